@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+'''
+Benchmark the ASCII light-curve writer against the original row by row
+writer. Run from the project directory:
+
+    python benchmarks/bench_ascii.py [nbins] [ndets]
+'''
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.fitsUtil.ascii import createASCII, createASCIIMulti
+
+def legacyASCII(t, exp, counts, detector, tzero, name, delim = ','):
+    ''' The V 0.1 writer: one fo.write per row '''
+    r = counts.sum(1)/exp
+    rErr = np.sqrt(counts.sum(1))/exp
+    fo = open(name, 'w')
+    fo.write("%s%s %s%s %s%s %s%s\n"%('T_i',delim, 'T_j',delim, 'Rate (Counts/s)',delim, 'Rate Err (Counts/s)',delim,))
+    for i in range(r.size):
+        fo.write("%s%s %s%s %s%s %s%s\n" %(t[0][i],delim,  t[1][i],delim, r[i],delim, rErr[i],delim))
+    fo.close()
+
+def timeit(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - t0
+
+def main(nbins = 86400, ndets = 14):
+    rng = np.random.default_rng(0)
+    ti = np.arange(nbins) * 1.024
+    t = (ti, ti + 1.024)
+    exp = np.full(nbins, 1.024)
+    counts = [rng.poisson(100, (nbins, 8)) for _ in range(ndets)]
+    dets = ['n%i' %i for i in range(ndets)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old = os.path.join(tmp, 'old.txt')
+        new = os.path.join(tmp, 'new.txt')
+        tOld = sum(timeit(legacyASCII, t, exp, c, d, 0, old) for c, d in zip(counts, dets))
+        tNew = sum(timeit(createASCII, t, exp, c, d, 0, new) for c, d in zip(counts, dets))
+        same = open(old).read() == open(new).read()
+        tFmt = sum(timeit(createASCII, t, exp, c, d, 0, new, fmt = '%.6e') for c, d in zip(counts, dets))
+        tWide = timeit(createASCIIMulti, t, [exp] * ndets, counts, dets, new, fmt = '%.6e')
+
+    print('%i bins x %i detectors' %(nbins, ndets))
+    print('  legacy per-row writer  : %.3f s' %tOld)
+    print('  buffered writer (%%s)   : %.3f s  (x%.1f, identical output: %s)' %(tNew, tOld/tNew, same))
+    print('  buffered writer (%%.6e) : %.3f s' %tFmt)
+    print('  single wide table      : %.3f s' %tWide)
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
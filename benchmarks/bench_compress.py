@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+'''
+Benchmark PHAII output size & write throughput with and without gzip
+compression, serially and from a thread pool. Run from the project directory:
+
+    python benchmarks/bench_compress.py [ndets] [nbins]
+
+The default is a day of CSPEC (4.096 s bins, 128 channels) for 14 detectors.
+'''
+
+import os
+import sys
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.fitsUtil import createPHAII
+
+DETS = ['n0', 'n1', 'n2', 'n3', 'n4', 'n5', 'n6', 'n7', 'n8', 'n9', 'na', 'nb', 'b0', 'b1']
+
+def makeProducts(ndets, nbins, nchan = 128):
+    rng = np.random.default_rng(0)
+    ti = np.arange(nbins) * 4.096
+    t = (ti, ti + 4.096)
+    exp = np.full(nbins, 4.096)
+    edges = (np.arange(nchan) * 10. + 4., np.arange(nchan) * 10. + 14.)
+    rate = rng.uniform(1, 20, nchan)
+    return [(t, exp, rng.poisson(rate * 4.096, (nbins, nchan)), det, edges)
+            for det in DETS[:ndets]]
+
+def writeAll(products, outDir, compress, workers):
+    def write(p):
+        t, exp, counts, det, edges = p
+        name = os.path.join(outDir, 'glg_bench_%s.pha' %det)
+        return createPHAII(t, exp, counts, det, 0., name, edges = edges, compress = compress)
+    t0 = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            names = list(executor.map(write, products))
+    else:
+        names = [write(p) for p in products]
+    dt = time.perf_counter() - t0
+    return dt, sum(os.path.getsize(n) for n in names)
+
+def main(ndets = 14, nbins = 21094):
+    products = makeProducts(ndets, nbins)
+    print('%i detectors x %i bins x 128 channels' %(ndets, nbins))
+    print('%-22s %10s %12s %10s' %('mode', 'time (s)', 'size (MB)', 'files/s'))
+    for label, compress, workers in [('uncompressed', None, 1),
+                                     ('gzip, serial', 'gzip', 1),
+                                     ('gzip, 4 threads', 'gzip', 4),
+                                     ('gzip, 8 threads', 'gzip', 8)]:
+        with tempfile.TemporaryDirectory() as tmp:
+            dt, size = writeAll(products, tmp, compress, workers)
+        print('%-22s %10.2f %12.1f %10.1f' %(label, dt, size / 1e6, ndets / dt))
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
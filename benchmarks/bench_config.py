@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+'''
+Benchmark the options set up done for each trigger of a scripted loop:
+the command line parser & an OSV_Args, plus the plot & lookup configs of a
+GUI instance. Each is timed with the config files parsed once per process
+(the default) & parsed again every time (as before the cache). Run from
+the project directory:
+
+    python benchmarks/bench_config.py [triggers]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lib.dep_ver_checker as setup
+from lib import options
+from lib.config.plotConfig import getPltCfg
+from lib.config.lookupConfig import getLUCfg
+
+def perTrigger(n):
+    t0 = time.perf_counter()
+    for i in range(n):
+        opts = options.cmdLineOptions(['600004800', '--dets', '0', '1'])
+        opts.check()
+        getPltCfg()
+        getLUCfg()
+    return (time.perf_counter() - t0) / n * 1e3
+
+def main(n = 1000):
+    cached = perTrigger(n)
+    loadConfig = setup.loadConfig
+    # Every call a cache miss, as without the cache
+    setup.loadConfig = lambda path, spec, reload = False: loadConfig(path, spec, reload = True)
+    try:
+        uncached = perTrigger(n)
+    finally:
+        setup.loadConfig = loadConfig
+    print('%i triggers, ms per trigger: parsed every time %.2f, cached %.2f (%.1fx)'
+          %(n, uncached, cached, uncached / cached))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
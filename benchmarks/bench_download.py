@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+'''
+Benchmark the daily downloader against the local FTP(S) stand-in under the
+faults of the real server: added latency, a limited per transfer rate,
+temporary errors, dropped transfers and a limit on sessions. Each scenario
+syncs the same synthetic days with sync_range into an empty directory,
+checks every file arrived intact, and reports files/s, MB/s, retries (RETR
+commands beyond one per file), logins and the peak & final number of
+parallel downloads chosen by the scheduler. The TLS scenario needs the
+openssl command for its certificate. Run from the project directory:
+
+    python benchmarks/bench_download.py [ndays] [nkb] [parallel]
+
+ftp.py's generated script can't be run this way as it starts osv.py.
+'''
+
+import os
+import sys
+import time
+import ftplib
+import filecmp
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.ftp.downloadDaily import DataDownloader, FTPPool, TransferScheduler, sync_range, date_range
+from ftpstandin import FTPStandIn, makeDailyTree, selfSignedCert, clientContext, dayDir
+
+FROM = '220315'
+
+def scenarios(nfiles, nbytes, parallel, certfile):
+    ''' (label, stand-in settings) of each scenario '''
+    cases = [('clean', {}),
+             ('latency 20 ms', {'latency': 0.02, 'login_delay': 0.1}),
+             ('rate 2 MB/s per transfer', {'rate': 2e6}),
+             ('temp errors 10%', {'temp_errors': max(1, nfiles // 10)}),
+             ('drops 10%', {'drops': max(1, nfiles // 10), 'drop_after': nbytes // 2}),
+             ('max %i sessions' %(parallel - 1), {'max_sessions': parallel - 1})]
+    if certfile:
+        cases.append(('TLS, 100 ms login', {'certfile': certfile, 'login_delay': 0.1}))
+    return cases
+
+def run(served, out, days, names, settings, parallel):
+    certfile = settings.get('certfile')
+    with FTPStandIn(served, **settings) as server:
+        if certfile:
+            pool = FTPPool(server.host, size = parallel, port = server.port, ftp_class = ftplib.FTP_TLS,
+                           context = clientContext(certfile))
+        else:
+            pool = FTPPool(server.host, size = parallel, port = server.port, ftp_class = ftplib.FTP)
+        scheduler = TransferScheduler(max_workers = parallel)
+        with pool:
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                downloaded, skipped, failed = sync_range(days[0], days[-1], ['ctime', 'cspec', 'poshist'],
+                                                         output_dir = out, max_workers = parallel,
+                                                         pool = pool, scheduler = scheduler)
+            dt = time.perf_counter() - t0
+        intact = all(filecmp.cmp(os.path.join(dayDir(served, day), n), os.path.join(out, day, n),
+                                 shallow = False)
+                     for day in days for n in names[day] if n in downloaded)
+        return {'time': dt, 'files': len(downloaded), 'failed': len(failed), 'intact': intact,
+                'bytes': server.bytesSent, 'retries': server.commands.get('RETR', 0) - len(downloaded),
+                'logins': server.logins, 'refused': server.refused, 'peak': scheduler.peak,
+                'final': scheduler.limit}
+
+def main(ndays = 2, nkb = 256, parallel = 4):
+    days = date_range(FROM, '%s%02i' %(FROM[:4], int(FROM[4:]) + ndays - 1))
+    nbytes = nkb * 1024
+    DataDownloader.RETRY_DELAY = 0.05
+    with tempfile.TemporaryDirectory() as tmp:
+        served = os.path.join(tmp, 'server')
+        names = makeDailyTree(served, days, size = nbytes)
+        nfiles = sum(len(n) for n in names.values())
+        certfile = selfSignedCert(tmp)
+        print('%i days, %i files of %i kB, up to %i parallel%s'
+              %(ndays, nfiles, nkb, parallel, '' if certfile else ' (no openssl, TLS skipped)'))
+        print('%-26s %8s %8s %8s %8s %7s %7s %5s %5s %7s'
+              %('scenario', 'time (s)', 'files/s', 'MB/s', 'retries', 'logins', 'failed', 'peak', 'final',
+                'intact'))
+        for i, (label, settings) in enumerate(scenarios(nfiles, nbytes, parallel, certfile)):
+            r = run(served, os.path.join(tmp, 'out%i' %i), days, names, settings, parallel)
+            print('%-26s %8.2f %8.1f %8.2f %8i %7i %7i %5i %5i %7s'
+                  %(label, r['time'], r['files'] / r['time'], nfiles * nbytes / 1e6 / r['time'], r['retries'],
+                    r['logins'], r['failed'], r['peak'], r['final'], r['intact']))
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:4]])
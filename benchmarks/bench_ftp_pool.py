@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''
+Benchmark daily file downloads over a pool of persistent connections
+against the original one connection per file, using the local FTP stand-in.
+login_delay mimics the TLS handshake & login of the real server. Run from
+the project directory:
+
+    python benchmarks/bench_ftp_pool.py [nkb] [login_delay_ms]
+'''
+
+import os
+import sys
+import time
+import ftplib
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.ftp.downloadDaily import DataDownloader, FTPPool, Manifest
+from ftpstandin import FTPStandIn, makeDailyTree
+
+DATE = '220315'
+
+def legacyDownload(server, ftp_dir, out, filename):
+    ''' The original download_file: a new connection & login for every file '''
+    with ftplib.FTP() as ftp:
+        ftp.connect(server.host, server.port)
+        ftp.login()
+        ftp.cwd(ftp_dir)
+        with open(os.path.join(out, filename), 'wb') as f:
+            ftp.retrbinary(f'RETR {filename}', f.write)
+    return True
+
+def main(nkb = 256, login_delay_ms = 200):
+    with tempfile.TemporaryDirectory() as tmp:
+        served = os.path.join(tmp, 'server')
+        names = makeDailyTree(served, [DATE], size = nkb * 1024)[DATE]
+        with FTPStandIn(served, login_delay = login_delay_ms / 1e3) as server:
+            results = []
+            out = os.path.join(tmp, 'legacy')
+            os.makedirs(out)
+            downloader = DataDownloader(DATE, out)
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers = 3) as executor:
+                list(executor.map(lambda n: legacyDownload(server, downloader.ftp_dir, out, n), names))
+            results.append(('new connection per file', time.perf_counter() - t0, server.logins))
+
+            out = os.path.join(tmp, 'pooled')
+            logins = server.logins
+            with FTPPool(server.host, size = 3, port = server.port, ftp_class = ftplib.FTP) as pool:
+                downloader = DataDownloader(DATE, out, pool = pool)
+                t0 = time.perf_counter()
+                with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                    downloader.download_files(['ctime', 'cspec', 'poshist'])
+                results.append(('pool of 3 connections', time.perf_counter() - t0, server.logins - logins))
+            # The downloads are recorded in the manifest next to them
+            assert sorted(i for i in os.listdir(out) if i != Manifest.NAME) == sorted(names)
+
+    print('%i files of %i kB, %i ms login' %(len(names), nkb, login_delay_ms))
+    print('%-26s %10s %10s %8s' %('mode', 'time (s)', 'files/s', 'logins'))
+    for label, dt, nLogin in results:
+        print('%-26s %10.2f %10.1f %8i' %(label, dt, len(names) / dt, nLogin))
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
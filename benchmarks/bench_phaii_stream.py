@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+'''
+Check & time the streamed PHAII writer. Pha_data.write_phaii writes the
+same synthetic binned data with createPHAII & with PHAIIStream
+(chunkSize), and every header card (but DATE) & table cell of the .PHA &
+.BAK must be the same. The background is float, as calc_background makes
+it, and some bins are flagged in the quality. The time & peak memory
+(tracemalloc) of each path are reported. Run from the project directory:
+
+    python benchmarks/bench_phaii_stream.py [nbins] [nchan] [chunkSize]
+
+The exit status is 1 if the files differ.
+'''
+
+import os
+import sys
+import time
+import types
+import tempfile
+import tracemalloc
+
+import numpy as np
+import astropy.io.fits as pf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.orbsub_classes import Pha_data
+
+TZERO = 600004800.
+
+def makeData(nbins, nchan):
+    ''' A Pha_data with the attributes write_phaii uses, without reading files '''
+    rng = np.random.default_rng(0)
+    res = 4.096 if nchan == 128 else 1.024
+    ti = TZERO - nbins / 2 * res + np.arange(nbins) * res
+    exp = np.full(nbins, res * 0.99)
+    rate = rng.uniform(1, 20, nchan)
+    src = rng.poisson(rate * res, (nbins, nchan)).astype(float)
+    # Averages of the offset regions, so not whole counts
+    bkg = (rng.poisson(rate * res, (nbins, nchan)) + rng.poisson(rate * res, (nbins, nchan))) / 2.
+    bkg += rng.uniform(0, 1, (nbins, nchan))
+    quality = np.zeros(nbins)
+    quality[rng.choice(nbins, nbins // 20, replace = False)] = 1
+    det = Pha_data.__new__(Pha_data)
+    det.detector = 'n0'
+    det.data = {'src': [np.column_stack((ti, ti + res)), src, exp, np.sqrt(src)]}
+    det.background = {'all': bkg, 'allerr': np.sqrt(bkg)}
+    det.bkgExp = {'all': exp}
+    det.quality = quality
+    det.eEdgeMin = np.arange(nchan) * 10. + 4.
+    det.eEdgeMax = det.eEdgeMin + 10.
+    return det
+
+def write(det, opts, names, **kwargs):
+    ''' Write the files, returning (seconds, peak bytes allocated) '''
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    det.write_phaii(opts, names = list(names), **kwargs)
+    dt = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dt, peak
+
+def differences(a, b):
+    ''' Differences between the FITS files a & b, cell by cell '''
+    diffs = []
+    with pf.open(a) as fa, pf.open(b) as fb:
+        if len(fa) != len(fb):
+            return ['%i & %i HDUs' %(len(fa), len(fb))]
+        for i, (ha, hb) in enumerate(zip(fa, fb)):
+            cards = lambda h: [(c.keyword, c.value) for c in h.header.cards if c.keyword != 'DATE']
+            if cards(ha) != cards(hb):
+                diffs.append('HDU %i header: %s' %(i, set(cards(ha)) ^ set(cards(hb))))
+            if ha.data is None or hb.data is None:
+                if (ha.data is None) != (hb.data is None):
+                    diffs.append('HDU %i data missing' %i)
+                continue
+            for col in ha.columns.names:
+                x, y = ha.data[col], hb.data[col]
+                if x.shape != y.shape or not np.array_equal(x, y):
+                    n = np.sum(x != y) if x.shape == y.shape else 'all'
+                    diffs.append('HDU %i %s: %s cells differ' %(i, col, n))
+    return diffs
+
+def main(nbins = 21094, nchan = 128, chunkSize = 4096):
+    det = makeData(nbins, nchan)
+    opts = types.SimpleNamespace(coords = [120., -30.], tzero = TZERO, name = 'bench')
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        # The same names in two directories, as FILENAME is in the headers
+        table = [os.path.join(tmp, 'table', 'glg_osv_bench_n0.' + ext) for ext in ('PHA', 'BAK')]
+        stream = [os.path.join(tmp, 'stream', 'glg_osv_bench_n0.' + ext) for ext in ('PHA', 'BAK')]
+        os.makedirs(os.path.dirname(table[0]))
+        os.makedirs(os.path.dirname(stream[0]))
+        dtTable, peakTable = write(det, opts, table)
+        dtStream, peakStream = write(det, opts, stream, chunkSize = chunkSize)
+        print('%i bins x %i channels, chunks of %i' %(nbins, nchan, chunkSize))
+        print('createPHAII  %7.3f s  peak %7.1f MB' %(dtTable, peakTable / 1e6))
+        print('PHAIIStream  %7.3f s  peak %7.1f MB' %(dtStream, peakStream / 1e6))
+        for a, b in zip(table, stream):
+            diffs = differences(a, b)
+            print('%s: %s' %(os.path.splitext(a)[1], '; '.join(diffs) if diffs else 'same'))
+            failed |= bool(diffs)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(i) for i in sys.argv[1:]]))
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+'''
+Benchmark each stage of the orbital subtraction on generated data, to
+catch performance regressions. The stages are those of OrbSub, run
+directly on the orbsub_classes: finding the files, reading the poshist,
+calculate_angles, get_gti, get_steps & per detector reading the PHA
+files, bin_pha, calc_background, write_phaii & write_pha.
+
+The cases vary one thing at a time from a base case (CTIME, 4
+detectors, 600 s, offsets 15): the data type, the number of detectors
+(1-14, for CTIME & CSPEC), the length of tRange & the number of orbit
+offsets. Each case is run --repeat times & the fastest time of each stage
+kept. Run from the project directory:
+
+    python benchmarks/bench_pipeline.py --output bench.json
+    python benchmarks/bench_pipeline.py --baseline bench.json --threshold 0.2
+
+With --baseline the results are compared with an earlier output & any
+stage more than threshold (a fraction) & --min-diff seconds slower is
+reported as a regression, making the exit status 1. Baselines are only
+comparable on the same machine, so none is stored with the code.
+
+The fixtures are made with gbmsim.py in --fixtures (by default in the
+temporary directory, about 700 MB) the first time & reused after. CTIME
+is generated at 1.024 s, the resolution it is binned to, rather than
+0.256 s to keep them smaller.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+import gbmsim
+from lib import pipeline
+from lib.instrument import Instrument
+from lib.orbsub_classes import Regions, Files, Poshist_data, Pha_data
+
+FIXTURES = os.path.join(tempfile.gettempdir(), 'osv_bench_fixtures')
+# Bumped when the fixtures change, so old ones are made again
+FIXTURE_VERSION = 1
+RESOLUTION = {'ctime': 1.024, 'cspec': 4.096}
+SEED = 0
+
+TZERO = 600004800.         # 2020-01-06 12:00
+COORDS = [120., -30.]
+BASE = {'specType': 'CTIME', 'dets': 4, 'tRange': [-100., 500.], 'offsets': ['15']}
+DETS = [1, 2, 4, 8, 14]
+TRANGES = [[-50., 250.], [-100., 500.], [-500., 1500.], [-1000., 5000.]]
+OFFSETS = [['15'], ['15', '30'], ['14', '15', '16'], ['14', '15', '16', '29', '30', '31']]
+# Days around tzero read by the base case & by the largest offsets
+NEAR = ('2020-01-05', 3)
+FAR = ['2020-01-04', '2020-01-08']
+
+STAGES = ['files', 'poshist', 'calculate_angles', 'get_gti', 'get_steps',
+          'pha_load', 'bin_pha', 'calc_background', 'write_phaii', 'write_pha']
+
+
+def makeFixtures(root):
+    '''
+    Generate the fixtures in root unless they're there already: all the
+    detectors for the days the base case reads & the base detectors (CTIME)
+    for the days further out read by the larger offsets.
+    '''
+    stamp = os.path.join(root, 'fixtures.json')
+    params = {'version': FIXTURE_VERSION, 'resolution': RESOLUTION, 'seed': SEED}
+    try:
+        with open(stamp) as f:
+            if json.load(f) == params:
+                return
+    except (OSError, ValueError):
+        pass
+    print('Generating fixtures in %s' %root, flush = True)
+    t0 = time.perf_counter()
+    shutil.rmtree(root, ignore_errors = True)
+    burst = gbmsim.Burst(TZERO, ra = COORDS[0], dec = COORDS[1])
+    gbmsim.generate(root, NEAR[0], NEAR[1], resolution = RESOLUTION, burst = burst, seed = SEED)
+    for day in FAR:
+        gbmsim.generate(root, day, 1, dets = gbmsim.DETS[:BASE['dets']], types = ('ctime', 'poshist'),
+                        resolution = RESOLUTION, seed = SEED)
+    with open(stamp, 'w') as f:
+        json.dump(params, f)
+    print('Generated in %.1f s' %(time.perf_counter() - t0), flush = True)
+
+
+def cases():
+    ''' The cases, one change from BASE at a time, by name '''
+    configs = [dict(BASE, specType = spec, dets = n) for spec in ('CTIME', 'CSPEC') for n in DETS]
+    configs += [dict(BASE, tRange = tRange) for tRange in TRANGES]
+    configs += [dict(BASE, offsets = offsets) for offsets in OFFSETS]
+    named = {}
+    for cfg in configs:
+        name = '%s_%idet_%is_%ioff' %(cfg['specType'].lower(), cfg['dets'],
+                                       cfg['tRange'][1] - cfg['tRange'][0], len(cfg['offsets']))
+        named[name] = cfg
+    return named
+
+
+def runCase(cfg, dataDir, outDir):
+    ''' Run the stages once, returning the Instrument which timed them '''
+    opts = pipeline.optionsFromDict({'tzero': TZERO, 'tRange': cfg['tRange'], 'offsets': cfg['offsets'],
+                                     'dets': gbmsim.DETS[:cfg['dets']], 'specType': cfg['specType'],
+                                     'coords': COORDS, 'name': 'bench'}, dataDir)
+    opts.check()
+    inst = Instrument()
+    with inst.stage('files'):
+        regions = Regions(opts.tzero, opts.tRange[0], opts.tRange[1], opts.offset)
+        files = Files(opts.tzero, regions, opts.offset)
+        files.find_pha_files(opts.dets, spec_type = opts.spec_type, data_dir = opts.data_dir)
+        files.find_poshist_files(opts.data_dir)
+    if files.error:
+        raise RuntimeError('Missing fixtures for %s: %s' %(cfg, files.error))
+    with inst.stage('poshist') as rec:
+        inst.addReads(rec, files.pos_files)
+        pos = Poshist_data(files.pos_files)
+        inst.addArrays(rec, sc_time = pos.sc_time, sc_quat = pos.sc_quat)
+    with inst.stage('calculate_angles'):
+        pos.calculate_angles(regions, opts.coords[0], opts.coords[1])
+    with inst.stage('get_gti'):
+        pos.get_gti()
+    with inst.stage('get_steps'):
+        pos.get_steps(opts.coords[0], opts.coords[1])
+    for det in opts.dets:
+        stem = os.path.join(outDir, 'glg_osv_bench_%s.XX' %det)
+        with inst.stage('pha_load', det) as rec:
+            inst.addReads(rec, files.pha_files[det])
+            det_data = Pha_data(files.pha_files[det])
+            inst.addArrays(rec, counts = det_data.counts)
+        with inst.stage('bin_pha', det):
+            det_data.bin_pha(regions, opts.offset, opts)
+        with inst.stage('calc_background', det):
+            det_data.calc_background(opts.offset)
+        with inst.stage('write_phaii', det):
+            det_data.write_phaii(opts, names = [stem.replace('.XX', '.PHA'), stem.replace('.XX', '.BAK')])
+        with inst.stage('write_pha', det):
+            det_data.write_pha(opts, names = [stem.replace('.XX', '.PHA1'), stem.replace('.XX', '.BAK1')])
+    return inst
+
+
+def timeCase(cfg, dataDir, repeat):
+    ''' The fastest wall & CPU time of each stage (summed over detectors) over repeat runs '''
+    stages = {}
+    outDir = tempfile.mkdtemp(prefix = 'osv_bench_')
+    try:
+        for i in range(repeat):
+            totals = runCase(cfg, dataDir, outDir).totals()
+            for stage, tot in totals.items():
+                best = stages.setdefault(stage, dict(tot))
+                best['wall'] = min(best['wall'], tot['wall'])
+                best['cpu'] = min(best['cpu'], tot['cpu'])
+    finally:
+        shutil.rmtree(outDir, ignore_errors = True)
+    return {stage: stages[stage] for stage in STAGES if stage in stages}
+
+
+def meta(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                                cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.node(), 'platform': platform.platform(),
+            'repeat': args.repeat, 'fixtureVersion': FIXTURE_VERSION}
+
+
+def compare(results, baseline, threshold, minDiff):
+    '''
+    Compare the wall times of results with baseline. Returns the text of
+    the comparison & the list of (case, stage, old, new) regressions.
+    '''
+    lines, regressions = [], []
+    for name, case in results['cases'].items():
+        old = baseline['cases'].get(name)
+        if old is None:
+            lines.append('%-28s not in the baseline' %name)
+            continue
+        for stage, tot in case['stages'].items():
+            if stage not in old['stages']:
+                continue
+            before, after = old['stages'][stage]['wall'], tot['wall']
+            flag = ''
+            if after > before * (1 + threshold) and after - before > minDiff:
+                flag = '  REGRESSION'
+                regressions.append((name, stage, before, after))
+            elif before > after * (1 + threshold) and before - after > minDiff:
+                flag = '  faster'
+            ratio = after / before if before else float('inf')
+            lines.append('%-28s %-16s %9.4f %9.4f %6.2fx%s' %(name, stage, before, after, ratio, flag))
+    head = '%-28s %-16s %9s %9s %7s\n' %('case', 'stage', 'base (s)', 'now (s)', 'ratio')
+    return head + '\n'.join(lines) + '\n', regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the stages of the orbital subtraction')
+    parser.add_argument('--fixtures', help = 'Directory of the generated data [default: %s]' %FIXTURES,
+                        default = FIXTURES)
+    parser.add_argument('--output', help = 'Write the results to this JSON file')
+    parser.add_argument('--baseline', help = 'Compare with the results in this JSON file')
+    parser.add_argument('--threshold', help = 'Fraction slower which is a regression [default: 0.2]',
+                        type = float, default = 0.2)
+    parser.add_argument('--min-diff', help = 'Seconds slower below which nothing is a regression '
+                        '[default: 0.005]', type = float, default = 0.005)
+    parser.add_argument('--repeat', help = 'Runs of each case, the fastest is kept [default: 3]',
+                        type = int, default = 3)
+    parser.add_argument('--cases', help = 'Only run the cases matching this regular expression')
+    args = parser.parse_args(argv)
+
+    makeFixtures(args.fixtures)
+    results = {'meta': meta(args), 'cases': {}}
+    for name, cfg in cases().items():
+        if args.cases and not re.search(args.cases, name):
+            continue
+        stages = timeCase(cfg, args.fixtures, args.repeat)
+        results['cases'][name] = {'config': cfg, 'stages': stages,
+                                  'total': sum(i['wall'] for i in stages.values())}
+        print('%-28s %8.3f s  ' %(name, results['cases'][name]['total'])
+              + ' '.join('%s %.3f' %(stage, tot['wall']) for stage, tot in stages.items()), flush = True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+        print('Results written to %s' %args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        text, regressions = compare(results, baseline, args.threshold, args.min_diff)
+        print('\nCompared with %s (%s, %s)' %(args.baseline, baseline['meta'].get('time'),
+                                             baseline['meta'].get('commit')))
+        print(text)
+        if regressions:
+            print('%i regressions of more than %i%%' %(len(regressions), args.threshold * 100))
+            return 1
+        print('No regressions of more than %i%%' %(args.threshold * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+'''
+Check & time resumed downloads. The local FTP stand-in cuts each of the
+first transfers after a fraction of the file, so every file needs several
+attempts; the downloaded files must match the served ones byte for byte.
+Also checks a partial .tmp left by an earlier run is continued rather than
+fetched again, one larger than the file is discarded & one whose transfer
+ends short (with no error) on every attempt isn't renamed, & that a local
+write error (disk full) fails at once rather than being retried. Run from
+the project directory:
+
+    python benchmarks/bench_resume.py [nfiles] [nmb] [drop_percent]
+
+The exit status is 1 if any check fails.
+'''
+
+import os
+import sys
+import errno
+import time
+import ftplib
+import filecmp
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.ftp.downloadDaily import DataDownloader, FTPPool, TransferScheduler
+from ftpstandin import FTPStandIn, makeDailyTree, dayDir, DETS
+
+DATE = '220315'
+
+FAILED = []
+
+def check(ok, what):
+    ''' Print what & whether it held, recording it if not '''
+    print('  %-58s %s' %(what, 'ok' if ok else 'FAILED'))
+    if not ok:
+        FAILED.append(what)
+
+class DiskFull(TransferScheduler):
+    ''' A scheduler whose throttle, called as each block is written, fails
+    like a full disk '''
+    tempErrors = 0
+
+    def throttle(self, nbytes):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    def temp_error(self):
+        self.tempErrors += 1
+        super().temp_error()
+
+def main(nfiles = 4, nmb = 8, drop_percent = 40):
+    nbytes = nmb * 2**20
+    dropAfter = nbytes * drop_percent // 100
+    # Each file is cut on every attempt but the last of the 3 allowed
+    if drop_percent < 34:
+        sys.exit('drop_percent must be at least 34 for a file to come down in 3 attempts')
+    nDrops = nfiles * (-(-100 // drop_percent) - 1)
+    DataDownloader.RETRY_DELAY = 0
+    quiet = lambda: contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with tempfile.TemporaryDirectory() as tmp:
+        served = os.path.join(tmp, 'server')
+        names = makeDailyTree(served, [DATE], dets = DETS[:nfiles], types = ['cspec'], size = nbytes)[DATE]
+        day = dayDir(served, DATE)
+        out = os.path.join(tmp, 'out')
+        same = lambda name: (os.path.exists(os.path.join(out, name)) and
+                             filecmp.cmp(os.path.join(day, name), os.path.join(out, name), shallow = False))
+        with FTPStandIn(served, drop_after = dropAfter, drops = nDrops) as server:
+            with FTPPool(server.host, port = server.port, ftp_class = ftplib.FTP) as pool:
+                downloader = DataDownloader(DATE, out, pool = pool)
+                print('%i files of %i MB, transfers cut after %i%%' %(nfiles, nmb, drop_percent))
+                t0 = time.perf_counter()
+                with quiet():
+                    ok = [downloader.download_file(n) for n in names]
+                dt = time.perf_counter() - t0
+                ratio = server.bytesSent / (nfiles * nbytes)
+                print('  %.2f s, bytes sent %.2f x file size (%i RETR, %i cut)'
+                      %(dt, ratio, server.commands['RETR'], server.dropsSent))
+                check(all(ok), 'resumed downloads succeed')
+                check(all(same(n) for n in names), 'resumed files equal the served ones')
+                check(server.dropsSent == nDrops and abs(ratio - 1) < 0.01,
+                      'each byte is sent once, the cut transfers resumed')
+                if FAILED:
+                    print('%i checks failed' %len(FAILED))
+                    return 1
+
+                # A partial file from an earlier run is continued
+                name = names[0]
+                os.remove(os.path.join(out, name))
+                with open(os.path.join(day, name), 'rb') as f, \
+                     open(os.path.join(out, name + '.tmp'), 'wb') as fo:
+                    fo.write(f.read(nbytes // 2))
+                sent = server.bytesSent
+                with quiet():
+                    ok = downloader.download_file(name)
+                check(ok and same(name) and server.bytesSent - sent == nbytes - nbytes // 2,
+                      'a partial .tmp from an earlier run is continued')
+
+                # A .tmp larger than the served file can't be its start, so
+                # it's discarded & the file fetched whole
+                os.remove(os.path.join(out, name))
+                with open(os.path.join(out, name + '.tmp'), 'wb') as fo:
+                    fo.write(b'x' * (nbytes + 100))
+                sent = server.bytesSent
+                with quiet():
+                    ok = downloader.download_file(name)
+                check(ok and same(name) and server.bytesSent - sent == nbytes,
+                      'a .tmp larger than the file is discarded')
+
+                # Ended short on every attempt with a normal 226 reply, so only
+                # the size check can tell: the .tmp must not be renamed, & is
+                # kept for the next run
+                name = names[1]
+                os.remove(os.path.join(out, name))
+                server.shorts = 3
+                server.drop_after = nbytes // 10
+                with quiet():
+                    ok = downloader.download_file(name)
+                partial = os.path.join(out, name + '.tmp')
+                check(not ok and not os.path.exists(os.path.join(out, name)),
+                      'an incomplete file is not renamed')
+                check(os.path.exists(partial) and 0 < os.path.getsize(partial) < nbytes,
+                      'the incomplete .tmp is kept to resume')
+                with quiet():
+                    ok = downloader.download_file(name)
+                check(ok and same(name) and not os.path.exists(partial),
+                      'it is completed & renamed by the next run')
+
+                # A local write error isn't a connection error, so fails
+                # on the first attempt
+                full = DiskFull()
+                retr = server.commands['RETR']
+                with quiet():
+                    ok = DataDownloader(DATE, os.path.join(tmp, 'full'), pool = pool,
+                                        scheduler = full).download_file(names[0])
+                check(not ok and server.commands['RETR'] - retr == 1 and not full.tempErrors,
+                      'a full disk fails at once, without retrying')
+    if FAILED:
+        print('%i checks failed' %len(FAILED))
+        return 1
+    print('All checks passed')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(i) for i in sys.argv[1:4]]))
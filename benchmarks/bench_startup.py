@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+'''
+Benchmark the start up time of the osv.py commands. Each command is run
+several times in a fresh interpreter and the median wall time is reported,
+with the slowest imports from python -X importtime. The utility commands
+(ver, convert) should take under TARGET_MS. Run from the project directory:
+
+    python benchmarks/bench_startup.py [repeats] [results.json]
+
+The exit status is 1 if a utility command misses the target. With a JSON
+file name the results are also written there, to track them over time.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+OSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'osv.py')
+TARGET_MS = 100
+
+# (command line, is a utility command with the target)
+COMMANDS = [(['ver'], True),
+            (['convert', '2023-05-15 14:30'], True),
+            (['getconfig'], False),
+            (['getdata', '--help'], False),
+            (['run', '--help'], False)]
+
+def wallTime(args, repeats):
+    times = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, OSV] + args, stdout = subprocess.DEVNULL,
+                       stderr = subprocess.DEVNULL, check = True)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1e3
+
+def slowestImports(args, n = 3):
+    ''' The n top level imports with the largest cumulative time (ms) '''
+    out = subprocess.run([sys.executable, '-X', 'importtime', OSV] + args, stdout = subprocess.DEVNULL,
+                         stderr = subprocess.PIPE, text = True).stderr
+    imports = []
+    for line in out.splitlines():
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', line)
+        # Top level imports only, their time includes what they import
+        if m and len(m.group(2)) <= 1:
+            imports.append((int(m.group(1)) / 1e3, m.group(3)))
+    return sorted(imports, reverse = True)[:n]
+
+def main(repeats = 5, jsonFile = None):
+    t0 = time.perf_counter()
+    for i in range(repeats):
+        subprocess.run([sys.executable, '-c', 'pass'], check = True)
+    interpreter = (time.perf_counter() - t0) / repeats * 1e3
+    print('python start up: %.0f ms, target for utility commands: %i ms' %(interpreter, TARGET_MS))
+    print('%-32s %9s %6s  %s' %('command', 'time (ms)', 'target', 'slowest imports (ms)'))
+    results = {'interpreter_ms': interpreter, 'target_ms': TARGET_MS, 'commands': {}}
+    ok = True
+    for args, utility in COMMANDS:
+        ms = wallTime(args, repeats)
+        slow = slowestImports(args)
+        status = ('ok' if ms < TARGET_MS else 'MISS') if utility else '-'
+        ok &= status != 'MISS'
+        print('%-32s %9.0f %6s  %s' %(' '.join(args), ms, status, ', '.join('%s %.0f' %(m, t) for t, m in slow)))
+        results['commands'][' '.join(args)] = {'ms': ms, 'utility': utility,
+                                               'slowest': [[m, t] for t, m in slow]}
+    if jsonFile:
+        with open(jsonFile, 'w') as f:
+            json.dump(results, f, indent = 1)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5, *sys.argv[2:3]))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+'''
+Check & time the archive manifest. Syncs synthetic days from the local FTP
+stand-in, then damages some of the downloaded files (truncated, a flipped
+byte, removed, an interrupted .tmp, one with no manifest entry) and runs
+verify_archive, which must find them all and download them again. A local
+product with no date in its name must be left alone, not reported bad. The
+verify time of the intact archive is reported in MB/s. Run from the project
+directory:
+
+    python benchmarks/bench_verify.py [ndays] [nkb] [parallel]
+'''
+
+import os
+import sys
+import time
+import ftplib
+import filecmp
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.ftp.downloadDaily import DataDownloader, FTPPool, Manifest, sync_range, verify_archive, date_range
+from ftpstandin import FTPStandIn, makeDailyTree, dayDir
+
+FROM = '220315'
+LOCAL = 'glg_osv_bench_n0.pha'
+
+def damage(out, day, names):
+    ''' Damage a few files of day, returning {name: how} '''
+    d = os.path.join(out, day)
+    damaged = {}
+    with open(os.path.join(d, names[0]), 'r+b') as f:
+        f.truncate(os.path.getsize(f.name) // 3)
+    damaged[names[0]] = 'partial'
+    with open(os.path.join(d, names[1]), 'r+b') as f:
+        f.seek(100)
+        b = f.read(1)
+        f.seek(100)
+        f.write(bytes([b[0] ^ 1]))
+    damaged[names[1]] = 'checksum'
+    os.remove(os.path.join(d, names[2]))
+    damaged[names[2]] = 'missing'
+    os.replace(os.path.join(d, names[3]), os.path.join(d, names[3] + '.tmp'))
+    with open(os.path.join(d, names[3] + '.tmp'), 'r+b') as f:
+        f.truncate(1000)
+    damaged[names[3]] = 'interrupted'
+    manifest = Manifest(d)
+    manifest.remove(names[4])
+    with open(os.path.join(d, names[4]), 'ab') as f:
+        f.write(b'junk')
+    damaged[names[4]] = 'unrecorded, wrong size'
+    with open(os.path.join(d, LOCAL), 'wb') as f:
+        f.write(b'local product')
+    return damaged
+
+def main(ndays = 2, nkb = 1024, parallel = 4):
+    days = date_range(FROM, '%s%02i' %(FROM[:4], int(FROM[4:]) + ndays - 1))
+    DataDownloader.RETRY_DELAY = 0.05
+    with tempfile.TemporaryDirectory() as tmp:
+        served = os.path.join(tmp, 'server')
+        out = os.path.join(tmp, 'out')
+        names = makeDailyTree(served, days, size = nkb * 1024)
+        nfiles = sum(len(n) for n in names.values())
+        with FTPStandIn(served) as server, \
+             FTPPool(server.host, size = parallel, port = server.port, ftp_class = ftplib.FTP) as pool:
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                sync_range(days[0], days[-1], ['ctime', 'cspec', 'poshist'], output_dir = out,
+                           max_workers = parallel, pool = pool)
+                t0 = time.perf_counter()
+                ok, repaired, bad = verify_archive(out, max_workers = parallel, requeue = False)
+                dt = time.perf_counter() - t0
+            print('%i days, %i files of %i kB' %(ndays, nfiles, nkb))
+            print('  intact archive: %i ok, %i bad, verified in %.2f s (%.0f MB/s)'
+                  %(len(ok), len(bad), dt, nfiles * nkb / 1024 / dt))
+
+            damaged = damage(out, days[0], names[days[0]])
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                ok, _, bad = verify_archive(out, max_workers = parallel, requeue = False)
+            print('  damaged %s: %i reported bad' %(', '.join(damaged.values()), len(bad)))
+            retr = server.commands['RETR']
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                ok, repaired, bad = verify_archive(out, max_workers = parallel, pool = pool)
+            same = all(filecmp.cmp(os.path.join(dayDir(served, day), n), os.path.join(out, day, n),
+                                   shallow = False) for day in days for n in names[day])
+            print('  requeued: %i re-downloaded (%i RETR), %i still bad, all identical: %s'
+                  %(len(repaired), server.commands['RETR'] - retr, len(bad), same))
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                ok, repaired, bad = verify_archive(out, max_workers = parallel, requeue = False)
+            print('  verify again: %i ok, %i bad' %(len(ok), len(bad)))
+            local = os.path.join(out, days[0], LOCAL)
+            print('  undated %s: reported bad %s, left alone %s'
+                  %(LOCAL, LOCAL in bad, os.path.exists(local) and open(local, 'rb').read() == b'local product'))
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:4]])
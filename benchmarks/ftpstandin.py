@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+'''
+A small local FTP(S) server standing in for the HEASARC daily data server so
+the downloader can be exercised & timed offline. It serves a directory tree
+read only and understands the commands ftplib uses for listing & retrieving
+files. makeDailyTree() fills a directory with synthetic daily files laid out
+as fermi/data/gbm/daily/YYYY/MM/DD/current.
+
+Faults & costs of the real server can be injected:
+    login_delay  seconds added to each login, e.g. for the TLS handshake
+    latency      seconds added to every command
+    rate         bytes/s of each transfer (None for no limit)
+    temp_errors  number of RETRs answered with 450 (ftplib.error_temp)
+    drops        number of transfers cut after drop_after bytes by closing
+                 the data & control connections
+    shorts       number of transfers ended after drop_after bytes with a
+                 normal 226 reply, so only the size shows they're short
+    max_sessions logins beyond this many at once get 421 (too many users)
+
+With certfile (see selfSignedCert) it also answers AUTH TLS & PROT P; use
+ftplib.FTP_TLS with clientContext(certfile). Without it use
+ftp_class = ftplib.FTP.
+
+    with FTPStandIn(root, login_delay = 0.2) as server:
+        pool = FTPPool(server.host, port = server.port, ftp_class = ftplib.FTP)
+'''
+
+import os
+import ssl
+import time
+import fnmatch
+import socket
+import threading
+import subprocess
+import socketserver
+import posixpath
+
+DETS = ['n0', 'n1', 'n2', 'n3', 'n4', 'n5', 'n6', 'n7', 'n8', 'n9', 'na', 'nb', 'b0', 'b1']
+
+
+def dayDir(root, day):
+    ''' Server directory of day (YYMMDD) under root '''
+    return os.path.join(root, 'fermi/data/gbm/daily/20%s/%s/%s/current' %(day[:2], day[2:4], day[4:]))
+
+
+def makeDailyTree(root, days, dets = DETS, types = ('ctime', 'cspec', 'poshist'), size = 2**16):
+    '''
+    Fill root with synthetic files for each day (YYMMDD): one per detector
+    for ctime & cspec and one poshist file. size is the size of each file in
+    bytes, or a dict of sizes by type. Returns a dict of the names by day.
+    '''
+    names = {}
+    for day in days:
+        directory = dayDir(root, day)
+        os.makedirs(directory, exist_ok = True)
+        names[day] = []
+        for dtype in types:
+            if dtype == 'poshist':
+                files = ['glg_poshist_all_%s_v00.fit' %day]
+            else:
+                files = ['glg_%s_%s_%s_v00.pha' %(dtype, det, day) for det in dets]
+            nbytes = size[dtype] if isinstance(size, dict) else size
+            for name in files:
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(os.urandom(nbytes))
+            names[day] += files
+    return names
+
+
+def selfSignedCert(directory):
+    '''
+    Make a self signed certificate for 127.0.0.1 with the openssl command.
+    Returns the path of a PEM file holding the key & certificate, or None
+    if openssl is not available.
+    '''
+    path = os.path.join(directory, 'standin.pem')
+    try:
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                        '-keyout', path, '-out', path], check = True, capture_output = True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return path
+
+
+def clientContext(certfile):
+    ''' TLS context for ftplib.FTP_TLS which trusts the stand-in '''
+    return ssl.create_default_context(cafile = certfile)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(('%s\r\n' %line).encode('latin-1'))
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server.standin
+        self.cwd = '/'
+        self.rest = 0
+        self.pasv = None
+        self.protP = False
+        self.loggedIn = False
+        self.reply('220 OSV stand-in ready')
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                line = line.decode('latin-1').rstrip('\r\n')
+                cmd, _, arg = line.partition(' ')
+                cmd = cmd.upper()
+                if server.latency:
+                    time.sleep(server.latency)
+                method = getattr(self, 'ftp_' + cmd, None)
+                if method is None:
+                    self.reply('502 Command not implemented')
+                    continue
+                with server.lock:
+                    server.commands[cmd] = server.commands.get(cmd, 0) + 1
+                if method(arg) is False:
+                    break
+        except OSError:
+            # Client went away or the TLS handshake failed
+            pass
+        finally:
+            if self.pasv is not None:
+                self.pasv.close()
+            if self.loggedIn:
+                with server.lock:
+                    server.sessions -= 1
+
+    def localPath(self, path):
+        path = posixpath.normpath(posixpath.join(self.cwd, path))
+        return path, os.path.join(self.server.standin.root, path.lstrip('/'))
+
+    def dataConnection(self):
+        if self.pasv is None:
+            self.reply('425 Use PASV first')
+            return None
+        self.pasv.settimeout(10)
+        conn, _ = self.pasv.accept()
+        self.pasv.close()
+        self.pasv = None
+        return conn
+
+    def openData(self, message):
+        ''' Accept the data connection, wrapped in TLS after PROT P '''
+        conn = self.dataConnection()
+        if conn is None:
+            return None
+        self.reply('150 %s' %message)
+        if self.protP:
+            conn = self.server.standin.context.wrap_socket(conn, server_side = True)
+        return conn
+
+    def closeData(self, conn):
+        if isinstance(conn, ssl.SSLSocket):
+            try:
+                conn = conn.unwrap()
+            except OSError:
+                pass
+        conn.close()
+
+    def ftp_AUTH(self, arg):
+        context = self.server.standin.context
+        if context is None or arg.upper() not in ('TLS', 'SSL'):
+            self.reply('504 AUTH type not supported')
+            return
+        self.reply('234 Proceed with negotiation')
+        self.connection = context.wrap_socket(self.connection, server_side = True)
+        self.rfile = self.connection.makefile('rb')
+        self.wfile = self.connection.makefile('wb')
+
+    def ftp_USER(self, arg):
+        self.reply('331 Send password')
+
+    def ftp_PASS(self, arg):
+        server = self.server.standin
+        if server.login_delay:
+            time.sleep(server.login_delay)
+        with server.lock:
+            refused = server.max_sessions and server.sessions >= server.max_sessions
+            if refused:
+                server.refused += 1
+            else:
+                server.sessions += 1
+                server.logins += 1
+        if refused:
+            self.reply('421 Too many users, try again later')
+            return False
+        self.loggedIn = True
+        self.reply('230 Logged in')
+
+    def ftp_QUIT(self, arg):
+        self.reply('221 Bye')
+        return False
+
+    def ftp_NOOP(self, arg):
+        self.reply('200 OK')
+
+    def ftp_TYPE(self, arg):
+        self.reply('200 Type set')
+
+    def ftp_PBSZ(self, arg):
+        self.reply('200 OK')
+
+    def ftp_PROT(self, arg):
+        self.protP = arg.upper() == 'P' and self.server.standin.context is not None
+        self.reply('200 OK')
+
+    def ftp_OPTS(self, arg):
+        self.reply('200 OK')
+
+    def ftp_PWD(self, arg):
+        self.reply('257 "%s"' %self.cwd)
+
+    def ftp_CWD(self, arg):
+        path, local = self.localPath(arg)
+        if not os.path.isdir(local):
+            self.reply('550 %s: No such directory' %arg)
+            return
+        self.cwd = path
+        self.reply('250 OK')
+
+    def ftp_SIZE(self, arg):
+        _, local = self.localPath(arg)
+        if not os.path.isfile(local):
+            self.reply('550 %s: No such file' %arg)
+            return
+        self.reply('213 %i' %os.path.getsize(local))
+
+    def ftp_PASV(self, arg):
+        if self.pasv is not None:
+            self.pasv.close()
+        self.pasv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.pasv.bind((self.server.standin.host, 0))
+        self.pasv.listen(1)
+        host, port = self.pasv.getsockname()
+        self.reply('227 Entering Passive Mode (%s,%i,%i)' %(host.replace('.', ','), port >> 8, port & 255))
+
+    def ftp_EPSV(self, arg):
+        self.ftp_PASV(arg)
+
+    def ftp_REST(self, arg):
+        self.rest = int(arg)
+        self.reply('350 Restarting at %i' %self.rest)
+
+    def ftp_NLST(self, arg):
+        pattern = arg or '*'
+        directory, pattern = posixpath.split(pattern)
+        _, local = self.localPath(directory)
+        if not os.path.isdir(local):
+            self.reply('550 %s: No such directory' %arg)
+            return
+        names = sorted(fnmatch.filter(os.listdir(local), pattern))
+        conn = self.openData('Here comes the listing')
+        if conn is None:
+            return
+        conn.sendall(''.join('%s\r\n' %n for n in names).encode('latin-1'))
+        self.closeData(conn)
+        self.reply('226 Transfer complete')
+
+    def ftp_MLSD(self, arg):
+        _, local = self.localPath(arg)
+        if not os.path.isdir(local):
+            self.reply('550 %s: No such directory' %arg)
+            return
+        lines = []
+        for name in sorted(os.listdir(local)):
+            path = os.path.join(local, name)
+            if os.path.isdir(path):
+                lines.append('type=dir; %s' %name)
+            else:
+                lines.append('type=file;size=%i; %s' %(os.path.getsize(path), name))
+        conn = self.openData('Here comes the listing')
+        if conn is None:
+            return
+        conn.sendall(''.join('%s\r\n' %l for l in lines).encode('latin-1'))
+        self.closeData(conn)
+        self.reply('226 Transfer complete')
+
+    def ftp_RETR(self, arg):
+        server = self.server.standin
+        _, local = self.localPath(arg)
+        rest, self.rest = self.rest, 0
+        if not os.path.isfile(local):
+            self.reply('550 %s: No such file' %arg)
+            return
+        with server.lock:
+            fail = server.temp_errors > 0
+            if fail:
+                server.temp_errors -= 1
+                server.tempErrorsSent += 1
+        if fail:
+            if self.pasv is not None:
+                self.pasv.close()
+                self.pasv = None
+            self.reply('450 %s: Temporarily unavailable' %arg)
+            return
+        conn = self.openData('Opening data connection')
+        if conn is None:
+            return
+        with server.lock:
+            limit = None
+            short = server.shorts > 0
+            if short:
+                server.shorts -= 1
+                server.shortsSent += 1
+                limit = server.drop_after
+            elif server.drops:
+                server.drops -= 1
+                server.dropsSent += 1
+                limit = server.drop_after
+        t0 = time.monotonic()
+        sent = 0
+        with open(local, 'rb') as f:
+            f.seek(rest)
+            while True:
+                block = f.read(65536 if limit is None else min(65536, limit))
+                if not block:
+                    break
+                conn.sendall(block)
+                sent += len(block)
+                with server.lock:
+                    server.bytesSent += len(block)
+                if server.rate:
+                    delay = t0 + sent / server.rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if limit is not None:
+                    limit -= len(block)
+                    if not limit and short:
+                        break
+                    if not limit:
+                        conn.close()
+                        return False
+        self.closeData(conn)
+        self.reply('226 Transfer complete')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FTPStandIn:
+    '''
+    Serve root on host:port (a free port if 0) from a background thread.
+    logins, refused (421 replies), tempErrorsSent, dropsSent, shortsSent, commands
+    (a count per command) & bytesSent are kept for checks. The fault
+    settings are plain attributes and can be changed while serving.
+    '''
+    def __init__(self, root, host = '127.0.0.1', port = 0, login_delay = 0., latency = 0.,
+                 drop_after = 0, drops = 0, shorts = 0, temp_errors = 0, max_sessions = 0,
+                 rate = None, certfile = None):
+        self.root = os.path.abspath(root)
+        self.login_delay = login_delay
+        self.latency = latency
+        self.drop_after = drop_after
+        self.drops = drops
+        self.shorts = shorts
+        self.temp_errors = temp_errors
+        self.max_sessions = max_sessions
+        self.rate = rate
+        self.context = None
+        if certfile:
+            self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.context.load_cert_chain(certfile)
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.sessions = 0
+        self.refused = 0
+        self.tempErrorsSent = 0
+        self.dropsSent = 0
+        self.shortsSent = 0
+        self.commands = {}
+        self.bytesSent = 0
+        self.server = _Server((host, port), _Handler)
+        self.server.standin = self
+        self.host, self.port = self.server.server_address
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
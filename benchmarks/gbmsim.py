@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+'''
+Synthetic GBM daily data, so the orbital subtraction can be tested & timed
+offline. Writes, under root/YYMMDD/ as the data directory is laid out,
+
+    glg_ctime_nX_YYMMDD_v00.pha     8 channel PHAII, one per detector
+    glg_cspec_nX_YYMMDD_v00.pha     128 channel PHAII
+    glg_poshist_all_YYMMDD_v00.fit  position & attitude each second
+
+read by util.read_pha & util.read_poshist like the real files. Everything
+follows one Orbit: a circular orbit whose radius gives the period (so the
+period recalculation finds it), the node precessing & the Earth turning
+under it, with the spacecraft z axis at the zenith rocked north & south on
+alternate orbits. The detectors are off in the SAA (an ellipse in
+longitude & latitude), which leaves gaps in the PHA data & the GTI; bins
+next to the SAA & a random fraction of others get QUALITY 1. The
+background of each detector varies over the orbit & decays after each SAA
+passage, with a power law spectrum, and a burst (Burst) can be added,
+seen by each detector according to its angle to the source.
+
+    days = generate('data', '2020-01-04', days = 3, dets = ['n0', 'n1'], types = ('ctime',),
+                    burst = Burst(600004800., amplitude = 2000.))
+    python benchmarks/gbmsim.py data 2020-01-04 --days 3 --dets n0 n1 --burst 600004800
+
+The output depends only on the arguments & seed.
+'''
+
+import os
+import sys
+import math
+import argparse
+import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lib.util.util as util
+from lib.util.timeConv import date_to_met
+from lib.fitsUtil import PHAIIStream
+from astropy.io import fits as pf
+
+DETS = ['n0', 'n1', 'n2', 'n3', 'n4', 'n5', 'n6', 'n7', 'n8', 'n9', 'na', 'nb', 'b0', 'b1']
+TYPES = ('ctime', 'cspec', 'poshist')
+# Seconds per bin of the real files
+RESOLUTION = {'ctime': 0.256, 'cspec': 4.096}
+NCHAN = {'ctime': 8, 'cspec': 128}
+# Energy range (keV) of the channels
+ERANGE = {'n': (4.5, 2000.), 'b': (150., 40000.)}
+
+GM = 3.986004418e14         # m^3 s^-2
+EARTH_RATE = 7.2921159e-5   # rad/s
+GMST0 = math.radians(100.2) # Greenwich sidereal angle at MET 0
+DEADTIME = 2.6e-6           # s per count
+DAY = 86400.
+
+
+class Orbit:
+    '''
+    Position & attitude of the spacecraft. period in s, angles in degrees,
+    precession of the node in degrees per day. saa is (lon, lat, half width
+    in lon, half width in lat) of the SAA ellipse.
+    '''
+    def __init__(self, period = 5737.7, inclination = 25.6, node = 0., phase = 0., precession = -5.2,
+                 rock = 50., saa = (-40., -15., 45., 15.)):
+        self.period = period
+        self.inclination = math.radians(inclination)
+        self.node = math.radians(node)
+        self.phase = math.radians(phase)
+        self.precession = math.radians(precession) / DAY
+        self.rock = math.radians(rock)
+        self.saa = saa
+        self.radius = (GM * period**2 / (4 * math.pi**2))**(1 / 3.)
+
+    def _frame(self, t):
+        ''' Unit vectors of position, velocity & orbit normal (n x 3 each) '''
+        t = np.asarray(t, float)
+        u = 2 * np.pi * t / self.period + self.phase
+        node = self.node + self.precession * t
+        ci, si = math.cos(self.inclination), math.sin(self.inclination)
+        cn, sn = np.cos(node), np.sin(node)
+        # In plane axes: towards the ascending node & 90 degrees on
+        p = np.stack([cn, sn, np.zeros_like(t)], axis = 1)
+        q = np.stack([-sn * ci, cn * ci, np.full_like(t, si)], axis = 1)
+        cu, su = np.cos(u)[:,None], np.sin(u)[:,None]
+        r = cu * p + su * q
+        v = -su * p + cu * q
+        return r, v, np.cross(r, v)
+
+    def position(self, t):
+        ''' J2000 position (m) '''
+        return self._frame(t)[0] * self.radius
+
+    def geographic(self, t):
+        ''' Longitude (0 - 360) & latitude in degrees '''
+        r = self._frame(t)[0]
+        lat = np.degrees(np.arcsin(r[:,2]))
+        lon = np.degrees(np.arctan2(r[:,1], r[:,0]) - GMST0 - EARTH_RATE * np.asarray(t, float))
+        return np.mod(lon, 360.), lat
+
+    def inSAA(self, t):
+        lon, lat = self.geographic(t)
+        lonC, latC, dLon, dLat = self.saa
+        dl = (lon - lonC + 180.) % 360. - 180.
+        return (dl / dLon)**2 + ((lat - latC) / dLat)**2 < 1.
+
+    def quaternions(self, t):
+        '''
+        Attitude quaternions (QSJ_1-4, scalar last) as util.calc_angles
+        reads them: z at the zenith rocked towards the orbit normal, north
+        & south on alternate orbits, x towards the velocity.
+        '''
+        r, v, n = self._frame(t)
+        rock = self.rock * np.tanh(5 * np.cos(np.pi * np.asarray(t, float) / self.period))[:,None]
+        z = np.cos(rock) * r + np.sin(rock) * n
+        y = np.cross(z, v)
+        y /= np.linalg.norm(y, axis = 1)[:,None]
+        x = np.cross(y, z)
+        return matrixToQuaternion(np.stack([x, y, z], axis = 1))
+
+
+def matrixToQuaternion(m):
+    '''
+    Quaternions (n x 4, scalar last) of attitude matrices (n x 3 x 3) whose
+    rows are the spacecraft axes in J2000, as in util.calc_angles.
+    '''
+    tr = m[:,0,0] + m[:,1,1] + m[:,2,2]
+    # The largest component is found first for accuracy (Shepperd)
+    cand = np.stack([1 + 2 * m[:,0,0] - tr, 1 + 2 * m[:,1,1] - tr, 1 + 2 * m[:,2,2] - tr, 1 + tr], axis = 1)
+    big = np.argmax(cand, axis = 1)
+    q = np.empty((len(m), 4))
+    for k in range(4):
+        i = big == k
+        a = m[i]
+        s = 2 * np.sqrt(cand[i, k])
+        if k == 0:
+            q[i] = np.stack([s / 4, (a[:,0,1] + a[:,1,0]) / s, (a[:,0,2] + a[:,2,0]) / s,
+                             (a[:,1,2] - a[:,2,1]) / s], axis = 1)
+        elif k == 1:
+            q[i] = np.stack([(a[:,0,1] + a[:,1,0]) / s, s / 4, (a[:,1,2] + a[:,2,1]) / s,
+                             (a[:,2,0] - a[:,0,2]) / s], axis = 1)
+        elif k == 2:
+            q[i] = np.stack([(a[:,0,2] + a[:,2,0]) / s, (a[:,1,2] + a[:,2,1]) / s, s / 4,
+                             (a[:,0,1] - a[:,1,0]) / s], axis = 1)
+        else:
+            q[i] = np.stack([(a[:,1,2] - a[:,2,1]) / s, (a[:,2,0] - a[:,0,2]) / s,
+                             (a[:,0,1] - a[:,1,0]) / s, s / 4], axis = 1)
+    return q
+
+
+class Burst:
+    '''
+    A burst at MET time from (ra, dec): a pulse rising over rise & decaying
+    over decay seconds (Norris et al. 1996) peaking at amplitude counts/s in
+    a detector facing it, with a power law spectrum of index.
+    '''
+    def __init__(self, time, amplitude = 1000., rise = 1., decay = 10., index = -1., ra = 120., dec = -30.):
+        self.time = time
+        self.amplitude = amplitude
+        self.rise = rise
+        self.decay = decay
+        self.index = index
+        self.ra = ra
+        self.dec = dec
+
+    def rate(self, t):
+        ''' Counts/s of a detector facing the burst at t '''
+        dt = np.asarray(t, float) - self.time
+        rate = np.zeros_like(dt)
+        on = dt > 0
+        mu = math.sqrt(self.rise / self.decay)
+        rate[on] = self.amplitude * np.exp(2 * mu) * np.exp(-self.rise / dt[on] - dt[on] / self.decay)
+        return rate
+
+    def scales(self, orbit):
+        ''' Fraction of the rate seen by each detector, from its angle to the source '''
+        t = np.asarray([self.time])
+        angles = util.calc_angles(t, orbit.position(t), orbit.quaternions(t), self.ra, self.dec)[2][0]
+        scales = {}
+        for det, ang in zip(DETS, angles):
+            if ang >= 90:
+                scales[det] = 0.
+            else:
+                # The BGOs see the source over a wide range of angles
+                scales[det] = 0.5 if det[0] == 'b' else math.cos(math.radians(ang))
+        return scales
+
+
+def edges(det, dtype):
+    ''' Channel energy edges (keV), log spaced over the detector's range '''
+    e = np.geomspace(*ERANGE[det[0]], NCHAN[dtype] + 1)
+    return e[:-1], e[1:]
+
+
+def spectrum(eMin, eMax, index):
+    ''' Fraction of the counts in each channel for a power law of index '''
+    a = index + 1
+    flux = (eMax**a - eMin**a) / a if a else np.log(eMax / eMin)
+    return flux / flux.sum()
+
+
+def background(det, t, orbit, rate = None):
+    '''
+    Background counts/s of det at times t: modulated over the orbit & with
+    a component that decays after each SAA passage.
+    '''
+    rate = rate if rate is not None else (800. if det[0] == 'n' else 500.)
+    i = DETS.index(det)
+    orbital = 0.25 * np.cos(2 * np.pi * t / orbit.period + 0.45 * i)
+    # Seconds since the last SAA exit, sampled each 30 s over the last orbit
+    grid = np.arange(t[0] - orbit.period, t[-1] + 30., 30.)
+    inSAA = orbit.inSAA(grid)
+    exits = grid[1:][inSAA[:-1] & ~inSAA[1:]]
+    since = t - exits[np.maximum(np.searchsorted(exits, t) - 1, 0)] if exits.size else np.full(t.size, 1e9)
+    since[since < 0] = 1e9
+    return rate * (1 + orbital + 0.6 * np.exp(-since / 1200.))
+
+
+def writePHA(fileName, det, dtype, day0, orbit, rng, resolution, burst = None, scales = None,
+             badFraction = 1e-4, pad = 10., chunk = 3600.):
+    ''' One day of PHAII data for det, written an hour at a time '''
+    eMin, eMax = edges(det, dtype)
+    bkgSpec = spectrum(eMin, eMax, -1.4)
+    nBins = int(DAY / resolution)
+    ti = day0 + np.arange(nBins) * resolution
+    # Bins with the detectors off (in the SAA) are dropped, those within pad
+    # seconds of it are flagged
+    saa = orbit.inSAA(ti + resolution / 2.)
+    near = np.convolve(saa, np.ones(2 * int(pad / resolution) + 1, bool), 'same') & ~saa
+    good = ~saa
+    # G.T.I.s are the runs of bins with the detectors on
+    change = np.diff(np.concatenate([[0], good.astype(np.int8), [0]]))
+    gti = (ti[change[:-1] == 1], ti[change[1:] == -1] + resolution)
+    step = int(chunk / resolution)
+    with PHAIIStream(fileName, det, day0, (eMin, eMax), NCHAN[dtype], gti = gti) as out:
+        for i in range(0, nBins, step):
+            keep = good[i:i + step]
+            t = ti[i:i + step][keep]
+            if not t.size:
+                continue
+            rate = background(det, t + resolution / 2., orbit)[:,None] * bkgSpec
+            if burst is not None and scales[det]:
+                rate += (burst.rate(t + resolution / 2.) * scales[det])[:,None] * spectrum(eMin, eMax,
+                                                                                          burst.index)
+            counts = rng.poisson(rate * resolution)
+            qual = (near[i:i + step][keep] | (rng.random(t.size) < badFraction)).astype(np.int16)
+            exposure = (resolution - counts.sum(axis = 1) * DEADTIME).astype(np.float32)
+            out.append((t, t + resolution), exposure, counts, qual)
+
+
+def writePoshist(fileName, day0, orbit):
+    ''' One day of poshist data, each second '''
+    t = day0 + np.arange(int(DAY), dtype = float)
+    pos = orbit.position(t)
+    quat = orbit.quaternions(t)
+    lon, lat = orbit.geographic(t)
+    cols = [pf.Column(name = 'SCLK_UTC', format = 'D', unit = 's', array = t)]
+    cols += [pf.Column(name = 'QSJ_%i' %(i + 1), format = 'D', array = quat[:,i]) for i in range(4)]
+    cols += [pf.Column(name = 'POS_%s' %c, format = 'D', unit = 'm', array = pos[:,i])
+             for i, c in enumerate('XYZ')]
+    cols += [pf.Column(name = 'SC_LAT', format = 'E', unit = 'deg', array = lat),
+             pf.Column(name = 'SC_LON', format = 'E', unit = 'deg', array = lon)]
+    hdu = pf.BinTableHDU.from_columns(cols)
+    hdu.header['EXTNAME'] = 'GLAST POS HIST'
+    pf.HDUList([pf.PrimaryHDU(), hdu]).writeto(fileName, overwrite = True)
+
+
+def dayList(start, days):
+    ''' YYMMDD of days days from start (YYYY-MM-DD) '''
+    d0 = datetime.datetime.strptime(start, '%Y-%m-%d')
+    return [(d0 + datetime.timedelta(days = i)).strftime('%y%m%d') for i in range(days)]
+
+
+def generate(root, start, days = 1, dets = DETS, types = TYPES, resolution = None, orbit = None,
+             burst = None, seed = 0, badFraction = 1e-4):
+    '''
+    Write days days of data from start (YYYY-MM-DD) under root. types is
+    taken from TYPES; resolution overrides the seconds per bin of RESOLUTION
+    (a number or a dict by type). Returns a dict of the file names by day.
+    '''
+    orbit = orbit or Orbit()
+    res = dict(RESOLUTION)
+    if isinstance(resolution, dict):
+        res.update(resolution)
+    elif resolution:
+        res = dict.fromkeys(res, resolution)
+    scales = burst.scales(orbit) if burst is not None else None
+    written = {}
+    for n, day in enumerate(dayList(start, days)):
+        directory = os.path.join(root, day)
+        os.makedirs(directory, exist_ok = True)
+        day0 = date_to_met('20%s-%s-%s' %(day[:2], day[2:4], day[4:]))
+        written[day] = []
+        if 'poshist' in types:
+            name = os.path.join(directory, 'glg_poshist_all_%s_v00.fit' %day)
+            writePoshist(name, day0, orbit)
+            written[day].append(name)
+        for k, dtype in enumerate(i for i in types if i != 'poshist'):
+            for det in dets:
+                # A generator per file, so any subset comes out the same
+                rng = np.random.default_rng([seed, n, k, DETS.index(det)])
+                name = os.path.join(directory, 'glg_%s_%s_%s_v00.pha' %(dtype, det, day))
+                writePHA(name, det, dtype, day0, orbit, rng, res[dtype], burst, scales, badFraction)
+                written[day].append(name)
+    return written
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Write synthetic GBM daily data files')
+    parser.add_argument('root', help = 'Data directory, a sub directory is made for each day')
+    parser.add_argument('start', help = 'First day, YYYY-MM-DD')
+    parser.add_argument('--days', help = 'Number of days [default: 1]', type = int, default = 1)
+    parser.add_argument('--dets', help = 'Detectors [default: all]', nargs = '+', choices = DETS, default = DETS)
+    parser.add_argument('--types', help = 'File types [default: all]', nargs = '+', choices = TYPES,
+                        default = list(TYPES))
+    parser.add_argument('--resolution', help = 'Seconds per bin [default: 0.256 CTIME, 4.096 CSPEC]',
+                        type = float)
+    parser.add_argument('--burst', help = 'Add a burst at this MET', type = float)
+    parser.add_argument('--amplitude', help = 'Peak counts/s of the burst [default: 1000]', type = float,
+                        default = 1000.)
+    parser.add_argument('--coords', help = 'RA & Dec of the burst [default: 120 -30]', type = float, nargs = 2,
+                        default = [120., -30.])
+    parser.add_argument('--seed', help = 'Random seed [default: 0]', type = int, default = 0)
+    args = parser.parse_args(argv)
+    burst = Burst(args.burst, args.amplitude, ra = args.coords[0], dec = args.coords[1]) if args.burst else None
+    written = generate(args.root, args.start, args.days, args.dets, args.types, args.resolution,
+                       burst = burst, seed = args.seed)
+    for day, names in written.items():
+        print('%s: %i files' %(day, len(names)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+'''
+Check that a faster implementation of the numerical code (rebin_gbm,
+calc_background, calc_angles, make_gti) gives the same output as the one
+it replaces. The legacy (a git revision, HEAD by default) & new (the
+working tree by default) code are each run in their own process on the
+same inputs, through OrbSub as the GUI runs it, so changes to the options
+& stages are caught too. Every array of the results is compared with the
+explicit tolerances of TOLERANCES: the final tRange, Pha_data.data
+(binned & after the background is taken), background, quality, bkgExp,
+det_angles, pointing, gti & occTI.
+The time taken by each of the four functions is reported for both, with
+the speedup. Run from the project directory:
+
+    python benchmarks/golden.py
+    python benchmarks/golden.py --legacy 6f864a0 --real /data/gbm 612345678.9 120 -30
+
+The inputs are the synthetic data of bench_pipeline.py (generated the
+first time) & any --real data: DATA_DIR TZERO RA DEC, run for CTIME &
+CSPEC (see --real-types, --real-trange & --real-offsets). --keep DIR
+saves the outputs of both as .npz files; a saved file can be passed to
+--legacy instead of a revision, as a golden output.
+The exit status is 1 if any array differs by more than its tolerance.
+'''
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tarfile
+import argparse
+import functools
+import tempfile
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+TIMED = ['rebin_gbm', 'calc_background', 'calc_angles', 'make_gti']
+
+# (rtol, atol) by group or group/field, the most specific is used. Times
+# are MET seconds, so are only given an absolute tolerance
+TOLERANCES = {
+    'binned': (1e-12, 1e-9),            # counts & errors summed into bins
+    'binned/x': (0., 1e-6),
+    'binned/exp': (1e-12, 1e-9),
+    'data': (1e-12, 1e-9),
+    'data/x': (0., 1e-6),
+    'background': (1e-9, 1e-9),
+    'bkgExp': (1e-12, 1e-9),
+    'quality': (0., 0.),
+    'det_angles': (0., 1e-6),           # degrees
+    'pointing': (0., 1e-6),
+    'gti': (0., 1e-6),
+    'occTI': (0., 1e-3),                # interpolated step times
+    'tRange': (0., 1e-9),               # after OSV_Args.check & find_files
+}
+
+SYNTHETIC = [
+    {'name': 'sim_ctime', 'specType': 'CTIME', 'dets': 14, 'tRange': [-100., 500.], 'offsets': ['15']},
+    {'name': 'sim_cspec', 'specType': 'CSPEC', 'dets': 14, 'tRange': [-100., 500.], 'offsets': ['15']},
+    {'name': 'sim_offsets', 'specType': 'CTIME', 'dets': 4, 'tRange': [-500., 1500.],
+     'offsets': ['14', '15', '16', '29', '30', '31']},
+]
+DETS = ['n0', 'n1', 'n2', 'n3', 'n4', 'n5', 'n6', 'n7', 'n8', 'n9', 'na', 'nb', 'b0', 'b1']
+
+
+def tolerance(key):
+    group, name = key.split('|')[1:]
+    field = name.rsplit('/', 1)[-1]
+    return TOLERANCES.get('%s/%s' %(group, field), TOLERANCES[group])
+
+
+# Run in the process of each implementation
+
+def runCase(case, orbsub, oc, options, arrays):
+    '''
+    Run case through OrbSub as the GUI does (OSV_Args.check, then
+    find_files, calc_period, get_gti, get_steps & do_orbsub), adding the
+    arrays made to arrays if it is a dict
+    '''
+    opts = options.OSV_Args()
+    opts.tzero = case['tzero']
+    opts.tRange = list(case['tRange'])
+    opts.offset = list(case['offsets'])
+    opts.dets = list(case['dets'])
+    opts.spec_type = case['specType']
+    opts.coords = list(case['coords'])
+    opts.data_dir = case['dataDir']
+    opts.check()
+
+    # The source counts are changed in place by calc_background, so they
+    # are kept as binned just before it
+    binned = {}
+    calcBackground = oc.Pha_data.calc_background
+    def keepBinned(self, *args, **kwargs):
+        if arrays is not None and self.data.get('src') is not False:
+            binned[self.detector] = [np.array(value) for value in self.data['src']]
+        return calcBackground(self, *args, **kwargs)
+    oc.Pha_data.calc_background = keepBinned
+    try:
+        orb = orbsub.OrbSub(opts)
+        if orb.find_files():
+            raise RuntimeError('Missing data files for %s' %case['name'])
+        if not orb.calc_period():
+            raise RuntimeError(orb.perErrMes)
+        if not orb.get_gti():
+            raise RuntimeError(orb.gtiErrMes)
+        if not orb.get_steps():
+            raise RuntimeError(orb.occErrMes)
+        # Not valid if a region has no data, which is kept as missing below
+        orb.do_orbsub()
+    finally:
+        oc.Pha_data.calc_background = calcBackground
+    if arrays is None:
+        return
+
+    def add(group, name, value):
+        arrays['%s|%s|%s' %(case['name'], group, name)] = np.array(value, dtype = float)
+
+    pos = orb.pos
+    add('tRange', 'final', opts.tRange)
+    for det, ang in pos.det_angles.items():
+        add('det_angles', det, ang)
+    for region, point in pos.pointing.items():
+        add('pointing', region, point)
+    for det, gti in pos.gti.items():
+        # None (never good) is kept as no intervals
+        add('gti', det, np.empty((0, 2)) if gti is None else np.column_stack(gti))
+    add('occTI', 'start', pos.occTI[0])
+    add('occTI', 'stop', pos.occTI[1])
+    for det in opts.dets:
+        det_data = orb.data[det]
+        for field, value in zip('x y exp err'.split(), binned.get(det, [])):
+            add('binned', '%s/src/%s' %(det, field), value)
+        for region, data in det_data.data.items():
+            if data is False:
+                add('data', '%s/%s/missing' %(det, region), [])
+                continue
+            for field, value in zip('x y exp err'.split(), data):
+                add('data', '%s/%s/%s' %(det, region, field), value)
+        for key, value in det_data.background.items():
+            add('background', '%s/%s' %(det, key), value)
+        for key, value in det_data.bkgExp.items():
+            add('bkgExp', '%s/%s' %(det, key), value)
+        add('quality', det, det_data.quality)
+
+
+def capture(tree, casesFile, out, repeat):
+    '''
+    Run the cases with the lib package of tree, saving the arrays & the
+    fastest time in each of the TIMED functions to out (.npz).
+    '''
+    sys.path.insert(0, tree)
+    from lib import options
+    from lib import orbsub
+    from lib import orbsub_classes as oc
+    import lib.util.util as util
+
+    clock = {}
+    def timed(name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                clock[name][0] += 1
+                clock[name][1] += time.perf_counter() - t0
+        return wrapper
+    for name in TIMED:
+        if name == 'calc_background':
+            oc.Pha_data.calc_background = timed(name, oc.Pha_data.calc_background)
+        elif hasattr(util, name):
+            setattr(util, name, timed(name, getattr(util, name)))
+
+    with open(casesFile) as f:
+        cases = json.load(f)
+    arrays, timing, errors = {}, {}, {}
+    for case in cases:
+        best = {}
+        try:
+            for i in range(repeat):
+                for name in TIMED:
+                    clock[name] = [0, 0.]
+                runCase(case, orbsub, oc, options, arrays if i == 0 else None)
+                for name, (calls, seconds) in clock.items():
+                    if calls:
+                        best[name] = [calls, min(seconds, best.get(name, [0, seconds])[1])]
+        except Exception as e:
+            errors[case['name']] = '%s: %s' %(type(e).__name__, e)
+        timing[case['name']] = best
+    meta = {'tree': tree, 'timing': timing, 'errors': errors}
+    np.savez(out, __meta__ = np.array(json.dumps(meta)), **arrays)
+
+
+# Run in the comparing process
+
+def exportTree(rev, directory):
+    ''' Extract lib of revision rev into directory '''
+    tar = subprocess.run(['git', 'archive', '--format=tar', rev, 'lib'], cwd = ROOT,
+                         capture_output = True, check = True).stdout
+    with tarfile.open(fileobj = io.BytesIO(tar)) as f:
+        f.extractall(directory)
+    return directory
+
+
+def load(fileName):
+    ''' The arrays & meta data of a capture '''
+    with np.load(fileName) as npz:
+        arrays = {key: npz[key] for key in npz.files if key != '__meta__'}
+        return arrays, json.loads(str(npz['__meta__']))
+
+
+def run(source, casesFile, repeat, tmp, label):
+    ''' Capture the output of source: a .npz file, a git revision or '' for the working tree '''
+    if source.endswith('.npz') and os.path.isfile(source):
+        return load(source)
+    tree = ROOT if not source else exportTree(source, os.path.join(tmp, label))
+    out = os.path.join(tmp, label + '.npz')
+    # calc_background sums the regions in the order of a set of strings,
+    # so the hash seed is fixed for the same code to give the same output
+    subprocess.run([sys.executable, os.path.abspath(__file__), 'capture', tree, casesFile, out,
+                    '--repeat', str(repeat)], check = True, env = dict(os.environ, PYTHONHASHSEED = '0'))
+    return load(out)
+
+
+def compare(old, new):
+    ''' (key, problem, max absolute difference, max relative difference) of each array '''
+    rows = []
+    for key in sorted(set(old) | set(new)):
+        if key not in new:
+            rows.append((key, 'missing in new', None, None))
+            continue
+        if key not in old:
+            rows.append((key, 'missing in legacy', None, None))
+            continue
+        a, b = old[key], new[key]
+        if a.shape != b.shape:
+            rows.append((key, 'shape %s vs %s' %(a.shape, b.shape), None, None))
+            continue
+        rtol, atol = tolerance(key)
+        diff = np.abs(a - b)
+        diff[np.isnan(a) & np.isnan(b)] = 0.
+        diffAbs = float(np.nanmax(diff, initial = 0.)) if np.isfinite(diff).all() else float('inf')
+        diffRel = float(np.max(diff / np.maximum(np.abs(a), 1e-300), initial = 0.))
+        ok = np.isclose(b, a, rtol = rtol, atol = atol, equal_nan = True).all()
+        rows.append((key, '' if ok else 'exceeds rtol %g atol %g' %(rtol, atol), diffAbs, diffRel))
+    return rows
+
+
+def report(rows, oldMeta, newMeta, verbose = False):
+    ''' Print the comparison & speedups, returning the number of failures '''
+    failures = [row for row in rows if row[1]]
+    cases = sorted(set(key.split('|')[0] for key, *rest in rows))
+    print('%-14s %8s %8s %12s %12s' %('case', 'arrays', 'failed', 'max abs', 'max rel'))
+    for case in cases:
+        mine = [row for row in rows if row[0].startswith(case + '|')]
+        diffs = [row for row in mine if row[2] is not None]
+        print('%-14s %8i %8i %12.3g %12.3g' %(case, len(mine), sum(1 for row in mine if row[1]),
+                                             max((row[2] for row in diffs), default = 0.),
+                                             max((row[3] for row in diffs), default = 0.)))
+    for key, problem, diffAbs, diffRel in (rows if verbose else failures):
+        print('  %-50s %s%s' %(key, problem or 'ok',
+                               '' if diffAbs is None else ' (max abs %.3g, rel %.3g)' %(diffAbs, diffRel)))
+    for label, meta in [('legacy', oldMeta), ('new', newMeta)]:
+        for case, error in meta['errors'].items():
+            failures.append((case, error, None, None))
+            print('  %s failed on %s: %s' %(label, case, error))
+
+    print('\n%-14s %-16s %10s %10s %8s' %('case', 'function', 'legacy (s)', 'new (s)', 'speedup'))
+    for case in sorted(set(oldMeta['timing']) | set(newMeta['timing'])):
+        old, new = oldMeta['timing'].get(case, {}), newMeta['timing'].get(case, {})
+        for name in TIMED:
+            if name not in old and name not in new:
+                continue
+            a, b = old.get(name, [0, float('nan')])[1], new.get(name, [0, float('nan')])[1]
+            print('%-14s %-16s %10.4f %10.4f %7.2fx' %(case, name, a, b, a / b if b else float('nan')))
+    return len(failures)
+
+
+def makeCases(args):
+    cases = []
+    if not args.no_synthetic:
+        import bench_pipeline
+        bench_pipeline.makeFixtures(args.fixtures)
+        for case in SYNTHETIC:
+            cases.append(dict(case, tzero = bench_pipeline.TZERO, coords = bench_pipeline.COORDS,
+                              dets = DETS[:case['dets']], dataDir = args.fixtures))
+    for n, (dataDir, tzero, ra, dec) in enumerate(args.real or []):
+        for spec in args.real_types:
+            cases.append(dict(name = 'real%i_%s' %(n, spec.lower()), specType = spec, tRange = args.real_trange,
+                              offsets = args.real_offsets,
+                              tzero = float(tzero), coords = [float(ra), float(dec)], dets = args.real_dets,
+                              dataDir = os.path.abspath(dataDir)))
+    if args.cases:
+        cases = [case for case in cases if re.search(args.cases, case['name'])]
+    return cases
+
+
+def main(argv = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['capture']:
+        parser = argparse.ArgumentParser(prog = 'golden.py capture')
+        parser.add_argument('tree')
+        parser.add_argument('cases')
+        parser.add_argument('out')
+        parser.add_argument('--repeat', type = int, default = 1)
+        args = parser.parse_args(argv[1:])
+        capture(args.tree, args.cases, args.out, args.repeat)
+        return 0
+
+    import bench_pipeline
+    parser = argparse.ArgumentParser(description = 'Compare the output & speed of two implementations')
+    parser.add_argument('--legacy', help = 'Git revision or saved .npz output [default: HEAD]', default = 'HEAD')
+    parser.add_argument('--new', help = 'Git revision or saved .npz output [default: the working tree]',
+                        default = '')
+    parser.add_argument('--real', help = 'Real data to run on too (may be repeated)', nargs = 4,
+                        action = 'append', metavar = ('DATA_DIR', 'TZERO', 'RA', 'DEC'))
+    parser.add_argument('--real-dets', help = 'Detectors of the real data [default: all]', nargs = '+',
+                        choices = DETS, default = DETS)
+    parser.add_argument('--real-types', help = 'Data types of the real data [default: CTIME CSPEC]', nargs = '+',
+                        choices = ['CTIME', 'CSPEC'], default = ['CTIME', 'CSPEC'])
+    parser.add_argument('--real-trange', help = 'tRange of the real data [default: -100 500]', nargs = 2,
+                        type = float, default = [-100., 500.])
+    parser.add_argument('--real-offsets', help = 'Orbit offsets of the real data [default: 14 15 16]',
+                        nargs = '+', default = ['14', '15', '16'])
+    parser.add_argument('--no-synthetic', help = "Don't run on the synthetic data", action = 'store_true')
+    parser.add_argument('--fixtures', help = 'Directory of the synthetic data [default: %s]'
+                        %bench_pipeline.FIXTURES, default = bench_pipeline.FIXTURES)
+    parser.add_argument('--cases', help = 'Only run the cases matching this regular expression')
+    parser.add_argument('--repeat', help = 'Runs of each case, the fastest is kept [default: 3]',
+                        type = int, default = 3)
+    parser.add_argument('--keep', help = 'Save both outputs (legacy.npz & new.npz) in this directory')
+    parser.add_argument('--verbose', help = 'List every array compared', action = 'store_true')
+    args = parser.parse_args(argv)
+
+    cases = makeCases(args)
+    if not cases:
+        parser.error('No cases to run')
+    tmp = tempfile.mkdtemp(prefix = 'osv_golden_')
+    try:
+        casesFile = os.path.join(tmp, 'cases.json')
+        with open(casesFile, 'w') as f:
+            json.dump(cases, f)
+        old, oldMeta = run(args.legacy, casesFile, args.repeat, tmp, 'legacy')
+        new, newMeta = run(args.new, casesFile, args.repeat, tmp, 'new')
+        if args.keep:
+            os.makedirs(args.keep, exist_ok = True)
+            for label in ('legacy', 'new'):
+                if os.path.exists(os.path.join(tmp, label + '.npz')):
+                    shutil.copy(os.path.join(tmp, label + '.npz'), args.keep)
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
+
+    # A saved output may have more cases than were run
+    names = set(case['name'] for case in cases)
+    for arrays, meta in [(old, oldMeta), (new, newMeta)]:
+        for key in [key for key in arrays if key.split('|')[0] not in names]:
+            del arrays[key]
+        for part in ('timing', 'errors'):
+            meta[part] = {case: value for case, value in meta[part].items() if case in names}
+    print('\nlegacy: %s, new: %s' %(args.legacy, args.new or 'working tree'))
+    failures = report(compare(old, new), oldMeta, newMeta, args.verbose)
+    print('\n%s' %('%i failures' %failures if failures else 'All arrays within tolerance'))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
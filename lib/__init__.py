@@ -1,5 +1,22 @@
-from .ftp import ftp
-from .ftp import downloadDaily as getData
-from . import fitsUtil
-from . import util
-from . import dep_ver_checker
\ No newline at end of file
+'''
+The OSV package. Submodules are imported when first used (lib.getData,
+lib.fitsUtil, ...) so that each command only pays for what it needs; wx,
+matplotlib & astropy in particular are slow to import.
+'''
+import importlib
+
+# Attribute -> submodule, for the names which differ
+_aliases = {'getData': '.ftp.downloadDaily'}
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(name)
+    try:
+        module = importlib.import_module(_aliases.get(name, '.' + name), __name__)
+    except ModuleNotFoundError as e:
+        if e.name != __name__ + _aliases.get(name, '.' + name):
+            raise
+        raise AttributeError("module %r has no attribute %r" %(__name__, name)) from None
+    globals()[name] = module
+    return module
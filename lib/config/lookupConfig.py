@@ -7,11 +7,7 @@ These are lists.
 
 from os.path import join as osJoin
 
-#from . import configobj
-import configobj #import v5
-from lib import validate
-
-import lib.config as setup
+import lib.dep_ver_checker as setup
 
 dfltLstType = 'force_list(default = list())'
 dfltEntry = 'lc = {0}\n spec = {0} \n gti = {0}'.format(dfltLstType)
@@ -47,16 +43,8 @@ cfgSpec = """
 {0}
 """.format(dfltEntry)
 
-def getLUCfg(default = True, luPath = False):
+def getLUCfg(default = True, luPath = False, reload = False):
     ''' lookup config '''
-    spec = cfgSpec.split('\n')
-    if not default:
-        if not luPath:
-            config = configobj.ConfigObj(configspec = spec)
-        else:
-            config = configobj.ConfigObj(luPath, configspec = spec)
-    else:
-        config = configobj.ConfigObj(configspec = spec)
-    validator = validate.Validator()
-    config.validate(validator, copy = True)
-    return config
\ No newline at end of file
+    if not default and luPath:
+        return setup.loadConfig(luPath, cfgSpec, reload)
+    return setup.loadConfig(None, cfgSpec, reload)
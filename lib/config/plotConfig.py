@@ -1,9 +1,5 @@
 from os.path import join as osJoin
 
-#from . import configobj
-import configobj #import v5
-from lib import validate
-
 import lib.dep_ver_checker as setup
 # yellow darkgreen skyblue
 cfgSpec = """
@@ -25,14 +21,7 @@ fontsizeLabel = integer(default = 8)
 fontsizeLegend = integer(default = 8)
 """
 
-def getPltCfg(default = True):
+def getPltCfg(default = True, reload = False):
     pltIni = 'plt.cgf'
     pltIniPath = osJoin(setup.iniDir, pltIni)
-    spec = cfgSpec.split('\n')
-    if default:
-        config = configobj.ConfigObj(configspec = spec)
-    else:
-        config = configobj.ConfigObj(pltIniPath, configspec = spec)
-    validator = validate.Validator()
-    config.validate(validator, copy = True)
-    return config
\ No newline at end of file
+    return setup.loadConfig(None if default else pltIniPath, cfgSpec, reload)
@@ -6,6 +6,7 @@ setup script for OSV
 
 import os
 import sys
+import threading
 
 import configobj #essentially just installed v5
 #from lib import validate
@@ -70,17 +71,49 @@ def doCheckVersions(verbose=True):
     print(mes)
     return mes
     
-def getConfig(default=False, printflag=False):
+_cache = {}  # (path, spec) -> ((mtime, size), validated ConfigObj)
+_cacheLock = threading.Lock()
+
+def parseConfig(path, spec):
+    ''' ConfigObj of the file path (None for the defaults) validated against spec '''
+    config = configobj.ConfigObj(path, configspec = spec.split('\n'))
+    validator = validate.Validator()
+    config.validate(validator, copy = True)
+    return config
+
+def loadConfig(path, spec, reload = False):
+    '''
+    As parseConfig but the result is kept, so each file is only parsed &
+    validated again if its modification time or size change (or reload is
+    set). A copy is returned, which can be changed freely.
+    '''
+    try:
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except (OSError, TypeError):
+        stamp = None
+    key = (path, spec)
+    with _cacheLock:
+        entry = _cache.get(key)
+        if reload or entry is None or entry[0] != stamp:
+            entry = _cache[key] = (stamp, parseConfig(path, spec))
+    config = configobj.ConfigObj(entry[1].dict())
+    config.filename = entry[1].filename
+    return config
+
+def reloadConfig():
+    ''' Forget the parsed config files, they are read again when next used '''
+    with _cacheLock:
+        _cache.clear()
+
+def getConfig(default=False, printflag=False, reload=False):
     ''' Read config file and return dictionary with values  '''
-    if not os.path.isdir(iniDir):
-        os.makedirs(iniDir)
-    spec = cfgSpec.split('\n')
     if default:
-        config = configobj.ConfigObj(configspec = spec)
+        config = loadConfig(None, cfgSpec, reload)
     else:
-        config = configobj.ConfigObj(iniPath, configspec = spec)
-    validator = validate.Validator()
-    config.validate(validator, copy = True)   
+        if not os.path.isdir(iniDir):
+            os.makedirs(iniDir)
+        config = loadConfig(iniPath, cfgSpec, reload)
     if printflag:
         print("The config file: ")
         print(config) 
@@ -104,7 +137,10 @@ def doConfig():
     ''' 
     Read config file: then prompt user to either ok values or input their own.
     '''
-    config = getConfig()
+    # Not the cached copy, the config is validated & written below
+    if not os.path.isdir(iniDir):
+        os.makedirs(iniDir)
+    config = parseConfig(iniPath, cfgSpec)
     print('Set the configuration for the current user.') 
     print('Press <return> to accept a default.')
     for i in list(config.keys()): 
@@ -1,6 +1,6 @@
 from . import pha
 from . import phaii
 
-from .pha import createPHA
-from .phaii import createPHAII
-from .ascii import createASCII
\ No newline at end of file
+from .pha import createPHA, createPHATypeII
+from .phaii import createPHAII, PHAIIStream
+from .ascii import createASCII, createASCIIMulti
\ No newline at end of file
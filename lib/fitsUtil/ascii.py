@@ -1,23 +1,60 @@
 '''
 ascii.py
 
-V 0.1
+V 0.2
 
 Create an ascii output file
 
+The table is formatted in a single operation and handed to the file object
+in one buffered write, rather than one write per row.
+
 '''
 
 import os
 
 import numpy as np
 
-def createASCII(t, exp, counts, detector, tzero, name, delim = ','):
-	'''     '''
-	r = counts.sum(1)/exp
+def _formatTable(cols, delim = ',', fmt = '%s'):
+	'''
+	Format a list of equal length 1-D columns into one string. Each row is
+	written as "c0<delim> c1<delim> ... cN<delim>\\n", the layout used since
+	V 0.1. fmt is the printf style format applied to every value.
+	'''
+	table = np.column_stack(cols)
+	if not table.size:
+		return ''
+	rowFmt = ' '.join(['%s%s' %(fmt, delim)] * table.shape[1]) + '\n'
+	# A single % on the whole table keeps the formatting in C
+	return (rowFmt * table.shape[0]) %tuple(table.ravel().tolist())
+
+def _header(labels, delim = ','):
+	''' Header row in the same layout as the data rows '''
+	return ' '.join(['%s%s' %(i, delim) for i in labels]) + '\n'
 
+def createASCII(t, exp, counts, detector, tzero, name, delim = ',', fmt = '%s'):
+	'''
+	Write the rate & rate error of counts (nbins x nchan) to name. fmt is the
+	float format used for every column, e.g. '%.6e'. The default reproduces
+	the str() output of earlier versions.
+	'''
+	r = counts.sum(1)/exp
 	rErr = np.sqrt(counts.sum(1))/exp
-	fo = open(name, 'w')
-	fo.write("%s%s %s%s %s%s %s%s\n"%('T_i',delim, 'T_j',delim, 'Rate (Counts/s)',delim, 'Rate Err (Counts/s)',delim,))
-	for i in range(r.size):
-		fo.write("%s%s %s%s %s%s %s%s\n" %(t[0][i],delim,  t[1][i],delim, r[i],delim, rErr[i],delim))
-	fo.close()
+	labels = ['T_i', 'T_j', 'Rate (Counts/s)', 'Rate Err (Counts/s)']
+	with open(name, 'w') as fo:
+		fo.write(_header(labels, delim) + _formatTable((t[0], t[1], r, rErr), delim, fmt))
+
+def createASCIIMulti(t, exps, counts, detectors, name, delim = ',', fmt = '%s'):
+	'''
+	Write several detectors into one wide table. t is the shared (ti, tj)
+	time grid, exps and counts are lists (one entry per detector, same order
+	as detectors) of exposure and counts (nbins x nchan) arrays. Each detector
+	adds a rate and a rate error column.
+	'''
+	labels = ['T_i', 'T_j']
+	cols = [t[0], t[1]]
+	for det, exp, c in zip(detectors, exps, counts):
+		total = c.sum(1)
+		labels.extend(['%s Rate (Counts/s)' %det, '%s Rate Err (Counts/s)' %det])
+		cols.extend([total/exp, np.sqrt(total)/exp])
+	with open(name, 'w') as fo:
+		fo.write(_header(labels, delim) + _formatTable(cols, delim, fmt))
@@ -53,8 +53,8 @@ class PHA:
         self.tzero = self.trig        
         self.ti = t[0]
         self.tj = t[1]        
-        self.tMin = self.ti[0] 
-        self.tMax = self.tj[-1]
+        self.tMin = np.min(self.ti)
+        self.tMax = np.max(self.tj)
         self.date = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
         # Observation start & end in UT
         self.obsStart = (datetime.datetime(2001, 0o1, 0o1, 0, 0, 0) + datetime.timedelta(0, (float(self.tMin)) ) ).strftime("%Y-%m-%dT%H:%M:%S")
@@ -238,9 +238,8 @@ class PHA:
         gtiCols = pf.ColDefs([gti_start, gti_end])
         gtiHdu = pf.BinTableHDU.from_columns(gtiCols, hdr)
         self.gtiExt = gtiHdu
-    def doEvents(self):
-        ''' Create Events extension '''
-        # First we define header
+    def eventsHeader(self):
+        ''' Header of the SPECTRUM extension '''
         hdr = pf.Header()
         hdr.set('EXTNAME', 'SPECTRUM'            , 'Name of extension')    
         hdr.set('TELESCOP', 'GLAST'              , 'Name of mission/Satellite')
@@ -291,15 +290,21 @@ class PHA:
         hdr.set('HDUCLAS3', 'RATE'              , '')
         hdr.set('HDUCLAS4', 'TYPEI'             , '')
         hdr.set('EXTVER'  , 1                    , 'Version of this extension format')
+        return hdr
+
+    def doEvents(self):
+        ''' Create Events extension '''
+        # First we define header
+        hdr = self.eventsHeader()
         
         #if self.statErr:
             #hdr['POISSERR'] = False
 
         #Now we define data table
-        channels = np.arange(self.nchan).reshape(1, 128)
-        qual_in = (np.ones(self.nchan) * self.qual).reshape(1, 128)
-        rate_in = self.rate.reshape(1, 128)
-        group_in = np.ones(self.nchan).reshape(1, 128)
+        channels = np.arange(self.nchan).reshape(1, self.nchan)
+        qual_in = (np.ones(self.nchan) * self.qual).reshape(1, self.nchan)
+        rate_in = self.rate.reshape(1, self.nchan)
+        group_in = np.ones(self.nchan).reshape(1, self.nchan)
 
         channelsCols = pf.Column(name='CHANNEL', format=f'{self.nchan}I', array = channels) # bscale = 1, bzero = 0)
         #rateCols = pf.Column(name='RATE', format='1E', array = self.rate, unit = 'count/s',)# bscale = 1, bzero = 32768)
@@ -374,3 +379,88 @@ def createPHA(t, exp, pha, det, trigTime, fileStem = '', hdrComment = '', edges
     if bkg:
         phaii.eventsExt.header["HDUCLAS2"] = "BKG"
     phaii.write()
+
+
+class PHATypeII(PHA):
+    '''
+    Class for the creation of PHA TYPE II files: one spectrum per row of the
+    SPECTRUM extension. t is (tstart, tstop) of each spectrum, exp the
+    exposure of each spectrum and pha/err the (nspec x nchan) counts & errors.
+    The spectra may be in any order and overlap; the GTI is their union.
+    '''
+    def __init__(self, t, exp, pha, det, trigTime, fileStem, hdrComment, edges,
+                    ra, dec, radErr, nchan, qual = np.empty((0)), err = None):
+        PHA.__init__(self, t, exp, pha, det, trigTime, fileStem, hdrComment, edges,
+                     ra, dec, radErr, nchan, err = err)
+        # Replace the summed spectrum with one spectrum per row. self.exp
+        # keeps the total exposure, used for the header keyword
+        self.specExp = np.asarray(exp, dtype = float)
+        self.nspec = self.specExp.size
+        expCol = np.where(self.specExp > 0, self.specExp, 1.)[:, None]
+        self.rate = pha / expCol
+        if err is None:
+            self.rateErr = np.sqrt(pha) / expCol
+        else:
+            self.rateErr = err / expCol
+        if qual.size:
+            self.qual = np.asarray(qual)
+        else:
+            self.qual = np.zeros(self.nspec)
+        # GTI: the intervals sorted & merged where they overlap or touch,
+        # rather than one span from the first start to the last stop
+        order = np.argsort(self.ti, kind = 'stable')
+        ti, tj = np.asarray(self.ti)[order], np.asarray(self.tj)[order]
+        reach = np.maximum.accumulate(tj)
+        new = np.concatenate(([True], ti[1:] > reach[:-1]))
+        self.gti_i = ti[new]
+        self.gti_j = np.maximum.reduceat(tj, np.flatnonzero(new))
+
+    def doEvents(self):
+        ''' Create TYPE II SPECTRUM extension '''
+        hdr = self.eventsHeader()
+        hdr.remove('EXPOSURE')
+        hdr.remove('QUALITY')
+        hdr['HDUCLAS4'] = 'TYPEII'
+        hdr['POISSERR'] = False
+
+        n = self.nspec
+        nchan = self.nchan
+        channels = np.tile(np.arange(nchan), (n, 1))
+        qual_in = np.repeat(self.qual.reshape(n, 1), nchan, axis = 1)
+        group_in = np.ones((n, nchan))
+
+        cols = pf.ColDefs([
+            pf.Column(name='SPEC_NUM' , format='I', array = np.arange(1, n + 1)),
+            pf.Column(name='TSTART'   , format='D', array = self.ti, unit = 's'),
+            pf.Column(name='TELAPSE'  , format='D', array = self.tj - self.ti, unit = 's'),
+            pf.Column(name='CHANNEL'  , format=f'{nchan}I', array = channels),
+            pf.Column(name='RATE'     , format=f'{nchan}D', array = self.rate, unit = 'Count/s'),
+            pf.Column(name='STAT_ERR' , format=f'{nchan}D', array = self.rateErr, unit = 'Count/s'),
+            pf.Column(name='QUALITY'  , format=f'{nchan}I', array = qual_in),
+            pf.Column(name='GROUPING' , format=f'{nchan}I', array = group_in),
+            pf.Column(name='EXPOSURE' , format='D', array = self.specExp, unit = 's'),
+            pf.Column(name='BACKFILE' , format='6A', array = np.array(['none'] * n)),
+            pf.Column(name='RESPFILE' , format='6A', array = np.array(['none'] * n)),
+            pf.Column(name='ANCRFILE' , format='6A', array = np.array(['none'] * n)),
+            ])
+        self.eventsExt = pf.BinTableHDU.from_columns(cols, hdr)
+
+
+def createPHATypeII(t, exp, pha, det, trigTime, fileStem = '', hdrComment = '', edges = (),
+                ra = 0, dec = 0, errRad = 0, qual = np.empty((0)), err = None,
+                bkg = False):
+    '''
+    Write a PHA TYPE II file, one spectrum per row. t is (tstart, tstop) of
+    each spectrum, exp the exposure of each spectrum and pha, err are
+    (nspec x nchan) arrays of counts & errors. Other inputs are as createPHA.
+    '''
+    nChan = pha.shape[1]
+    pha2 = PHATypeII( t, exp, pha, det, trigTime, fileStem, hdrComment, edges,
+                    ra, dec, errRad, nChan, qual = qual, err = err)
+    pha2.doPrimary()
+    pha2.doEbounds()
+    pha2.doGTI()
+    pha2.doEvents()
+    if bkg:
+        pha2.eventsExt.header["HDUCLAS2"] = "BKG"
+    pha2.write()
@@ -20,6 +20,8 @@ gerard.fitzpatrick@ucdconnect.ie
 '''
 
 import os
+import io
+import gzip
 import datetime
 
 import astropy.io.fits as pf
@@ -107,6 +109,9 @@ class PHAII:
             self.hdrComment = None
 
         self.statErr = statErr
+        # Output compression: None or 'gzip'
+        self.compress = None
+        self.compresslevel = 6
 
     def doPrimary(self):
         ''' Create Primary Extension.'''
@@ -324,13 +329,24 @@ class PHAII:
         '''
         hdulist = pf.HDUList([self.primExt, self.eBoundsExt, self.eventsExt, 
                               self.gtiExt])
-        hdulist.writeto(self.filename, overwrite = self.clobber)
+        if self.compress == 'gzip':
+            # Serialise in memory, then compress. zlib releases the GIL so 
+            # several files can be compressed in parallel threads
+            if not self.clobber and os.path.exists(self.filename):
+                raise OSError("File %s already exists" %self.filename)
+            buf = io.BytesIO()
+            hdulist.writeto(buf)
+            with gzip.open(self.filename, 'wb', compresslevel = self.compresslevel) as fo:
+                fo.write(buf.getbuffer())
+        else:
+            hdulist.writeto(self.filename, overwrite = self.clobber)
         hdulist.close()
 
         
 
 def createPHAII(t, exp, pha, det, trigTime, fileStem = '', hdrComment = '', edges = (),
-                ra = 0, dec = 0, errRad = 0, qual = (), statErr = None, bkg = False):
+                ra = 0, dec = 0, errRad = 0, qual = (), statErr = None, bkg = False,
+                compress = None, compresslevel = 6):
 
     ''' 
     Takes 5 inputs: t, pha, det, trigTime, fileStem & hdrComment. t is the time 
@@ -340,15 +356,142 @@ def createPHAII(t, exp, pha, det, trigTime, fileStem = '', hdrComment = '', edge
     fileStem is the string which will identify the file and will 
     replace the usual yymmddfff. hdrComment is a string that will be written
     to the header of the primary extension.
+    compress can be None or 'gzip'; with gzip a .gz suffix is added to
+    fileStem if missing. Returns the name of the file written.
     '''
-    
+    if compress == 'gzip' and not fileStem.endswith('.gz'):
+        fileStem += '.gz'
     nChan = pha.shape[1]
     phaii = PHAII( t, exp, pha, det, trigTime, fileStem, hdrComment, edges,
-                    ra, dec, errRad, nChan, statErr = statErr )
+                    ra, dec, errRad, nChan, qual = np.asarray(qual), statErr = statErr )
     phaii.doPrimary()
     phaii.doEbounds()
     phaii.doGTI()
     phaii.doEvents()
     if bkg:
         phaii.eventsExt.header["HDUCLAS2"] = "BKG"    
-    phaii.write()
\ No newline at end of file
+    phaii.compress = compress
+    phaii.compresslevel = compresslevel
+    phaii.write()
+    return fileStem
+
+class PHAIIStream:
+    '''
+    Write a PHAII file incrementally. SPECTRUM rows are appended chunk by 
+    chunk, straight to disk, so only one chunk has to be held in memory.
+    The headers are made by PHAII, so the file matches one written by 
+    createPHAII. On close NAXIS2 and the time keywords are fixed up by 
+    rewriting the headers in place, and the GTI extension is appended.
+
+        out = PHAIIStream(name, det, trigTime, edges, nchan)
+        for t, exp, counts, qual in chunks:
+            out.append(t, exp, counts, qual)
+        out.close()
+    '''
+    def __init__(self, fileStem, det, trigTime, edges, nchan, hdrComment = '',
+                 ra = 0, dec = 0, errRad = 0, bkg = False, gti = ()):
+        self.filename = fileStem
+        self.det = det
+        self.trig = trigTime
+        self.edges = edges
+        self.nchan = nchan
+        self.hdrComment = hdrComment
+        self.ra = ra
+        self.dec = dec
+        self.errRad = errRad
+        self.bkg = bkg
+        self.gti = gti
+        self.nrows = 0
+        self.tMin = trigTime
+        self.tMax = trigTime
+        # Raw (stored) layout of a SPECTRUM row, see PHAII.doEvents. COUNTS
+        # is stored with TZERO = 32768, TIME & ENDTIME with TZERO = trigTime
+        self.dtype = np.dtype([('COUNTS', '>i4', (nchan,)), ('EXPOSURE', '>f4'),
+                               ('QUALITY', '>i2'), ('TIME', '>f8'), ('ENDTIME', '>f8')])
+        self.fo = open(self.filename, 'wb')
+        primHdr, eBoundsHdu, eventsHdr = self._headers()
+        self.fo.write(primHdr.tostring().encode('ascii'))
+        self.eBoundsOffset = self.fo.tell()
+        self.fo.write(self._hduBytes(eBoundsHdu))
+        self.eventsOffset = self.fo.tell()
+        self.eventsHdrSize = len(eventsHdr.tostring())
+        self.fo.write(eventsHdr.tostring().encode('ascii'))
+        self.dataSize = 0
+
+    def _hduBytes(self, hdu):
+        ''' Serialise a complete (small) extension HDU, header & data '''
+        buf = io.BytesIO()
+        pf.HDUList([pf.PrimaryHDU(), hdu]).writeto(buf)
+        # An empty primary HDU is a single 2880 byte header block
+        return buf.getvalue()[2880:]
+
+    def _headers(self):
+        '''
+        Create the primary header, EBOUNDS extension & SPECTRUM header for 
+        the current time range & number of rows, using a one row placeholder.
+        '''
+        t = (np.asarray([self.tMin]), np.asarray([self.tMax]))
+        phaii = PHAII(t, np.ones(1), np.zeros((1, self.nchan)), self.det, self.trig,
+                      self.filename, self.hdrComment, self.edges, self.ra, self.dec,
+                      self.errRad, self.nchan, gti = self.gti)
+        phaii.doPrimary()
+        phaii.doEbounds()
+        phaii.doEvents()
+        phaii.doGTI()
+        if self.bkg:
+            phaii.eventsExt.header["HDUCLAS2"] = "BKG"
+        eventsHdr = phaii.eventsExt.header
+        eventsHdr['NAXIS2'] = self.nrows
+        primHdr = phaii.primExt.header
+        # Normally added by astropy when writing an HDUList with extensions
+        primHdr.set('EXTEND', True, after = 'NAXIS')
+        self.gtiExt = phaii.gtiExt
+        return primHdr, phaii.eBoundsExt, eventsHdr
+
+    def append(self, t, exp, pha, qual = None):
+        '''
+        Append rows to the SPECTRUM extension. t is (ti, tj), exp the 
+        exposure, pha the (nbins x nchan) counts & qual the quality flags.
+        '''
+        n = np.size(exp)
+        if not n:
+            return
+        rows = np.empty(n, dtype = self.dtype)
+        # Cast before the offset, as PHAII.doEvents, so float counts are
+        # truncated the same way
+        rows['COUNTS'] = np.asarray(pha).astype(np.int32) - 32768
+        rows['EXPOSURE'] = exp
+        rows['QUALITY'] = 0 if qual is None else qual
+        rows['TIME'] = np.asarray(t[0]) - self.trig
+        rows['ENDTIME'] = np.asarray(t[1]) - self.trig
+        if not self.nrows:
+            self.tMin = t[0][0]
+        self.tMax = t[1][-1]
+        self.fo.write(rows.tobytes())
+        self.nrows += n
+        self.dataSize += rows.nbytes
+
+    def close(self):
+        ''' Pad the SPECTRUM data, rewrite the headers & append the GTI '''
+        if self.fo.closed:
+            return
+        self.fo.write(bytes(-self.dataSize % 2880))
+        primHdr, eBoundsHdu, eventsHdr = self._headers()
+        self.fo.write(self._hduBytes(self.gtiExt))
+        # The headers have the same cards as those written at the start, so 
+        # they occupy the same number of blocks and can be overwritten
+        hdr = eventsHdr.tostring().encode('ascii')
+        if len(hdr) != self.eventsHdrSize:
+            raise IOError("SPECTRUM header of %s changed size" %self.filename)
+        for offset, h in [(0, primHdr.tostring().encode('ascii')),
+                          (self.eBoundsOffset, eBoundsHdu.header.tostring().encode('ascii')),
+                          (self.eventsOffset, hdr)]:
+            self.fo.seek(offset)
+            self.fo.write(h)
+        self.fo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
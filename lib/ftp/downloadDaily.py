@@ -10,22 +10,56 @@ import argparse
 import ftplib
 import sys
 import os
+import re
+import json
+import socket
+import ssl
+import hashlib
+import time
+import fnmatch
+import posixpath
+import queue
+import threading
 from pathlib import Path
 import concurrent
 from concurrent.futures import ThreadPoolExecutor
 import contextlib
+from datetime import datetime, timedelta
+
+# Errors which mean the connection is no longer usable, worth retrying on a
+# new one. Not OSError as a whole, so local I/O errors (disk full, no
+# permission) aren't retried
+CONNECTION_ERRORS = (ConnectionError, TimeoutError, socket.gaierror, ssl.SSLError, EOFError,
+                     ftplib.error_temp)
 
 
 def parse_args():
     """Parse command-line arguments with improved help messages"""
     parser = argparse.ArgumentParser(
-        description='Download continuous data from Fermi GBM FTP server')
+        description='Download continuous data from Fermi GBM FTP server',
+        epilog='To check downloaded files against their size & checksum manifests '
+               'and download corrupt or partial ones again, use: '
+               'osv.py getdata verify [data_dir] (see osv.py getdata verify --help)')
     
     parser.add_argument(
         'date', 
         type=str,
+        nargs='?',
         help='Date to download in YYMMDD format (e.g., 220315 for March 15, 2022)'
     )
+    parser.add_argument(
+        '--from',
+        dest='from_date',
+        help='First date of a range to sync in YYMMDD format (use with --to). '
+             'Each day is saved in its own YYMMDD subdirectory',
+        type=str
+    )
+    parser.add_argument(
+        '--to',
+        dest='to_date',
+        help='Last date (inclusive) of a range to sync in YYMMDD format',
+        type=str
+    )
     parser.add_argument(
         '--ctime', 
         help='Download CTIME (count time) data',
@@ -54,28 +88,457 @@ def parse_args():
         type=Path,
         default=Path.cwd()
     )
+    parser.add_argument(
+        '--no-cache',
+        help="Don't use the cached listings of the server's day directories",
+        action='store_true'
+    )
+    parser.add_argument(
+        '--refresh',
+        help="List the server again, updating the cached listings",
+        action='store_true'
+    )
     parser.add_argument(
         '--parallel',
-        help="Number of parallel downloads (default: 4)",
+        help="Maximum number of parallel downloads, the number used adapts "
+             "to the throughput & server errors (default: 4)",
         type=int,
         default=4
     )
+    parser.add_argument(
+        '--max-rate',
+        help="Limit the total download rate, in MB/s (default: no limit)",
+        type=float
+    )
 
     return parser.parse_args()
 
 
+def parse_verify_args(argv):
+    """Parse the arguments of the verify command"""
+    parser = argparse.ArgumentParser(
+        prog='osv.py getdata verify',
+        description='Check downloaded files against their size & checksum manifests '
+                    'and download any corrupt or partial files again')
+    
+    parser.add_argument(
+        'data_dir',
+        help="Data directory, holding the files or their YYMMDD day directories "
+             "(default: current directory)",
+        type=Path,
+        nargs='?',
+        default=Path.cwd()
+    )
+    parser.add_argument(
+        '--no-requeue',
+        help="Only report bad files, don't download them again",
+        action='store_true'
+    )
+    parser.add_argument(
+        '--parallel',
+        help="Number of files checked or downloaded in parallel (default: 4)",
+        type=int,
+        default=4
+    )
+    
+    return parser.parse_args(argv)
+
+
+class FTPPool:
+	"""
+	A bounded pool of logged in FTP connections shared between threads.
+	
+	Opening an FTP_TLS connection costs a TLS handshake, login and prot_p,
+	which for small files takes longer than the transfer itself. Connections
+	are opened lazily up to size, handed out with connection() and returned
+	to the pool afterwards. A connection which has been idle for longer than
+	idle_check seconds is checked with a NOOP before it is handed out and
+	is replaced if it has gone stale. A connection which raises during use
+	is closed rather than returned. context is an optional ssl.SSLContext
+	for FTP_TLS, e.g. to trust the certificate of a test server.
+	"""
+
+	def __init__(self, host, size=3, port=21, ftp_class=ftplib.FTP_TLS, timeout=60, idle_check=15,
+				 context=None):
+		self.host = host
+		self.port = port
+		self.size = size
+		self.ftp_class = ftp_class
+		self.timeout = timeout
+		self.idle_check = idle_check
+		self.context = context
+		self._idle = queue.LifoQueue()
+		self._slots = threading.BoundedSemaphore(size)
+		self._lock = threading.Lock()
+		self.opened = 0
+
+	def _connect(self):
+		ftp = self.ftp_class(context=self.context) if self.context else self.ftp_class()
+		ftp.connect(self.host, self.port, timeout=self.timeout)
+		ftp.login()
+		if isinstance(ftp, ftplib.FTP_TLS):
+			ftp.prot_p()  # Set secure data connection
+		ftp.cur_dir = None
+		with self._lock:
+			self.opened += 1
+		return ftp
+
+	@staticmethod
+	def _discard(ftp):
+		with contextlib.suppress(Exception):
+			ftp.close()
+
+	def acquire(self):
+		"""Check out a connection, blocking while all size connections are in use"""
+		self._slots.acquire()
+		try:
+			while True:
+				try:
+					ftp, last_used = self._idle.get_nowait()
+				except queue.Empty:
+					return self._connect()
+				if time.monotonic() - last_used < self.idle_check:
+					return ftp
+				try:
+					ftp.voidcmd('NOOP')
+					return ftp
+				except CONNECTION_ERRORS:
+					self._discard(ftp)
+		except BaseException:
+			self._slots.release()
+			raise
+
+	def release(self, ftp, broken=False):
+		"""Return a connection to the pool, or close it if broken"""
+		if broken:
+			self._discard(ftp)
+		else:
+			self._idle.put((ftp, time.monotonic()))
+		self._slots.release()
+
+	@contextlib.contextmanager
+	def connection(self, directory=None):
+		"""
+		Context manager giving a connection, changed to directory if passed.
+		The connection is dropped from the pool if the block raises.
+		"""
+		ftp = self.acquire()
+		try:
+			if directory is not None and ftp.cur_dir != directory:
+				ftp.cwd('/' + directory.lstrip('/'))
+				ftp.cur_dir = directory
+			yield ftp
+		except BaseException:
+			self.release(ftp, broken=True)
+			raise
+		self.release(ftp)
+
+	def close(self):
+		"""Log out of all idle connections"""
+		while True:
+			try:
+				ftp, _ = self._idle.get_nowait()
+			except queue.Empty:
+				break
+			with contextlib.suppress(Exception):
+				ftp.quit()
+			self._discard(ftp)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+class TransferScheduler:
+	"""
+	Decides how many downloads run at once and optionally limits the total
+	bandwidth.
+	
+	Workers take a slot() for each file. The number of slots starts at start
+	and is adapted once per round of completed files (a round is as many
+	files as there are slots): it is raised by one while the aggregate
+	throughput keeps improving by more than 10%, and lowered by one if the
+	throughput drops by more than 10%. A temporary error or dropped
+	connection halves it straight away, and it is then held for two rounds.
+	
+	If bandwidth (bytes/s) is set, throttle() is called with every block
+	received and sleeps to keep the total rate of all transfers under it.
+	"""
+
+	def __init__(self, max_workers=6, start=3, min_workers=1, bandwidth=None):
+		self.max_workers = max_workers
+		self.min_workers = min_workers
+		self.limit = max(min_workers, min(start, max_workers))
+		self.bandwidth = bandwidth
+		self._cond = threading.Condition()
+		self.active = 0
+		self.peak = 0
+		self.temp_errors = 0
+		self.files = []  # (filename, bytes, seconds, ok)
+		self._start = None
+		self._round = (0, 0, None)  # files, bytes, start time
+		self._last_rate = None
+		self._hold = 0
+		self._next_send = 0.
+
+	@contextlib.contextmanager
+	def slot(self):
+		"""Wait until fewer than limit transfers are running"""
+		with self._cond:
+			while self.active >= self.limit:
+				self._cond.wait()
+			self.active += 1
+			self.peak = max(self.peak, self.active)
+			now = time.monotonic()
+			if self._start is None:
+				self._start = now
+			if self._round[2] is None:
+				self._round = (0, 0, now)
+		try:
+			yield
+		finally:
+			with self._cond:
+				self.active -= 1
+				self._cond.notify_all()
+
+	def throttle(self, nbytes):
+		"""Sleep as needed to keep all transfers under the bandwidth limit"""
+		if not self.bandwidth:
+			return
+		with self._cond:
+			now = time.monotonic()
+			# Reserve the time this block takes at the limit, allowing a
+			# short burst so small blocks don't sleep individually
+			self._next_send = max(self._next_send, now - 0.25) + nbytes / self.bandwidth
+			delay = self._next_send - now
+		if delay > 0:
+			time.sleep(delay)
+
+	def temp_error(self):
+		"""Back off after a temporary error or dropped connection"""
+		with self._cond:
+			self.temp_errors += 1
+			self.limit = max(self.min_workers, self.limit // 2)
+			self._hold = 2
+			self._last_rate = None
+			self._round = (0, 0, time.monotonic())
+
+	def record(self, filename, nbytes, seconds, ok=True):
+		"""Record a finished file and adapt the concurrency once per round"""
+		with self._cond:
+			self.files.append((filename, nbytes, seconds, ok))
+			nfiles, nround, start = self._round
+			nfiles += 1
+			nround += nbytes
+			now = time.monotonic()
+			if nfiles < self.limit:
+				self._round = (nfiles, nround, start)
+				return
+			rate = nround / max(now - start, 1e-9)
+			if self._hold:
+				self._hold -= 1
+			elif self._last_rate is None or rate > 1.1 * self._last_rate:
+				self.limit = min(self.max_workers, self.limit + 1)
+			elif rate < 0.9 * self._last_rate:
+				self.limit = max(self.min_workers, self.limit - 1)
+			self._last_rate = rate
+			self._round = (0, 0, now)
+			self._cond.notify_all()
+
+	def report(self, per_file=True):
+		"""Per-file & aggregate throughput as text"""
+		lines = []
+		if per_file:
+			for filename, nbytes, seconds, ok in sorted(self.files):
+				rate = nbytes / 1e6 / max(seconds, 1e-9)
+				status = '' if ok else ' FAILED'
+				lines.append(f"  {filename}: {nbytes / 1e6:.1f} MB in {seconds:.1f} s ({rate:.2f} MB/s){status}")
+		total = sum(f[1] for f in self.files)
+		elapsed = time.monotonic() - self._start if self._start is not None else 0.
+		lines.append(f"Throughput: {total / 1e6:.1f} MB in {elapsed:.1f} s "
+					 f"({total / 1e6 / max(elapsed, 1e-9):.2f} MB/s aggregate), "
+					 f"{self.peak} peak / {self.limit} final concurrent transfers, "
+					 f"{self.temp_errors} temporary errors")
+		return '\n'.join(lines)
+
+
+class ListingCache:
+	"""
+	A local manifest of the remote day directory listings, with the size &
+	version of each file, so repeated syncs don't need to list the server.
+	
+	Files in a day directory keep changing for a while (new versions are
+	processed), but settle after about a week. Each listing is therefore
+	kept for a time which depends on the age of the day: TTL_BY_AGE gives
+	(maximum age in days, seconds to keep) in order, and older days are
+	kept for SETTLED_TTL seconds. The manifest is a JSON file, by default
+	in the OSV settings directory.
+	"""
+
+	TTL_BY_AGE = [(2, 10 * 60), (7, 6 * 3600)]
+	SETTLED_TTL = 30 * 86400
+
+	def __init__(self, path=None, refresh=False):
+		"""
+		Args:
+			path (Path, optional): Manifest file (default: ~/.gbmOSV/ftp_listing.json)
+			refresh (bool): Ignore cached listings, but still update the manifest
+		"""
+		self.path = Path(path) if path else Path.home() / '.gbmOSV' / 'ftp_listing.json'
+		self.refresh = refresh
+		self._lock = threading.Lock()
+		try:
+			with open(self.path) as f:
+				self.days = json.load(f)
+		except (OSError, ValueError):
+			self.days = {}
+
+	def ttl(self, date, now=None):
+		"""Seconds a listing of date (YYMMDD) stays valid"""
+		now = now if now is not None else time.time()
+		age = (now - datetime.strptime(date, '%y%m%d').timestamp()) / 86400.
+		for max_age, ttl in self.TTL_BY_AGE:
+			if age < max_age:
+				return ttl
+		return self.SETTLED_TTL
+
+	def get(self, date):
+		"""Return {filename: size} for date if there is a valid listing, else None"""
+		with self._lock:
+			entry = self.days.get(date)
+		if self.refresh or entry is None:
+			return None
+		now = time.time()
+		if now - entry['time'] > self.ttl(date, now):
+			return None
+		return {name: info['size'] for name, info in entry['files'].items()}
+
+	def put(self, date, files):
+		"""Store a listing, {filename: size or None}, and save the manifest"""
+		entry = {'time': time.time(),
+				 'files': {name: {'size': size, 'version': version_of(name)}
+						   for name, size in files.items()}}
+		with self._lock:
+			self.days[date] = entry
+			self.save()
+
+	def save(self):
+		"""Write the manifest, via a temporary file so it is never left half written"""
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+		with open(tmp, 'w') as f:
+			json.dump(self.days, f)
+		tmp.replace(self.path)
+
+
+def version_of(filename):
+	"""Version number of a GBM file name (e.g. 1 for ..._v01.pha), or None"""
+	match = re.search(r'_v(\d+)\.', filename)
+	return int(match.group(1)) if match else None
+
+
+def date_of(filename):
+	"""Date (YYMMDD) of a GBM file name, or None"""
+	match = re.search(r'_(\d{6})_v\d+\.', filename)
+	return match.group(1) if match else None
+
+
+def blake2(path, hasher=None):
+	"""Feed the contents of path to a blake2b hasher (a new one if not passed) and return it"""
+	hasher = hasher if hasher is not None else hashlib.blake2b()
+	with open(path, 'rb') as f:
+		while True:
+			block = f.read(1 << 20)
+			if not block:
+				break
+			hasher.update(block)
+	return hasher
+
+
+class Manifest:
+	"""
+	The size & blake2b checksum of each file downloaded to a directory, kept
+	in a JSON file there (NAME), so the archive can be checked without the
+	server. Downloads record their files as they finish; verify_archive
+	re-checks them.
+	"""
+
+	NAME = '.osv_manifest.json'
+
+	def __init__(self, directory):
+		self.path = Path(directory) / self.NAME
+		self._lock = threading.Lock()
+		try:
+			with open(self.path) as f:
+				self.files = json.load(f)
+		except (OSError, ValueError):
+			self.files = {}
+
+	def get(self, filename):
+		"""Return {'size', 'blake2b'} for filename, or None if not recorded"""
+		with self._lock:
+			return self.files.get(filename)
+
+	def record(self, filename, size, digest):
+		"""Record a downloaded file and save the manifest"""
+		with self._lock:
+			self.files[filename] = {'size': size, 'blake2b': digest, 'time': time.time()}
+			self.save()
+
+	def remove(self, filename):
+		with self._lock:
+			if self.files.pop(filename, None) is not None:
+				self.save()
+
+	def save(self):
+		"""Write the manifest, via a temporary file so it is never left half written"""
+		tmp = self.path.with_suffix('.tmp')
+		with open(tmp, 'w') as f:
+			json.dump(self.files, f, indent=0)
+		tmp.replace(self.path)
+
+	def check(self, filename):
+		"""
+		Check a file against its record. Returns 'ok', 'unrecorded',
+		'missing', 'partial' (shorter than recorded), 'size' or 'checksum'
+		"""
+		entry = self.get(filename)
+		path = self.path.parent / filename
+		if entry is None:
+			return 'unrecorded'
+		if not path.exists():
+			# An interrupted download can be resumed
+			return 'partial' if path.with_suffix(path.suffix + '.tmp').exists() else 'missing'
+		size = path.stat().st_size
+		if size < entry['size']:
+			return 'partial'
+		if size != entry['size']:
+			return 'size'
+		if blake2(path).hexdigest() != entry['blake2b']:
+			return 'checksum'
+		return 'ok'
+
+
 class DataDownloader:
 	"""Handle FTP connection and data downloads for a specific date"""
 
 	FTP_HOST = 'heasarc.gsfc.nasa.gov'
+	RETRY_DELAY = 1  # seconds, doubled on each retry
 
-	def __init__(self, date, output_dir=None):
+	def __init__(self, date, output_dir=None, pool=None, cache=None, scheduler=None):
 		"""
 		Initialize the downloader with a date in YYMMDD format
 		
 		Args:
 			date (str): Date in YYMMDD format
 			output_dir (Path, optional): Directory to save files
+			pool (FTPPool, optional): Connection pool to share, e.g. between
+				several days. One of 3 connections is created if not passed.
+			cache (ListingCache, optional): Manifest of directory listings
+			scheduler (TransferScheduler, optional): Shared concurrency &
+				bandwidth control, and throughput record
 		"""
 		# Validate date format
 		if not (len(date) == 6 and date.isdigit()):
@@ -89,7 +552,12 @@ class DataDownloader:
 		
 		# Create output directory if provided
 		self.output_dir = Path(output_dir) if output_dir else Path.cwd()
-		self.output_dir.mkdir(exist_ok=True)
+		self.output_dir.mkdir(parents=True, exist_ok=True)
+		self.pool = pool if pool is not None else FTPPool(self.FTP_HOST)
+		self.cache = cache
+		self.scheduler = scheduler
+		self.manifest = Manifest(self.output_dir)
+		self._listing = None
 
 	def connect(self):
 		"""Establish FTP connection and navigate to the data directory"""
@@ -105,50 +573,153 @@ class DataDownloader:
 		return ftp
 
 	def download_file(self, filename):
-		"""Download a single file with connection retry mechanism"""
+		"""
+		Download a single file with connection retry mechanism.
+		
+		A partial .tmp file left by a dropped connection, on an earlier
+		attempt or an earlier run, is continued from its current size using
+		REST. The file is only renamed once its size matches the server's,
+		and its size & checksum are then recorded in the manifest.
+		With a scheduler, the download waits for a free slot and its
+		throughput is recorded.
+		"""
+		if self.scheduler is None:
+			return self._download_file(filename)[0]
+		with self.scheduler.slot():
+			t0 = time.monotonic()
+			ok, received = self._download_file(filename)
+			self.scheduler.record(filename, received, time.monotonic() - t0, ok)
+		return ok
+
+	def _download_file(self, filename):
+		"""Download a single file, returning (success, bytes received)"""
 		output_path = self.output_dir / filename
 		temp_path = output_path.with_suffix(output_path.suffix + '.tmp')
 		
+		received = 0
+		
 		# Try up to 3 times to download the file
 		max_retries = 3
 		for attempt in range(max_retries):
 			try:
-				# Create a new FTP connection for each file to avoid timeout issues
-				with ftplib.FTP_TLS(self.FTP_HOST) as ftp:
-					ftp.login()
-					ftp.prot_p()
-					ftp.cwd(self.ftp_dir)
-					
-					# Download the file
-					with open(temp_path, 'wb') as f:
-						ftp.retrbinary(f'RETR {filename}', f.write)
+				# Connections are reused from the pool; one that has dropped
+				# raises here and is replaced on the next attempt
+				with self.pool.connection(self.ftp_dir) as ftp:
+					ftp.voidcmd('TYPE I')  # SIZE is in bytes only in binary mode
+					try:
+						remote_size = ftp.size(filename)
+					except ftplib.error_perm:
+						remote_size = None  # SIZE not supported, can't resume
+					offset = temp_path.stat().st_size if temp_path.exists() else 0
+					if remote_size is None or offset > remote_size:
+						offset = 0
+					# The checksum is computed as the file arrives, starting
+					# from what is already in a partial file
+					hasher = blake2(temp_path) if offset else hashlib.blake2b()
+					# Download the file, or the rest of it
+					if not temp_path.exists() or offset != remote_size:
+						if offset:
+							print(f"Resuming {filename} from {offset} of {remote_size} bytes")
+						with open(temp_path, 'ab' if offset else 'wb') as f:
+							def write(block):
+								nonlocal received
+								f.write(block)
+								hasher.update(block)
+								received += len(block)
+								if self.scheduler is not None:
+									self.scheduler.throttle(len(block))
+							ftp.retrbinary(f'RETR {filename}', write, rest=offset or None)
 					
-					# Rename to final filename after successful download
-					temp_path.rename(output_path)
-					print(f"Successfully downloaded {filename}")
-					return True
+				local_size = temp_path.stat().st_size
+				if remote_size is not None and local_size != remote_size:
+					if local_size > remote_size:
+						temp_path.unlink()
+					raise ftplib.error_temp(f"Size mismatch for {filename}: "
+											f"{local_size} of {remote_size} bytes")
+				# Rename to final filename after successful download
+				temp_path.replace(output_path)
+				self.manifest.record(filename, local_size, hasher.hexdigest())
+				print(f"Successfully downloaded {filename}")
+				return True, received
 					
-			except ftplib.error_temp as e:
-				# Temporary FTP error, might be worth retrying
+			except CONNECTION_ERRORS as e:
+				# Temporary FTP error or dropped connection, worth retrying
+				if self.scheduler is not None:
+					self.scheduler.temp_error()
 				if attempt < max_retries - 1:
-					retry_delay = 2 ** attempt  # Exponential backoff: 1, 2, 4 seconds
+					retry_delay = self.RETRY_DELAY * 2 ** attempt  # Exponential backoff: 1, 2, 4 seconds
 					print(f"Temporary error downloading {filename} (attempt {attempt+1}/{max_retries}): {e}")
 					print(f"Retrying in {retry_delay} seconds...")
-					import time
 					time.sleep(retry_delay)
 				else:
+					# The partial file is kept so the next run can resume it
 					print(f"Failed to download {filename} after {max_retries} attempts: {e}")
-					# Clean up temp file
-					with contextlib.suppress(FileNotFoundError):
-						temp_path.unlink()
-					return False
+					return False, received
 					
 			except Exception as e:
 				print(f"Error downloading {filename}: {e}")
 				# Clean up temporary file if download failed
 				with contextlib.suppress(FileNotFoundError):
 					temp_path.unlink()
+				return False, received
+
+	def list_files(self, file_types, detectors=None):
+		"""
+		List the files of each type on the server for this date
+		
+		Args:
+			file_types (list): List of file types ('ctime', 'cspec', 'poshist')
+			detectors (list): List of detector names or None for all detectors
+		
+		Returns:
+			dict: file type -> list of matching file names
+		"""
+		patterns = {'ctime': 'glg_*ctime*pha', 'cspec': 'glg_*cspec*pha', 'poshist': 'glg_*poshist*fit'}
+		
+		# Create a filter function to match detectors
+		def matches_detector(filename, file_type):
+			if file_type == 'poshist' or detectors is None:
+				return True
+			
+			# Extract detector name from filename (format: glg_TYPE_DETECTOR_DATE_...)
+			try:
+				detector = filename.split('_')[2]
+				return detector in detectors
+			except IndexError:
 				return False
+		
+		listing = self.listing()
+		file_listings = {}
+		for file_type in file_types:
+			files = sorted(fnmatch.filter(listing, patterns[file_type]))
+			file_listings[file_type] = [f for f in files if matches_detector(f, file_type)]
+		return file_listings
+
+	def listing(self):
+		"""
+		Return {filename: size} for the day directory. The size is None if
+		the server doesn't support MLSD. The cached listing is used if it is
+		still valid, otherwise the directory is listed once.
+		"""
+		if self._listing is not None:
+			return self._listing
+		if self.cache is not None:
+			self._listing = self.cache.get(self.date)
+			if self._listing is not None:
+				return self._listing
+		
+		# List files over a pooled connection, which is then reused
+		with self.pool.connection(self.ftp_dir) as ftp:
+			try:
+				files = {name: int(facts['size']) if 'size' in facts else None
+						 for name, facts in ftp.mlsd(facts=['type', 'size'])
+						 if facts.get('type', 'file') == 'file'}
+			except ftplib.error_perm:
+				files = {posixpath.basename(name): None for name in ftp.nlst()}
+		if self.cache is not None:
+			self.cache.put(self.date, files)
+		self._listing = files
+		return files
 
 	def download_files(self, file_types=None, detectors=None, max_workers=4):
 		"""
@@ -165,47 +736,19 @@ class DataDownloader:
 			
 		print(f"Connecting to {self.FTP_HOST}...")
 		try:
-			# Use a temporary connection just to list files
-			with ftplib.FTP_TLS(self.FTP_HOST) as ftp:
-				ftp.login()
-				ftp.prot_p()
-				
-				try:
-					ftp.cwd(self.ftp_dir)
-				except ftplib.error_perm as e:
-					raise ValueError(f"Cannot access directory {self.ftp_dir}: {e}")
-				
-				# Get file listings for each type
-				file_listings = {}
-				for file_type in file_types:
-					if file_type == 'ctime':
-						file_listings['ctime'] = ftp.nlst('glg_*ctime*pha')
-					elif file_type == 'cspec':
-						file_listings['cspec'] = ftp.nlst('glg_*cspec*pha')
-					elif file_type == 'poshist':
-						file_listings['poshist'] = ftp.nlst('glg_*poshist*fit')
+			file_listings = self.list_files(file_types, detectors)
+		except ftplib.error_perm as e:
+			print(f"Cannot access directory {self.ftp_dir}: {e}")
+			return
 		except Exception as e:
 			print(f"Connection failed: {e}")
 			return
 			
 		print(f"Connected. Accessed {self.ftp_dir}")
 		
-		# Create a filter function to match detectors
-		def matches_detector(filename, file_type):
-			if file_type == 'poshist' or detectors is None:
-				return True
-			
-			# Extract detector name from filename (format: glg_TYPE_DETECTOR_DATE_...)
-			try:
-				detector = filename.split('_')[2]
-				return detector in detectors
-			except IndexError:
-				return False
-		
 		# Build list of files to download
 		downloads = []
-		for file_type, files in file_listings.items():
-			matching_files = [f for f in files if matches_detector(f, file_type)]
+		for file_type, matching_files in file_listings.items():
 			if not matching_files:
 				print(f"No matching {file_type.upper()} files found")
 				continue
@@ -217,9 +760,12 @@ class DataDownloader:
 			print("No files to download")
 			return
 			
-		# Use a smaller number of workers to avoid connection limits
-		actual_workers = min(max_workers, 3)  # Cap at 3 parallel downloads by default
-		print(f"Starting downloads using {actual_workers} parallel connections")
+		# The number of parallel downloads adapts to the throughput & errors,
+		# up to the number of pooled connections
+		if self.scheduler is None:
+			self.scheduler = TransferScheduler(max_workers=min(max_workers, self.pool.size))
+		actual_workers = self.scheduler.max_workers
+		print(f"Starting downloads using up to {actual_workers} parallel connections")
 		
 		# Show progress
 		total_files = len(downloads)
@@ -249,12 +795,357 @@ class DataDownloader:
 				print(f"Progress: {completed + failed}/{total_files} ({completed} succeeded, {failed} failed)")
 		
 		print(f"Download complete. {completed}/{total_files} files saved to {self.output_dir}")
+		print(self.scheduler.report())
 		if failed:
 			print(f"Failed to download {failed} files. You may want to retry.")
 
 
+def _wait_downloads(downloads, progress=None):
+    """
+    Wait for a dict of download_file futures -> (downloader, filename)
+    
+    Returns:
+        tuple: (downloaded, failed) lists of file names
+    """
+    downloaded, failed = [], []
+    total = len(downloads)
+    for done, future in enumerate(concurrent.futures.as_completed(downloads), 1):
+        filename = downloads[future][1]
+        try:
+            ok = future.result()
+        except Exception as e:
+            print(f"Download error for {filename}: {e}")
+            ok = False
+        (downloaded if ok else failed).append(filename)
+        if progress:
+            progress(done, total, filename, ok)
+    return downloaded, failed
+
+
+def date_range(from_date, to_date):
+    """List the dates from from_date to to_date inclusive, both YYMMDD"""
+    try:
+        start = datetime.strptime(from_date, '%y%m%d')
+        end = datetime.strptime(to_date, '%y%m%d')
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date range: {from_date} to {to_date}. Dates must be YYMMDD")
+    if end < start:
+        raise ValueError(f"Invalid date range: {to_date} is before {from_date}")
+    return [(start + timedelta(days=i)).strftime('%y%m%d') for i in range((end - start).days + 1)]
+
+
+def sync_range(from_date, to_date, file_types, detectors=None, output_dir=None, max_workers=3, pool=None,
+               cache=None, scheduler=None):
+    """
+    Download a range of days, each into output_dir/YYMMDD.
+    
+    All day directories are listed first over a shared connection pool to
+    make the full download plan. Files already present locally with the
+    same size as on the server are skipped. The rest are downloaded in
+    parallel with a running progress count and a summary at the end.
+    With a ListingCache, days with a valid cached listing (which includes
+    the sizes) are planned without contacting the server. The number of
+    parallel downloads is adapted by a TransferScheduler, which can also
+    limit the bandwidth; one is made with max_workers if not passed.
+    
+    Returns:
+        tuple: (downloaded, skipped, failed) lists of file names
+    """
+    output_dir = Path(output_dir) if output_dir else Path.cwd()
+    days = date_range(from_date, to_date)
+    own_pool = pool is None
+    if own_pool:
+        pool = FTPPool(DataDownloader.FTP_HOST, size=max_workers)
+    if scheduler is None:
+        scheduler = TransferScheduler(max_workers=max_workers)
+    skipped, failed = [], []
+    t0 = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # List every day
+            print(f"Listing {len(days)} days from {days[0]} to {days[-1]} on {DataDownloader.FTP_HOST}...")
+            downloaders = [DataDownloader(day, output_dir / day, pool=pool, cache=cache, scheduler=scheduler)
+                           for day in days]
+            listings = {executor.submit(d.list_files, file_types, detectors): d for d in downloaders}
+            planned = []
+            for future in concurrent.futures.as_completed(listings):
+                downloader = listings[future]
+                try:
+                    file_listings = future.result()
+                except Exception as e:
+                    print(f"Cannot list {downloader.date}: {e}")
+                    failed.append(downloader.date)
+                    continue
+                planned.extend((downloader, f) for files in file_listings.values() for f in files)
+            
+            # Check the size of any file which is already here. One which
+            # matches but isn't in the manifest (e.g. from an older version)
+            # has its checksum recorded so verify can check it later
+            def up_to_date(downloader, filename):
+                local = downloader.output_dir / filename
+                if not local.exists():
+                    return False
+                local_size = local.stat().st_size
+                size = downloader.listing().get(filename)
+                if size is None:
+                    with pool.connection(downloader.ftp_dir) as ftp:
+                        ftp.voidcmd('TYPE I')
+                        size = ftp.size(filename)
+                if size != local_size:
+                    return False
+                entry = downloader.manifest.get(filename)
+                if entry is None:
+                    downloader.manifest.record(filename, local_size, blake2(local).hexdigest())
+                    return True
+                return entry['size'] == local_size
+            checks = [executor.submit(up_to_date, d, f) for d, f in planned]
+            plan = []
+            for (downloader, filename), check in zip(planned, checks):
+                try:
+                    present = check.result()
+                except Exception:
+                    present = False
+                if present:
+                    skipped.append(filename)
+                else:
+                    plan.append((downloader, filename))
+            print(f"Plan: {len(planned)} files listed, {len(skipped)} already present, "
+                  f"{len(plan)} to download")
+            
+            # Download
+            def progress(done, total, filename, ok):
+                status = 'ok' if ok else 'FAILED'
+                print(f"Progress: {done}/{total} ({status} {filename})")
+            downloads = {executor.submit(d.download_file, f): (d, f) for d, f in plan}
+            downloaded, fail = _wait_downloads(downloads, progress)
+            failed.extend(fail)
+    finally:
+        if own_pool:
+            pool.close()
+    
+    nbytes = sum((d.output_dir / f).stat().st_size for d, f in plan if f in downloaded)
+    dt = time.monotonic() - t0
+    print(f"Sync complete in {dt:.1f} s: {len(downloaded)} downloaded ({nbytes / 1e6:.1f} MB, "
+          f"{nbytes / 1e6 / max(dt, 1e-9):.1f} MB/s), {len(skipped)} skipped, {len(failed)} failed")
+    if downloaded:
+        print(scheduler.report(per_file=False))
+    if failed:
+        print(f"Failed: {' '.join(sorted(failed))}")
+    return downloaded, skipped, failed
+
+
+def download_missing(missing_files, spec_type, data_dir=None, max_workers=3, pool=None, progress=None,
+                     cache=None):
+    """
+    Download the files reported missing by orbsub_classes.Files in process.
+    
+    All days and file types are handled by one pool of worker threads and
+    one pool of connections, so at most max_workers transfers run at once.
+    Day directories are listed in parallel and each file is queued as soon
+    as its day has been listed. Files are saved to data_dir/YYMMDD, where
+    Files looks for them.
+    
+    Args:
+        missing_files (dict): Files.missingFiles - 'pos' is a list of days,
+            'ctime'/'cspec' map each day to a list of detectors
+        spec_type (str): 'CTIME' or 'CSPEC'
+        data_dir (Path, optional): Top data directory (default: current directory)
+        max_workers (int): Maximum number of parallel listings/downloads
+        pool (FTPPool, optional): Connection pool, one is created if not passed
+        progress (callable, optional): Called as progress(done, total, name, ok)
+            after each file
+        cache (ListingCache, optional): Manifest of directory listings
+    
+    Returns:
+        tuple: (downloaded, failed) lists of file names
+    """
+    data_dir = Path(data_dir) if data_dir else Path.cwd()
+    spec_type = spec_type.lower()
+    spec_days = {day: dets for day, dets in missing_files[spec_type].items() if dets}
+    days = sorted(set(missing_files['pos']) | set(spec_days))
+    
+    own_pool = pool is None
+    if own_pool:
+        pool = FTPPool(DataDownloader.FTP_HOST, size=max_workers)
+    downloaded, failed = [], []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            listings = {}
+            for day in days:
+                downloader = DataDownloader(day, data_dir / day, pool=pool, cache=cache)
+                file_types = []
+                if day in missing_files['pos']:
+                    file_types.append('poshist')
+                if day in spec_days:
+                    file_types.append(spec_type)
+                future = executor.submit(downloader.list_files, file_types, spec_days.get(day))
+                listings[future] = downloader
+            
+            downloads = {}
+            for future in concurrent.futures.as_completed(listings):
+                downloader = listings[future]
+                day = downloader.date
+                try:
+                    file_listings = future.result()
+                except Exception as e:
+                    print(f"Cannot list {downloader.ftp_dir}: {e}")
+                    failed.append(day)
+                    continue
+                # Anything requested but not on the server counts as failed
+                if 'poshist' in file_listings and not file_listings['poshist']:
+                    failed.append(f"glg_poshist_all_{day}")
+                for det in spec_days.get(day, []):
+                    if not any(f.split('_')[2] == det for f in file_listings.get(spec_type, [])):
+                        failed.append(f"glg_{spec_type}_{det}_{day}")
+                for files in file_listings.values():
+                    for filename in files:
+                        downloads[executor.submit(downloader.download_file, filename)] = (downloader, filename)
+            
+            done, fail = _wait_downloads(downloads, progress)
+            downloaded.extend(done)
+            failed.extend(fail)
+    finally:
+        if own_pool:
+            pool.close()
+    
+    print(f"Downloaded {len(downloaded)} files to {data_dir}, {len(failed)} failed")
+    return downloaded, failed
+
+
+def verify_archive(data_dir=None, max_workers=4, requeue=True, pool=None, cache=None, scheduler=None):
+    """
+    Re-check downloaded files against their manifests and re-download bad ones.
+
+    data_dir and each of its subdirectories (e.g. the YYMMDD day directories)
+    are searched for manifests. Every recorded file is checked for its size
+    & checksum in parallel, and .tmp files left by interrupted downloads are
+    found. GBM files which aren't recorded are compared with the size on the
+    server (when requeue is set) and recorded if it matches. Unrecorded
+    files with no date in their name (e.g. local products) can't be looked
+    up on the server, so they are listed as unknown and left alone. With
+    requeue, bad files are removed and downloaded again, partial files are
+    resumed.
+
+    Returns:
+        tuple: (ok, repaired, bad) lists of file names, bad being the files
+            still missing or corrupt
+    """
+    data_dir = Path(data_dir) if data_dir else Path.cwd()
+    dirs = [d for d in [data_dir] + sorted(p for p in data_dir.iterdir() if p.is_dir())
+            if (d / Manifest.NAME).exists() or any(d.glob('glg_*'))]
+    print(f"Verifying {len(dirs)} directories under {data_dir}...")
+
+    def check(manifest, filename):
+        try:
+            return manifest.check(filename)
+        except OSError:
+            return 'unreadable'
+
+    ok, bad = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        checks = {}
+        for d in dirs:
+            manifest = Manifest(d)
+            names = set(manifest.files)
+            names.update(p.name for p in d.glob('glg_*') if p.suffix != '.tmp')
+            names.update(p.name[:-4] for p in d.glob('glg_*.tmp'))
+            for filename in sorted(names):
+                checks[executor.submit(check, manifest, filename)] = (manifest, filename)
+
+        unrecorded, unknown = [], []
+        for future in concurrent.futures.as_completed(checks):
+            manifest, filename = checks[future]
+            status = future.result()
+            if status == 'ok':
+                ok.append(filename)
+            elif status == 'unrecorded' and not date_of(filename):
+                unknown.append(manifest.path.parent / filename)
+            elif status == 'unrecorded':
+                if (manifest.path.parent / filename).exists():
+                    unrecorded.append((manifest, filename))
+                else:
+                    bad.append((manifest, filename, 'partial'))
+            else:
+                bad.append((manifest, filename, status))
+        print(f"{len(ok)} files ok, {len(bad)} bad, {len(unrecorded)} not in a manifest, "
+              f"{len(unknown)} unknown")
+        for manifest, filename, status in sorted(bad, key=lambda b: b[1]):
+            print(f"  {status}: {manifest.path.parent / filename}")
+        for path in sorted(unknown):
+            print(f"  unknown (no date, not in a manifest): {path}")
+        if not requeue:
+            return ok, [], [b[1] for b in bad] + [u[1] for u in unrecorded]
+
+        # Re-queue the bad files, and check unrecorded ones against the server
+        own_pool = pool is None
+        if own_pool:
+            pool = FTPPool(DataDownloader.FTP_HOST, size=max_workers)
+        if scheduler is None:
+            scheduler = TransferScheduler(max_workers=max_workers)
+        downloaders = {}
+        lock = threading.Lock()
+        def downloader_for(manifest, filename):
+            key = (manifest.path.parent, date_of(filename))
+            with lock:
+                if key not in downloaders:
+                    downloaders[key] = DataDownloader(key[1], key[0], pool=pool, cache=cache,
+                                                      scheduler=scheduler)
+                    downloaders[key].manifest = manifest
+                return downloaders[key]
+
+        def adopt(manifest, filename):
+            path = manifest.path.parent / filename
+            if downloader_for(manifest, filename).listing().get(filename) == path.stat().st_size:
+                manifest.record(filename, path.stat().st_size, blake2(path).hexdigest())
+                return True
+            return False
+
+        def repair(manifest, filename, status):
+            path = manifest.path.parent / filename
+            if status != 'partial':
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+                with contextlib.suppress(FileNotFoundError):
+                    path.with_suffix(path.suffix + '.tmp').unlink()
+            manifest.remove(filename)
+            return downloader_for(manifest, filename).download_file(filename)
+
+        unchecked = []
+        try:
+            for (manifest, filename), future in [(u, executor.submit(adopt, *u)) for u in unrecorded]:
+                try:
+                    if future.result():
+                        ok.append(filename)
+                        continue
+                except Exception as e:
+                    print(f"Cannot check {filename} on the server: {e}")
+                    unchecked.append(filename)
+                    continue
+                bad.append((manifest, filename, 'size'))
+            downloads = {executor.submit(repair, *b): (None, b[1]) for b in bad if date_of(b[1])}
+            repaired, failed = _wait_downloads(downloads)
+        finally:
+            if own_pool:
+                pool.close()
+
+    failed += [b[1] for b in bad if not date_of(b[1])] + unchecked
+    print(f"Verify complete: {len(ok)} ok, {len(repaired)} re-downloaded, {len(failed)} still bad")
+    return ok, repaired, failed
+
+
 def main(argv=None):
     """Main entry point for the script"""
+    # The verify command has its own arguments
+    if (argv if argv else sys.argv[1:])[:1] == ['verify']:
+        args = parse_verify_args((argv if argv else sys.argv[1:])[1:])
+        try:
+            ok, repaired, bad = verify_archive(args.data_dir, max_workers=args.parallel,
+                                               requeue=not args.no_requeue, cache=ListingCache())
+        except Exception as e:
+            print(f"Error: {e}")
+            return 1
+        return 1 if bad else 0
+    
     # Handle passed arguments or use sys.argv
     if argv:
         # Save original args and replace with passed args
@@ -275,14 +1166,33 @@ def main(argv=None):
     if args.poshist:
         file_types.append('poshist')
     
+    if not file_types:
+        print("No file types specified. Please use --ctime, --cspec, or --poshist")
+        return 1
+    
     # Set up and run the downloader
     try:
-        downloader = DataDownloader(args.date, args.output_dir)
-        downloader.download_files(
-            file_types=file_types,
-            detectors=args.dets,
-            max_workers=args.parallel
-        )
+        cache = None if args.no_cache else ListingCache(refresh=args.refresh)
+        bandwidth = args.max_rate * 1e6 if args.max_rate else None
+        scheduler = TransferScheduler(max_workers=args.parallel, bandwidth=bandwidth)
+        if args.from_date or args.to_date:
+            with FTPPool(DataDownloader.FTP_HOST, size=args.parallel) as pool:
+                downloaded, skipped, failed = sync_range(
+                    args.from_date, args.to_date or args.from_date, file_types,
+                    detectors=args.dets, output_dir=args.output_dir,
+                    max_workers=args.parallel, pool=pool, cache=cache, scheduler=scheduler)
+            return 1 if failed else 0
+        if not args.date:
+            print("Error: give a date, or a range with --from and --to")
+            return 1
+        with FTPPool(DataDownloader.FTP_HOST, size=args.parallel) as pool:
+            downloader = DataDownloader(args.date, args.output_dir, pool=pool, cache=cache,
+                                        scheduler=scheduler)
+            downloader.download_files(
+                file_types=file_types,
+                detectors=args.dets,
+                max_workers=args.parallel
+            )
     except Exception as e:
         print(f"Error: {e}")
         return 1
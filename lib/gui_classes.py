@@ -3,6 +3,9 @@ import sys
 import time
 import platform
 import pickle
+import copy
+import queue
+import threading
 from collections import defaultdict
 from functools import lru_cache
 
@@ -26,6 +29,10 @@ from lib.config.lookupConfig import getLUCfg
 
 from . import OrbsubExtras as extras
 
+# PHAII exports of more counts (bins x channels) than this are streamed
+# (Pha_data.write_phaii chunkSize), e.g. several hours of CSPEC
+PHAII_STREAM_COUNTS = 1000000
+PHAII_CHUNK_SIZE = 4096
 
 class Logger:
     '''
@@ -78,6 +85,99 @@ class Logger:
     def __str__(self):
         return self.mes
         
+class ExportQueue:
+    '''
+    Runs export jobs one at a time on a background thread so the GUI stays
+    responsive while large products are written. Jobs are queued with add()
+    and progress messages are passed to report, which is called from the 
+    worker thread - the GUI wraps it with wx.CallAfter. cancel() drops any
+    queued jobs and stops the running one if it was added as cancellable.
+    '''
+    def __init__(self, report, onError = None):
+        self.report = report
+        self.onError = onError
+        self.jobs = queue.Queue()
+        # The cancel events of the jobs queued or running
+        self.stops = []
+        self.thread = None
+        self.lock = threading.Lock()
+        self.nDone = 0
+        self.nQueued = 0
+    def add(self, label, func, *args, cancellable = False, **kwargs):
+        '''
+        Queue func(*args, **kwargs), label is shown in the status bar. If
+        cancellable, func is passed its own threading.Event as cancel, which
+        it checks to stop early, returning nothing when it did.
+        '''
+        stop = threading.Event()
+        if cancellable:
+            kwargs['cancel'] = stop
+        with self.lock:
+            if not self.pending():
+                self.nDone = 0
+                self.nQueued = 0
+            self.nQueued += 1
+            self.stops.append(stop)
+            self.jobs.put((label, func, args, kwargs, stop))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target = self._run, daemon = True)
+                self.thread.start()
+        self.report('Queued export of %s (%i pending)' %(label, self.pending()))
+    def pending(self):
+        ''' Number of jobs queued or running '''
+        return self.nQueued - self.nDone
+    def cancel(self):
+        ''' Drop queued jobs & flag the running one to stop '''
+        nDropped = 0
+        with self.lock:
+            for stop in self.stops:
+                stop.set()
+            while True:
+                try:
+                    stop = self.jobs.get_nowait()[-1]
+                except queue.Empty:
+                    break
+                self.stops.remove(stop)
+                self.jobs.task_done()
+                nDropped += 1
+            self.nQueued -= nDropped
+        return nDropped
+    def _run(self):
+        while True:
+            try:
+                label, func, args, kwargs, stop = self.jobs.get(timeout = 1)
+            except queue.Empty:
+                with self.lock:
+                    if self.jobs.empty():
+                        self.thread = None
+                        return
+                continue
+            # Cancelled after it was taken off the queue but before it started
+            cancelled = stop.is_set()
+            try:
+                if not cancelled:
+                    self.report('Exporting %s (%i/%i)' %(label, self.nDone + 1, self.nQueued))
+                    names = func(*args, **kwargs)
+                    # Only cancellable jobs stop early, returning nothing if they did
+                    cancelled = 'cancel' in kwargs and stop.is_set() and not names
+                if cancelled:
+                    mes = 'Export of %s cancelled' %label
+                else:
+                    mes = 'Exported %s' %label
+                    if names:
+                        mes += ': %s' %', '.join(os.path.basename(n) for n in names)
+            except Exception as e:
+                mes = 'Export of %s failed' %label
+                if self.onError:
+                    self.onError('%s:\n%s' %(mes, e))
+            with self.lock:
+                self.stops.remove(stop)
+                self.nDone += 1
+                if self.pending():
+                    mes += ' - %i more queued' %self.pending()
+            self.jobs.task_done()
+            self.report(mes)
+
 class GUI_txtFrame(wx.Frame):
     '''
     Frame which consits of a text box with option to save contents to file.
@@ -233,7 +333,12 @@ class OrbsubGUI(wx.Frame):
         self.log = Logger(progVer = orbSubVersion)  
         self.cfgGUI = False      
         self.orbsub = False   
+        # The osv_classes.OSV_Instance shown, to run it again with new options
+        self.instance = False
         self.curDet = False
+        # Exports are written on a background thread, see ExportQueue
+        self.exports = ExportQueue(lambda mes: wx.CallAfter(self.UpdateStatusBar, mes),
+                                   onError = lambda mes: wx.CallAfter(self.ErrorMes, mes))
 
         # pltLines - this variable is used to store the data that is plotted - this
         # means we can delete from the plot when change detectors. For convenience
@@ -354,10 +459,15 @@ class OrbsubGUI(wx.Frame):
 
         self.expM_pii = self.expMenu.Append(-1, "PHAII", "Text")
         self.expM_pha = self.expMenu.Append(-1, "PHA", "Text")
+        self.expM_ph2 = self.expMenu.Append(-1, "PHA TYPE II (LC selections)", "Text")
         self.expM_alc = self.expMenu.Append(-1, "ASCII LC", "Text")
+        self.expM_all = self.expMenu.Append(-1, "PHAII (all detectors)", "Text")
+        self.expM_cnl = self.expMenu.Append(-1, "Cancel exports", "Text")
         
         self.expM_occ = self.expMenu.Append(-1, "Occultation Times", "Text")
+        self.expM_stg = self.expMenu.Append(-1, "Stage Timing (JSON)", "Text")
         
+        self.mscM_opt = self.mscMenu.Append(-1, "Change Options", "Text")
         self.mscM_log = self.mscMenu.Append(-1, "Show Log", "Text")
         self.mscM_abt = self.mscMenu.Append(-1, "About", "Text")
         
@@ -422,6 +532,7 @@ class OrbsubGUI(wx.Frame):
             self.Bind(wx.EVT_BUTTON, self.popUpMenu, btn)
         
         # Bind methods to menus
+        self.Bind(wx.EVT_MENU, self.OnChangeOptions, self.mscM_opt)
         self.Bind(wx.EVT_MENU, self.OnShowLog, self.mscM_log)
         self.Bind(wx.EVT_MENU, self.OnAbout, self.mscM_abt)
         # self.Bind(wx.EVT_MENU, self.OnConfig, self.mscM_cfg)
@@ -445,7 +556,11 @@ class OrbsubGUI(wx.Frame):
         self.Bind(wx.EVT_MENU, self.OnExportPHAII, self.expM_pii)
         self.Bind(wx.EVT_MENU, self.OnExportASCLC, self.expM_alc)
         self.Bind(wx.EVT_MENU, self.OnExportPHA, self.expM_pha)
+        self.Bind(wx.EVT_MENU, self.OnExportPHATypeII, self.expM_ph2)
+        self.Bind(wx.EVT_MENU, self.OnExportPHAIIAll, self.expM_all)
+        self.Bind(wx.EVT_MENU, self.OnCancelExports, self.expM_cnl)
         self.Bind(wx.EVT_MENU, self.OnExportOccultation, self.expM_occ)
+        self.Bind(wx.EVT_MENU, self.OnExportStages, self.expM_stg)
 		# Bind rebin options
         self.Bind(wx.EVT_MENU, self.onRebin, self.rebM_inv )
         self.Bind(wx.EVT_MENU, self.onLogCounts, self.rebM_counts )
@@ -470,6 +585,9 @@ class OrbsubGUI(wx.Frame):
         self.orbsub = orbsub
         self.dets = list(orbsub.data.keys())
         self.dets.sort()        
+        if self.curDet not in self.dets:
+            # Run again without the detector shown
+            self.curDet = False
         # Either generate default lookup or load one
         # if one exists and autoLoadLU has been set
         # _val is just a boolean keyword we use to 
@@ -1191,16 +1309,56 @@ class OrbsubGUI(wx.Frame):
     def OnExportPHAII(self, event):
         names = self.getOutputName( 'phaii')
         if not len(names): return 
-        print(self.curDet, names)
-        self.orbsub.data[self.curDet].write_phaii(self.orbsub.opts, names = names,)
+        self.queuePHAII(self.curDet, names)
+    def OnExportPHAIIAll(self, event):
+        ''' Queue PHAII files for every detector into a chosen directory '''
+        dlg = wx.DirDialog(self, "Directory for PHAII files", os.getcwd())
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        outDir = dlg.GetPath()
+        dlg.Destroy()
+        for det in self.dets:
+            stem = os.path.join(outDir, self.defaultOutputName(det))
+            self.queuePHAII(det, [stem.replace('.XX', '.PHA'), stem.replace('.XX', '.BAK')])
+    def queuePHAII(self, det, names):
+        # Only large exports are streamed, which can then be cancelled part way
+        det_data = self.orbsub.data[det]
+        if det_data.data['src'][1].size > PHAII_STREAM_COUNTS:
+            self.exports.add('%s PHAII' %det, det_data.write_phaii, self.orbsub.opts,
+                             names = names, chunkSize = PHAII_CHUNK_SIZE, cancellable = True)
+        else:
+            self.exports.add('%s PHAII' %det, det_data.write_phaii, self.orbsub.opts,
+                             names = names)
     def OnExportPHA(self,event):
         names = self.getOutputName( 'pha')
         if not len(names): return
-        self.orbsub.data[self.curDet].write_pha(self.orbsub.opts, names = names, lcMask = self.lcMask,)
+        # Masks are copied as the user can keep selecting while the job waits
+        self.exports.add('%s PHA' %self.curDet, self.orbsub.data[self.curDet].write_pha,
+                         self.orbsub.opts, names = names, lcMask = self.lcMask.copy(),)
+    def OnExportPHATypeII(self, event):
+        ''' Export one spectrum per light curve selection in a single file '''
+        edges = self._LU[self.curDet]['lc']
+        if len(edges) < 2:
+            self.ErrorMes("Make at least one light curve selection first", title = "Error")
+            return
+        names = self.getOutputName( 'pha2')
+        if not len(names): return
+        self.exports.add('%s PHA TYPE II' %self.curDet, self.orbsub.data[self.curDet].write_pha_typeii,
+                         self.orbsub.opts, list(edges), names = names,
+                         specMask = self.specMask.copy(), offset = self.orbsub.opts.tzero)
     def OnExportASCLC(self,event):
         names = self.getOutputName( 'ascii')
         if not len(names): return
-        self.orbsub.data[self.curDet].write_ascii(self.orbsub.opts, names = names, lcMask = self.lcMask, specMask = self.specMask)
+        self.exports.add('%s ASCII LC' %self.curDet, self.orbsub.data[self.curDet].write_ascii,
+                         self.orbsub.opts, names = names, lcMask = self.lcMask.copy(),
+                         specMask = self.specMask.copy())
+    def OnCancelExports(self, event):
+        if not self.exports.pending():
+            self.UpdateStatusBar('No exports running')
+            return
+        nDropped = self.exports.cancel()
+        self.UpdateStatusBar('Cancelling exports (%i queued dropped)' %nDropped)
     
     def OnExportOccultation(self, event):
         '''
@@ -1233,6 +1391,51 @@ class OrbsubGUI(wx.Frame):
         
         dlg.Destroy()
     
+    def OnChangeOptions(self, event):
+        '''
+        Change the options of this instance & run it again, redoing only what
+        the change affects, e.g. adding an offset reads & bins just the new
+        regions (OrbSub.update)
+        '''
+        if not self.orbsub or not self.instance:
+            self.ErrorMes("No data loaded", title="Error")
+            return
+        opts = copy.deepcopy(self.orbsub.opts)
+        opts.offset = [i for i in opts.offset if i != 'src']
+        opts.error = opts.warning = False
+        opts.err_mes = opts.warning_mes = ''
+        with osv_classes.OptDialog(self, opts, title="OSV Options") as dlg:
+            if dlg.ShowModal() != wx.ID_OK:
+                return
+            opts = dlg.opts
+        opts.check()
+        if opts.error:
+            self.ErrorMes(opts.err_mes, title="Error encountered")
+            return
+        self.UpdateStatusBar('Running with the new options...')
+        self.instance.rerun(opts)
+        self.UpdateStatusBar('')
+
+    def OnExportStages(self, event):
+        '''
+        Export the time, CPU, bytes read & array sizes of each stage of the
+        orbital subtraction to a JSON file
+        '''
+        if not self.orbsub:
+            self.ErrorMes("No data loaded", title="Error")
+            return
+        defaultName = f"glg_osv_stages_{self.orbsub.opts.name}.json"
+        dlg = wx.FileDialog(self, "Export Stage Timing", os.getcwd(), defaultName,
+                           "JSON files (*.json)|*.json|All files (*.*)|*.*",
+                           wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if dlg.ShowModal() == wx.ID_OK:
+            filepath = dlg.GetPath()
+            try:
+                self.orbsub.instrument.toJSON(filepath)
+            except Exception as e:
+                self.ErrorMes(f"Error writing stage timing file:\n{str(e)}", title="Export Error")
+        dlg.Destroy()
+
     def _writeOccultationFile(self, filepath):
         '''
         Write occultation time intervals to a text file
@@ -1261,11 +1464,15 @@ class OrbsubGUI(wx.Frame):
             f.write(f"\n# Total occultation intervals: {len(occStart)}\n")
             f.write(f"# Total occultation time: {np.sum(occEnd - occStart):.6f} seconds\n")
     
+    def defaultOutputName(self, det):
+        return "glg_osv-%s_%s_%s.XX" %(self.orbsub.opts.spec_type.lower(), self.orbsub.opts.name, det)
+
     def getOutputName(self, otype):
         ''' getoutput name for files
         '''
-        exts = {'phaii': ['PHA', 'BAK'], 'pha': ['PHA1', 'BAK1'], 'ascii': ['src', 'bkg']}
-        defaultName = ("glg_osv-%s_%s_%s.XX" %(self.orbsub.opts.spec_type.lower(), self.orbsub.opts.name, self.curDet))
+        exts = {'phaii': ['PHA', 'BAK'], 'pha': ['PHA1', 'BAK1'], 'pha2': ['PHA2', 'BAK2'],
+                'ascii': ['src', 'bkg']}
+        defaultName = self.defaultOutputName(self.curDet)
         names = []
         for i,j in zip(exts[otype], ['source', 'background']):
             name = defaultName.replace(".XX",".%s"%i) 
@@ -1292,8 +1499,12 @@ class OrbsubGUI(wx.Frame):
     
     def OnClose(self, event):
         '''Handle close event'''    
-        val = self.YesNoMes("Are you sure you want to quit?", "Exit?")
+        mes = "Are you sure you want to quit?"
+        if self.exports.pending():
+            mes = "%i export(s) still running and will be cancelled.\n%s" %(self.exports.pending(), mes)
+        val = self.YesNoMes(mes, "Exit?")
         if val:
+            self.exports.cancel()
             event.Skip()
 
     def ErrorMes(self, mes, title = 'Error', style =wx.OK|wx.ICON_ERROR ):
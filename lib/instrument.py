@@ -0,0 +1,133 @@
+'''
+Records what each stage of an orbital subtraction costs: wall & CPU
+seconds, the bytes of data files read & the sizes of the arrays made,
+per stage & per detector. An OrbSub fills one as it runs (OrbSub.instrument),
+it is shown in the Logger & exported as JSON with the summary of a
+headless run, to find bottlenecks & regressions.
+
+    inst = Instrument()
+    with inst.stage('do_orbsub', det = 'n0') as rec:
+        inst.addReads(rec, files, preloaded)
+        ...
+        inst.addArrays(rec, counts = det_data.counts)
+    inst.toJSON('stages.json')
+
+CPU time is that of the thread running the stage, work it hands to other
+threads is recorded in their own stages. If tracemalloc is tracing (osv.py
+--trace-memory) the peak memory allocated during each stage is recorded
+too, as memPeak; tracemalloc has a single peak, so it is only a rough
+guide for stages run in parallel threads. Functions passed to addObserver are called with every
+finished record, of any Instrument.
+'''
+
+import os
+import json
+import time
+import threading
+import contextlib
+import tracemalloc
+
+_observers = []
+_stack = threading.local()
+
+def addObserver(func):
+    _observers.append(func)
+
+def removeObserver(func):
+    _observers.remove(func)
+
+
+class Instrument:
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, det = None):
+        ''' Time the enclosed code as stage name (of detector det), yielding its record '''
+        rec = {'stage': name, 'det': det, 'wall': 0., 'cpu': 0., 'files': 0, 'bytesRead': 0,
+               'arrays': {}}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            # Peaks of enclosed stages are passed up, as each resets the peak
+            stack = _stack.__dict__.setdefault('frames', [])
+            frame = {'start': tracemalloc.get_traced_memory()[0], 'peak': 0}
+            stack.append(frame)
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield rec
+        finally:
+            rec['wall'] = time.perf_counter() - wall
+            rec['cpu'] = time.thread_time() - cpu
+            if tracing:
+                stack.pop()
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                rec['memPeak'] = max(peak - frame['start'], 0)
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            with self.lock:
+                self.records.append(rec)
+            for func in list(_observers):
+                func(rec)
+
+    @staticmethod
+    def addReads(rec, paths, preloaded = {}):
+        ''' Count the files of paths which will be read, i.e. aren't in preloaded '''
+        for path in paths:
+            if path not in preloaded:
+                rec['files'] += 1
+                try:
+                    rec['bytesRead'] += os.path.getsize(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def addArrays(rec, **arrays):
+        ''' Record the shape & bytes of each array, by name '''
+        for name, arr in arrays.items():
+            if arr is not None:
+                rec['arrays'][name] = {'shape': list(arr.shape), 'bytes': int(arr.nbytes)}
+
+    def clear(self):
+        with self.lock:
+            self.records = []
+
+    def totals(self):
+        ''' The records summed by stage, in the order the stages were first run '''
+        totals = {}
+        with self.lock:
+            records = list(self.records)
+        for rec in records:
+            tot = totals.setdefault(rec['stage'], {'calls': 0, 'wall': 0., 'cpu': 0., 'files': 0,
+                                                   'bytesRead': 0, 'arrayBytes': 0})
+            tot['calls'] += 1
+            for key in ('wall', 'cpu', 'files', 'bytesRead'):
+                tot[key] += rec[key]
+            tot['arrayBytes'] += sum(i['bytes'] for i in rec['arrays'].values())
+        return totals
+
+    def asDict(self):
+        with self.lock:
+            records = [dict(rec) for rec in self.records]
+        return {'totals': self.totals(), 'records': records}
+
+    def toJSON(self, fileName):
+        with open(fileName, 'w') as f:
+            json.dump(self.asDict(), f, indent = 1)
+
+    def __str__(self):
+        mes = '<Begin Stage Timing>\n'
+        mes += '%-12s %-4s %9s %9s %6s %10s %10s %10s\n' %('stage', 'det', 'wall (s)', 'cpu (s)', 'files',
+                                                          'read (MB)', 'arrays (MB)', 'peak (MB)')
+        with self.lock:
+            records = list(self.records)
+        for rec in records:
+            arrayBytes = sum(i['bytes'] for i in rec['arrays'].values())
+            peak = '%10.2f' %(rec['memPeak'] / 1e6) if 'memPeak' in rec else '%10s' %'-'
+            mes += '%-12s %-4s %9.3f %9.3f %6i %10.2f %10.2f %s\n' %(rec['stage'], rec['det'] or '-',
+                                                                      rec['wall'], rec['cpu'], rec['files'],
+                                                                      rec['bytesRead'] / 1e6, arrayBytes / 1e6,
+                                                                      peak)
+        mes += '<End Stage Timing>\n\n'
+        return mes
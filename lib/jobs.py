@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+'''
+A resumable queue of orbital subtraction jobs (osv.py jobs), for running
+many triggers. The jobs are kept in a SQLite file with their state
+(pending, running, done, failed) & pulled by a pool of worker processes,
+each running the headless pipeline (pipeline.runPipeline). If the run is
+stopped or the machine crashes, running it again carries on with only the
+unfinished jobs. The summary of each job, with the time taken by each
+stage, is stored with it.
+
+    python osv.py jobs add triggers.txt --CSPEC --dets 0 1 --offsets 30
+    python osv.py jobs run --workers 4 --out-dir out
+    python osv.py jobs status
+    python osv.py jobs retry
+
+The triggers file has a trigger per line: tzero [name [ra dec]], blank
+lines & lines starting with # are skipped. The queue is osv_jobs.sqlite
+unless --db is given.
+'''
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import multiprocessing
+
+from . import pipeline
+
+DB = 'osv_jobs.sqlite'
+STATES = ['pending', 'running', 'done', 'failed']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    options TEXT UNIQUE,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    pid INTEGER,
+    started REAL,
+    finished REAL,
+    exit_code INTEGER,
+    status TEXT,
+    timing TEXT,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+'''
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    '''
+    The job queue in the SQLite file path. Each process (the runner & each
+    worker) opens its own JobQueue. Jobs are dictionaries of options as
+    taken by pipeline.optionsFromDict.
+    '''
+    def __init__(self, path = DB):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout = 60, isolation_level = None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, jobs):
+        ''' Add jobs, skipping those already queued. Returns the number added '''
+        before = self.db.total_changes
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT OR IGNORE INTO jobs (name, options) VALUES (?, ?)',
+                                [(job.get('name'), json.dumps(job, sort_keys = True)) for job in jobs])
+        return self.db.total_changes - before
+
+    def claim(self):
+        ''' Mark the next pending job running & return (id, job), or None if there are none '''
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.db.execute("SELECT id, options FROM jobs WHERE state = 'pending' ORDER BY id "
+                                  "LIMIT 1").fetchone()
+            if row is not None:
+                self.db.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, pid = ?, "
+                                "started = ?, finished = NULL WHERE id = ?", (os.getpid(), time.time(), row[0]))
+        finally:
+            self.db.execute('COMMIT')
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def finish(self, jobId, summary):
+        ''' Store the pipeline summary of a job, which is then done or failed '''
+        state = 'done' if summary['exitCode'] == pipeline.OK else 'failed'
+        self.db.execute('UPDATE jobs SET state = ?, finished = ?, exit_code = ?, status = ?, timing = ?, '
+                        'summary = ? WHERE id = ?',
+                        (state, time.time(), summary['exitCode'], summary['status'],
+                         json.dumps(summary['timing']), json.dumps(summary, default = str), jobId))
+        return state
+
+    def recover(self):
+        '''
+        Return the jobs left running by workers which have died (a crash, a
+        reboot or the run being killed) to pending. Returns their number.
+        '''
+        rows = self.db.execute("SELECT id, pid FROM jobs WHERE state = 'running'").fetchall()
+        lost = [(i,) for i, pid in rows if pid is None or not _alive(pid)]
+        self.db.executemany("UPDATE jobs SET state = 'pending' WHERE id = ? AND state = 'running'", lost)
+        return len(lost)
+
+    def retry(self):
+        ''' Return the failed jobs to pending. Returns their number '''
+        return self.db.execute("UPDATE jobs SET state = 'pending' WHERE state = 'failed'").rowcount
+
+    def counts(self):
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.db.execute('SELECT state, count(*) FROM jobs GROUP BY state').fetchall())
+        return counts
+
+    def failed(self):
+        ''' (id, name, status, first error) of each failed job '''
+        rows = self.db.execute("SELECT id, name, status, summary FROM jobs WHERE state = 'failed' "
+                               "ORDER BY id").fetchall()
+        out = []
+        for i, name, status, summary in rows:
+            errors = json.loads(summary)['errors']
+            # A job can fail with no error message, e.g. finish(code, '')
+            first = errors[0].splitlines() if errors else []
+            out.append((i, name, status, first[0] if first else ''))
+        return out
+
+    def timing(self):
+        ''' The mean seconds taken by each stage over the jobs done '''
+        total, n = {}, 0
+        for row, in self.db.execute("SELECT timing FROM jobs WHERE state = 'done'"):
+            n += 1
+            for stage, seconds in json.loads(row).items():
+                total[stage] = total.get(stage, 0.) + seconds
+        return {stage: seconds / n for stage, seconds in total.items()}
+
+
+def worker(path, outDir, products, compress, download, dataDir):
+    ''' Run jobs from the queue in path until there are none left '''
+    queue = JobQueue(path)
+    try:
+        while True:
+            claimed = queue.claim()
+            if claimed is None:
+                return
+            jobId, job = claimed
+            try:
+                opts = pipeline.optionsFromDict(job, dataDir)
+            except (ValueError, TypeError, IndexError) as e:
+                summary = {'exitCode': pipeline.OPTIONS, 'status': pipeline.STATUS[pipeline.OPTIONS],
+                           'errors': ['Bad job: %s' %e], 'timing': {}}
+            else:
+                summary = pipeline.runPipeline(opts, outDir = outDir, products = products,
+                                               compress = compress, download = download)
+            state = queue.finish(jobId, summary)
+            print('job %i %s: %s (%.1f s)' %(jobId, job.get('name') or job['tzero'], state,
+                                            summary.get('seconds', 0.)), flush = True)
+    finally:
+        queue.close()
+
+
+def runJobs(path = DB, workers = 2, outDir = './', products = ['phaii'], compress = None,
+            download = False, dataDir = None):
+    '''
+    Run the unfinished jobs of the queue in path with a pool of worker
+    processes. Returns the job counts by state.
+    '''
+    queue = JobQueue(path)
+    recovered = queue.recover()
+    if recovered:
+        print('%i interrupted jobs returned to pending' %recovered)
+    pending = queue.counts()['pending']
+    print('%i pending jobs, %i workers' %(pending, workers))
+    procs = [multiprocessing.Process(target = worker, args = (path, outDir, products, compress,
+                                                               download, dataDir))
+             for i in range(min(workers, pending))]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        # The jobs which were running are picked up again by the next run
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
+        queue.recover()
+        raise
+    finally:
+        counts = queue.counts()
+        queue.close()
+    return counts
+
+
+def readTriggers(fileName, common):
+    ''' Jobs from a triggers file, each with the options in common '''
+    jobs = []
+    with open(fileName) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            job = dict(common, tzero = float(fields[0]))
+            if len(fields) > 1:
+                job['name'] = fields[1]
+            if len(fields) > 3:
+                job['coords'] = [float(fields[2]), float(fields[3])]
+            jobs.append(job)
+    return jobs
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'osv.py jobs',
+                                     description = 'Queue & run orbital subtraction jobs for many triggers')
+    parser.add_argument('--db', help = 'Job queue file [default: %s]' %DB, default = DB)
+    commands = parser.add_subparsers(dest = 'command')
+    commands.required = True
+
+    add = commands.add_parser('add', help = 'Queue a job for each trigger in a file')
+    add.add_argument('triggers', help = 'File with a trigger per line: tzero [name [ra dec]]')
+    add.add_argument('--offsets', help = 'Orbit offsets [default: from the config]', nargs = '*', type = str)
+    add.add_argument('--tRange', help = 'Time range relative to tzero [default: from the config]',
+                     nargs = 2, type = float)
+    add.add_argument('--dets', help = 'Detectors (0-13) [default: all]', nargs = '*', type = int)
+    add.add_argument('--CSPEC', help = 'Use CSPEC data', action = 'store_true')
+    add.add_argument('--data-dir', help = 'Data directory [default: from the config]')
+
+    run = commands.add_parser('run', help = 'Run the unfinished jobs')
+    run.add_argument('--workers', help = 'Worker processes [default: the number of CPUs]', type = int,
+                     default = os.cpu_count())
+    run.add_argument('--out-dir', help = 'Directory for the products [default: ./]', default = './')
+    run.add_argument('--products', help = 'Products to write [default: phaii]', nargs = '+',
+                     choices = pipeline.PRODUCTS, default = ['phaii'])
+    run.add_argument('--compress', help = 'Compress the PHAII files', choices = ['gzip'])
+    run.add_argument('--download', help = 'Download missing data files', action = 'store_true')
+    run.add_argument('--data-dir', help = "Data directory for jobs which don't give one")
+
+    commands.add_parser('status', help = 'Count the jobs by state & list the failed ones')
+    commands.add_parser('retry', help = 'Return the failed jobs to pending')
+    args = parser.parse_args(argv)
+
+    if args.command == 'add':
+        common = {'specType': 'CSPEC' if args.CSPEC else 'CTIME'}
+        if args.offsets:
+            common['offsets'] = args.offsets
+        if args.tRange:
+            common['tRange'] = args.tRange
+        if args.dets:
+            common['dets'] = args.dets
+        if args.data_dir:
+            common['dataDir'] = os.path.abspath(args.data_dir)
+        jobs = readTriggers(args.triggers, common)
+        queue = JobQueue(args.db)
+        print('Queued %i of %i jobs in %s' %(queue.add(jobs), len(jobs), args.db))
+        queue.close()
+        return 0
+
+    if args.command == 'run':
+        counts = runJobs(args.db, args.workers, args.out_dir, args.products, args.compress,
+                         args.download, args.data_dir)
+        print(', '.join('%s %i' %(state, counts[state]) for state in STATES))
+        return 0 if counts['failed'] == 0 else 1
+
+    queue = JobQueue(args.db)
+    try:
+        if args.command == 'retry':
+            print('%i failed jobs returned to pending' %queue.retry())
+            return 0
+        counts = queue.counts()
+        print(', '.join('%s %i' %(state, counts[state]) for state in STATES))
+        timing = queue.timing()
+        if timing:
+            print('Mean seconds per stage: ' + ', '.join('%s %.2f' %i for i in timing.items()))
+        for i, name, status, error in queue.failed():
+            print('failed job %i %s (%s): %s' %(i, name, status, error))
+    finally:
+        queue.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,7 +6,8 @@ import argparse
 import lib.util.util as util
 import lib.dep_ver_checker as setup
 
-def cmdLineOptions():
+def cmdLineParser():
+    ''' Argument parser for the orbital subtraction options '''
     cfg = setup.getConfig()
 
     booleanArg = {'action': 'store_true', 'default': False}
@@ -47,12 +48,21 @@ def cmdLineOptions():
                          **booleanArg)
     parser.add_argument('--coords', help = 'Source coordinates (RA, Dec)',
                         type = float, default = False, nargs = 2)                        
+    return parser
 
-    args = parser.parse_args()
+def cmdLineOptions(argv = None, parser = None):
+    '''
+    Parse argv (sys.argv by default) into an OSV_Args. parser can be one
+    made by cmdLineParser with extra arguments added; the parsed arguments
+    are then kept as the args attribute.
+    '''
+    parser = parser if parser is not None else cmdLineParser()
+    args = parser.parse_args(argv)
     # We now need to convert these arguments to 
     # that required by orbsub. 
     osvArgs = OSV_Args()
     osvArgs.mapArgs(args)
+    osvArgs.args = args
 
     return osvArgs
 
@@ -95,6 +105,9 @@ class OSV_Args:
         self.coords = ['', '']
         self.reCalcOrbit = True
         self.autoLU = False
+        # tRange & resolution of the last run with these options (set by
+        # OrbSub.do_orbsub), which check leaves as it is
+        self.usedRange = None
         # error/warning errors
         self.error = False
         self.warning = False
@@ -142,8 +155,11 @@ class OSV_Args:
         # We want a bin edge at zero. To get this we take shift the leftmost edge (tmin)
         # to ensure that there area an integer multiple of the resolution between it and
         # zero. We then shift the right edge for the same reason.
-        self.tRange[0] = int(self.tRange[0]/self.resolution) * self.resolution + self.resolution/2.
-        self.tRange[1] = int(self.tRange[1]/self.resolution) * self.resolution        
+        # The tRange of the last run is left as it is, so running an instance
+        # again with changed options (OrbSub.update) doesn't move it
+        if getattr(self, 'usedRange', None) != (self.tRange, self.resolution):
+            self.tRange[0] = int(self.tRange[0]/self.resolution) * self.resolution + self.resolution/2.
+            self.tRange[1] = int(self.tRange[1]/self.resolution) * self.resolution
         
         if not util.good_gbm_met(self.tzero):
             self.error = True
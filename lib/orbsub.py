@@ -1,37 +1,78 @@
 #!/usr/bin/env python
 
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from .orbsub_classes import *
+from .instrument import Instrument
+from lib import fitsUtil
+import lib.util.util as util
 
 __version__='1.3'
 
+PERIOD = 5737.70910239
+
 class OrbSub():
-    def __init__(self,opts):
+    def __init__(self,opts, keepReads = False):
         self.opts = opts
         self.files = ''
         self.data = {}
         self.gti = None
-        self.period = 5737.70910239
+        self.period = PERIOD
         self.pos = None
+        self.posFiles = None
         self.data_err = False
         self.perErr = False
         self.perMes = ''
         self.perErrMes = ''
+        # Output of util.read_pha/read_poshist indexed by file, filled by 
+        # stream_orbsub so the data needn't be read again, & by every read
+        # if keepReads so update needn't read them again
+        self.reads = {}
+        self.keepReads = keepReads
+        # The inputs of the geometry & of each detector's data when they
+        # were last done, so update can tell what must be done again
+        self.inputs = {}
+        # Time, CPU, bytes read & array sizes of each stage
+        self.instrument = Instrument()
     def find_files(self):
         '''Find all relevant files needed for bkg subtraction'''
         opts = self.opts
-        opts.check()
-        #Regions is a class which contains the time ranges
-        regions = Regions(opts.tzero, opts.tRange[0], opts.tRange[1], opts.offset,
-                          orbit_period = self.period)
-        
-        #Files is a class which is used to first calculate what days are needed,
-        #the corresponding files are then found
-        files           = Files(opts.tzero, regions, opts.offset)
-        files.find_pha_files(opts.dets, spec_type = opts.spec_type, data_dir = opts.data_dir)
-        files.find_poshist_files(opts.data_dir)
+        with self.instrument.stage('find_files'):
+            opts.check()
+            #Regions is a class which contains the time ranges
+            regions = Regions(opts.tzero, opts.tRange[0], opts.tRange[1], opts.offset,
+                              orbit_period = self.period)
+            
+            #Files is a class which is used to first calculate what days are needed,
+            #the corresponding files are then found
+            files           = Files(opts.tzero, regions, opts.offset)
+            files.find_pha_files(opts.dets, spec_type = opts.spec_type, data_dir = opts.data_dir)
+            files.find_poshist_files(opts.data_dir)
         self.regions    = regions
         self.files      = files
+        if self.pos and self.posFiles != files.pos_files:
+            self.pos = None
         return self.files.error
+
+    def update(self, opts):
+        '''
+        Change the options to opts, for the stages to be run again as for a
+        new OrbSub (find_files, calc_period, get_gti, get_steps & do_orbsub)
+        but doing only what depends on what changed. The geometry is kept if
+        the regions, coordinates & poshist files are the same, & only the
+        detectors whose files or regions changed are done again, binning
+        just their new regions. E.g. adding a detector reads & bins just that
+        detector. The files read are kept from here on (keepReads), so a
+        detector whose days change reads all its files on the first update
+        but only the new ones after. The period is recalculated from the
+        default as for a new OrbSub, so the results are the same.
+        '''
+        self.opts = opts
+        self.period = PERIOD
+        self.keepReads = True
+        self.instrument.clear()
     
     def calc_period(self):
         ''' 
@@ -49,9 +90,11 @@ class OrbSub():
             self.perErrMes += 'Defaulting to: %fs\n' %self.period
             self.perErrMes += '<End error: Period>\n\n'
             return False
-        elif not self.pos:
-            pos = Poshist_data(self.files.pos_files)
-        pos.calc_period()
+        with self.instrument.stage('calc_period') as rec:
+            if not self.pos:
+                self.pos = self._read_poshist(rec)
+            pos = self.pos
+            pos.calc_period()
         if abs(pos.period - self.period) > 0.1:
             self.perMes += 'Difference b/w new & old period is > %f\n' %tolerance
             self.perMes += 'Old Period: %fs, New Period: %fs\n' %(self.period, pos.period)
@@ -87,9 +130,16 @@ class OrbSub():
             self.occErrMes += "No coordinates set:cannot calculate Occultation Steps\n"
             self.occErrMes += '<End error: Occultation Steps.>\n\n'
             return False
-        if not self.pos:
-            self.pos = Poshist_data(self.files.pos_files)
-        self.pos.get_steps(self.opts.coords[0], self.opts.coords[1])
+        key = (tuple(self.posFiles or ()), tuple(self.opts.coords))
+        if self.pos and self.inputs.get('steps') == key:
+            self.occMes += 'Occultation Steps unchanged\n'
+            self.occMes += '<End Calculating Occultation Steps>\n\n'
+            return True
+        with self.instrument.stage('get_steps') as rec:
+            if not self.pos:
+                self.pos = self._read_poshist(rec)
+            self.pos.get_steps(self.opts.coords[0], self.opts.coords[1])
+        self.inputs['steps'] = (tuple(self.posFiles), tuple(self.opts.coords))
         self.occMes += 'Occultation Steps successfully found\n'
         self.occMes += '<End Calculating Occultation Steps>\n\n'
         return True        
@@ -118,11 +168,19 @@ class OrbSub():
             self.gtiErrMes += "No coordinates set:cannot calculate GTI\n"
             self.gtiErrMes += '<End error: G.T.I.>\n\n'
             return False
-        if not self.pos:
-            self.pos = Poshist_data(self.files.pos_files)
-        self.pos.calculate_angles(self.regions, self.opts.coords[0],
-                                    self.opts.coords[1])
-        self.pos.get_gti()
+        key = (tuple(self.posFiles or ()), tuple(self.opts.coords), self._ranges())
+        if self.pos and self.inputs.get('gti') == key:
+            # The detector angles are done for all detectors
+            self.gtiMes += 'G.T.I.s unchanged\n'
+            self.gtiMes += '<End Calculating G.T.I.>\n\n'
+            return True
+        with self.instrument.stage('get_gti') as rec:
+            if not self.pos:
+                self.pos = self._read_poshist(rec)
+            self.pos.calculate_angles(self.regions, self.opts.coords[0],
+                                        self.opts.coords[1])
+            self.pos.get_gti()
+        self.inputs['gti'] = (tuple(self.posFiles), tuple(self.opts.coords), self._ranges())
         #self.gti = self.pos.gti
         self.gtiMes += 'G.T.I.s successfully found\n'
         self.gtiMes += '<End Calculating G.T.I.>\n\n'
@@ -137,16 +195,238 @@ class OrbSub():
         isValid = True
         # Loop over each detector, extract data from relevant temporal regions,
         # then average them to find the bkg.
+        # Binned regions are only reused from data of the same type & directory
+        source = (self.opts.spec_type, self.opts.data_dir)
+        sameSource = self.inputs.get('source') == source
         for det in self.opts.dets:
+            files = self.files.pha_files[det]
+            key = (tuple(files), self._ranges())
+            old = self.data.get(det) if sameSource else None
+            if old is not None and self.inputs.get(det) == key:
+                self.orbMes += ' Processing %s: unchanged\n' %det
+                if old.binDataError:
+                    self.orbErrMes += old.binDataErrMes
+                    isValid = False
+                data[det] = old
+                continue
             self.orbMes += ' Processing %s:\n' %det           
-            #Read in data from each day & concatenate it into several arrays
-            det_data = Pha_data(self.files.pha_files[det])
-            det_data.bin_pha(self.regions, self.opts.offset, self.opts)
-            if det_data.binDataError:
-                self.orbErrMes += det_data.binDataErrMes
-                isValid = False
-            det_data.calc_background(self.opts.offset)
+            with self.instrument.stage('do_orbsub', det) as rec:
+                #Read in data from each day & concatenate it into several arrays
+                self.instrument.addReads(rec, files, self.reads)
+                if old is not None and old.files == files:
+                    # A copy, as exports of old may still be running (see
+                    # gui_classes.ExportQueue). The read arrays are shared.
+                    det_data = copy.copy(old)
+                else:
+                    self._keep(files, util.read_pha)
+                    det_data = Pha_data(files, preloaded = self.reads)
+                det_data.bin_pha(self.regions, self.opts.offset, self.opts, previous = old)
+                if det_data.binDataError:
+                    self.orbErrMes += det_data.binDataErrMes
+                    isValid = False
+                det_data.calc_background(self.opts.offset)
+                self._add_pha_arrays(rec, det_data)
+            if det_data.reused:
+                self.orbMes += '  reused %s\n' %' '.join(sorted(det_data.reused))
+            self.inputs[det] = key
             det_dic = {det:det_data}
             data.update(det_dic)
+        self.inputs['source'] = source
+        self.data = data
+        # Running again with these options keeps this tRange (see OSV_Args.check)
+        self.opts.usedRange = (list(self.opts.tRange), self.opts.resolution)
+        if self.keepReads:
+            # Only the files still in use are kept
+            inUse = set(self.files.pos_files or [])
+            for det in self.opts.dets:
+                inUse.update(self.files.pha_files[det])
+            for path in set(self.reads) - inUse:
+                del self.reads[path]
+        return isValid
+
+    def _ranges(self):
+        ''' The time ranges of the regions, to compare the inputs of stages '''
+        return tuple(sorted((index, tuple(r)) for index, r in self.regions.ranges.items()))
+
+    def _keep(self, paths, read):
+        ''' If the reads are kept, read the files of paths which haven't been into self.reads '''
+        if self.keepReads:
+            for path in paths:
+                if path not in self.reads:
+                    self.reads[path] = read(path)
+
+    def _read_poshist(self, rec):
+        ''' Poshist_data of the poshist files, recording the reads in rec '''
+        self.instrument.addReads(rec, self.files.pos_files, self.reads)
+        self._keep(self.files.pos_files, lambda path: util.read_poshist(path, verbose = False))
+        pos = Poshist_data(self.files.pos_files, preloaded = self.reads)
+        self.posFiles = list(self.files.pos_files)
+        # The geometry is done again with new poshist data
+        self.inputs.pop('gti', None)
+        self.inputs.pop('steps', None)
+        self.instrument.addArrays(rec, sc_time = pos.sc_time, sc_quat = pos.sc_quat)
+        return pos
+
+    def _add_pha_arrays(self, rec, det_data):
+        src = det_data.data.get('src') if hasattr(det_data, 'data') else None
+        self.instrument.addArrays(rec, counts = det_data.counts,
+                                  src = src[1] if src else None,
+                                  bkg = getattr(det_data, 'background', {}).get('all'))
+
+    def stream_orbsub(self, fetch, max_workers = 4):
+        '''
+        Perform the orbital subtraction while the missing files are still
+        being fetched. fetch(progress) must download the missing files &
+        call progress(done, total, name, ok) as each one arrives, e.g. 
+        getData.download_missing with the other arguments filled in.
+        Each file is read as soon as it is on disk. Once all the days of
+        a detector have been read its data is binned & the background is
+        calculated, while files for the other detectors are still coming.
+        The poshist files are read into self.pos the same way.
+        Returns (isValid, downloaded, failed) with the lists of files fetch
+        did & did not get.
+        '''
+        opts = self.opts
+        days = self.files.days
+        # Paths are made as in Files, so they match self.reads afterwards
+        dataDir = Path(opts.data_dir) if opts.data_dir else Path.cwd()
+        self.orbErrMes = ''
+        self.orbMes = ''
+        lock = threading.Lock()
+        # The data made here is done again by the next do_orbsub
+        for det in opts.dets:
+            self.inputs.pop(det, None)
+        # day -> file for each detector, and for the poshist files under 'pos'
+        found = {det: {} for det in opts.dets}
+        found['pos'] = {}
+
+        def fileKey(name):
+            # glg_cspec_n0_220315_v00.pha or glg_poshist_all_220315_v01.fit
+            parts = os.path.basename(name).split('_')
+            return ('pos' if parts[1] == 'poshist' else parts[2]), parts[3]
+
+        def read(path):
+            det, day = fileKey(path)
+            if det not in found:
+                return None
+            with self.instrument.stage('read', None if det == 'pos' else det) as rec:
+                self.instrument.addReads(rec, [path], self.reads)
+                # Files kept from an earlier run (see update) aren't read again
+                if path not in self.reads and det == 'pos':
+                    self.reads[path] = util.read_poshist(path, verbose = False)
+                elif path not in self.reads:
+                    self.reads[path] = util.read_pha(path)
+            with lock:
+                # Only the highest version of a day is used, as in Files
+                current = found[det].get(day)
+                if current is not None and file_version(current) >= file_version(path):
+                    return None
+                found[det][day] = path
+                if len(found[det]) != len(days):
+                    return None
+            files = [found[det][i] for i in days]
+            if det == 'pos':
+                self.pos = Poshist_data(files, preloaded = self.reads)
+                self.posFiles = files
+                self.inputs.pop('gti', None)
+                self.inputs.pop('steps', None)
+                return None
+            with self.instrument.stage('do_orbsub', det) as rec:
+                det_data = Pha_data(files, preloaded = self.reads)
+                det_data.bin_pha(self.regions, opts.offset, opts)
+                det_data.calc_background(opts.offset)
+                self._add_pha_arrays(rec, det_data)
+            return det_data
+
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            futures = []
+            present = list(self.files.pos_files or [])
+            for det in opts.dets:
+                present += self.files.pha_files[det]
+            futures += [executor.submit(read, i) for i in present]
+
+            def progress(done, total, name, ok):
+                if ok:
+                    path = str(dataDir / fileKey(name)[1] / name)
+                    futures.append(executor.submit(read, path))
+            downloaded, failed = fetch(progress)
+
+            data = {}
+            isValid = True
+            for future in list(futures):
+                try:
+                    det_data = future.result()
+                except Exception as e:
+                    self.orbErrMes += '*** Error reading data: %s\n' %e
+                    isValid = False
+                    continue
+                if det_data is not None:
+                    data[det_data.detector] = det_data
+        for det in opts.dets:
+            if det not in data:
+                self.orbErrMes += '*** PHA Files missing for %s\n' %det
+                isValid = False
+                continue
+            self.orbMes += ' Processing %s:\n' %det
+            if data[det].binDataError:
+                self.orbErrMes += data[det].binDataErrMes
+                isValid = False
+        if len(found['pos']) != len(days):
+            self.orbErrMes += '*** Poshist files missing\n'
+            isValid = False
         self.data = data
-        return isValid    
\ No newline at end of file
+        self.opts.usedRange = (list(opts.tRange), opts.resolution)
+        if not failed:
+            # Pick up the downloaded files
+            self.find_files()
+        return isValid, downloaded, failed
+
+    def write_ascii_all(self, names = [], lcMask = np.empty((0)), specMask = np.empty((0)), fmt = '%s'):
+        '''
+        Write the light curves of every detector into a single wide ASCII
+        table for the source and one for the background. All detectors are
+        binned on the same source region, but their bins can still differ
+        (e.g. a data gap in one), in which case a ValueError is raised.
+        lcMask & specMask select the time bins & channels, as in
+        Pha_data.write_ascii.
+        '''
+        dets = sorted(self.data.keys())
+        if not len(names):
+            fileStem = "glg_osv_%s_all.XX" %(self.opts.name)
+            names = [fileStem.replace('.XX', '.src'), fileStem.replace('.XX', '.bkg')]
+        t = self.data[dets[0]].data['src'][0]
+        for det in dets[1:]:
+            edges = self.data[det].data['src'][0]
+            if edges.shape != t.shape or not np.array_equal(edges, t):
+                raise ValueError("The time bins of %s & %s differ (%i & %i bins), they can't "
+                                 "be written in one table" %(dets[0], det, t.shape[0], edges.shape[0]))
+        if not lcMask.size:
+            lcMask = t[:,0] != -99999999
+        t = (t[lcMask,0], t[lcMask,1])
+        src, srcExp, bkg, bkgExp = [], [], [], []
+        for det in dets:
+            det_data = self.data[det]
+            mask = specMask if specMask.size else slice(None)
+            # Apply both masks separately to avoid ValueError exception
+            src.append(det_data.data['src'][1][:, mask][lcMask, :])
+            srcExp.append(det_data.data['src'][2][lcMask])
+            bkg.append(det_data.background['all'][:, mask][lcMask, :])
+            bkgExp.append(det_data.bkgExp['all'][lcMask])
+        fitsUtil.createASCIIMulti(t, srcExp, src, dets, names[0], fmt = fmt)
+        fitsUtil.createASCIIMulti(t, bkgExp, bkg, dets, names[1], fmt = fmt)
+        return names
+
+    def write_phaii_all(self, compress = None, compresslevel = 6, max_workers = 4):
+        '''
+        Write source & background PHAII files for every detector. The files
+        are written from a pool of threads, which mostly helps when compress
+        is 'gzip' as the compression runs outside the GIL.
+        Returns a dictionary of the names written, indexed by detector.
+        '''
+        dets = sorted(self.data.keys())
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            futures = {det: executor.submit(self.data[det].write_phaii, self.opts,
+                                            names = [], compress = compress,
+                                            compresslevel = compresslevel)
+                       for det in dets}
+            return {det: futures[det].result() for det in dets}
@@ -1,5 +1,6 @@
 
 import  os
+import  re
 import  numpy           as np
 import  lib.util.util   as util
 from    glob    import glob
@@ -7,6 +8,11 @@ from    lib     import fitsUtil
 
 from pathlib import Path
 
+def file_version(name):
+    ''' Version of a GBM file name, e.g. 1 for glg_ctime_n0_220315_v01.pha (-1 if none) '''
+    match = re.search(r'_v(\d+)\.', os.path.basename(name))
+    return int(match.group(1)) if match else -1
+
 class Regions:
     '''
     Determine the time of selection regions
@@ -94,9 +100,15 @@ class Files:
             day_dir = data_path / i
             pos_pattern = f'glg_poshist_all_{i}*fit'
             pos_file = list(day_dir.glob(pos_pattern))
+            if not pos_file:
+                # Accept gzip compressed files
+                pos_file = list(day_dir.glob(pos_pattern + '.gz'))
             
             # Convert Path objects to strings for compatibility
+            # Only the highest version of a day is used
             pos_file = [str(f) for f in pos_file]
+            if len(pos_file) > 1:
+                pos_file = [max(pos_file, key = file_version)]
             
             self.pos_files.extend(pos_file)
             
@@ -132,9 +144,15 @@ class Files:
                 day_dir = data_path / i
                 pha_pattern = f'glg_{spec_type.lower()}_{j}_{i}*pha'
                 pha_file = list(day_dir.glob(pha_pattern))
+                if not pha_file:
+                    # Accept gzip compressed files
+                    pha_file = list(day_dir.glob(pha_pattern + '.gz'))
                 
                 # Convert Path objects to strings for compatibility
+                # Only the highest version of a day is used
                 pha_file = [str(f) for f in pha_file]
+                if len(pha_file) > 1:
+                    pha_file = [max(pha_file, key = file_version)]
                 
                 pha_file_list.extend(pha_file)
                 
@@ -188,13 +206,18 @@ class Files:
         return output
 
 class Poshist_data:
-    def __init__(self,pos_files):
+    def __init__(self,pos_files, preloaded = {}):
         '''
         Read in data for a list of POSHIST Files 
+        preloaded is an optional dictionary of util.read_poshist output 
+        indexed by file name, for files which have already been read.
         '''
         
         for i in pos_files:
-            poshist_data = util.read_poshist(i, verbose = False)
+            if i in preloaded:
+                poshist_data = preloaded[i]
+            else:
+                poshist_data = util.read_poshist(i, verbose = False)
             if i == pos_files[0]:
                 self.sc_time = poshist_data[0]
                 self.sc_pos = poshist_data[1]
@@ -337,18 +360,24 @@ class Pha_data:
     '''
     Class for GBM PHA data
     '''
-    def __init__(self, pha_files):
+    def __init__(self, pha_files, preloaded = {}):
         '''
         Concatenate the data from several days into single arrays
+        preloaded is an optional dictionary of util.read_pha output indexed
+        by file name, for files which have already been read.
         '''
         self.detector = 'null'
         # the double slash vs forward slash makes it work on windows 
         # does nothing if there are no double slashes
         self.detector =  pha_files[0].replace('\\', '/').split('/')[-1][10:12]
+        self.files = list(pha_files)
         
         for i in pha_files:
             
-            t_start, t_end, t_exposure, counts,  eMin, eMax = util.read_pha(i)
+            if i in preloaded:
+                t_start, t_end, t_exposure, counts,  eMin, eMax = preloaded[i]
+            else:
+                t_start, t_end, t_exposure, counts,  eMin, eMax = util.read_pha(i)
             
             # TODO clean up, quality is handled in read pha no ?
             #print("This is the file: ", i, "\n")
@@ -375,9 +404,12 @@ class Pha_data:
                 self.t_exposure = np.concatenate((self.t_exposure, t_exposure))
                 self.counts = np.concatenate((self.counts, counts))
             
-    def bin_pha(self, regions, offset, opts):
+    def bin_pha(self, regions, offset, opts, previous = None):
         '''
         Bin up pha counts to desired binsize -> also keep original data
+        previous is an optional Pha_data of the same detector & data binned
+        before (see OrbSub.update): the background regions it binned over
+        the same time ranges are taken from it rather than binned again.
         '''
         nchan = self.eEdgeMin.size
         
@@ -394,7 +426,16 @@ class Pha_data:
         # The data for each orbit offset is stored in dictionary data which 
         # is indexed by the same offset string as region.ranges
 
+        # The source region is always binned as calc_background changes it
+        reuse = {}
+        if previous is not None and previous.eEdgeMin.size == nchan:
+            for index, binned in previous.data.items():
+                if index != 'src' and binned is not False:
+                    reuse[index] = (previous.ranges[index], binned)
+
         data = {}
+        self.ranges = {}
+        self.reused = []
         self.binDataMes = ''
         self.binDataErrMes = ''
         self.binDataError = False
@@ -418,6 +459,11 @@ class Pha_data:
                 
                 #print "<> %s <>" %index
                 region = regions.ranges[index]
+                self.ranges[index] = tuple(region)
+                if index in reuse and reuse[index][0] == self.ranges[index]:
+                    data.update({index: reuse[index][1]})
+                    self.reused.append(index)
+                    continue
                 
                 mask = np.where((self.t_start >= region[0] ) & 
                                 (self.t_end <= region[1]))
@@ -474,7 +520,8 @@ class Pha_data:
                     continue                    
                 if n == 0:
                     zeromask = (np.average(data[index][1],1)==0)
-                    bkg = data[index][1]
+                    # A copy, as the sum mustn't change the region's counts
+                    bkg = data[index][1].copy()
                     bkgErr = data[index][3]**2 #! TODO dble check Should the error not be sqrt?
                 else:
                     zeromask = (zeromask == True) | (np.average(data[index][1],1)==0)
@@ -588,9 +635,18 @@ class Pha_data:
         #     print i,j 
         # print '\n'
         return edges
-    def write_phaii(self, opts, data_class = 'TOTAL', new_file = [], data = [], dir = './', gti = [], names = [],):
+    def write_phaii(self, opts, data_class = 'TOTAL', new_file = [], data = [], dir = './', gti = [], names = [],
+                    compress = None, compresslevel = 6, chunkSize = None, cancel = None):
         '''
-        Write a set of PHAII files.
+        Write a set of PHAII files. compress can be None or 'gzip'.
+        If chunkSize (number of bins) is passed, the files are written with
+        fitsUtil.PHAIIStream a chunk of rows at a time. The binned arrays are
+        already in memory, but the int32 counts & FITS table copies of the
+        whole file that createPHAII makes are avoided. chunkSize is ignored
+        when compress is set.
+        cancel is an optional threading.Event checked between chunks; if it
+        is set the partly written files are removed and nothing is returned.
+        Returns the names of the files written.
         '''
 
         # Primary
@@ -623,11 +679,32 @@ class Pha_data:
         if not len(names):
             names.append(fileStem.replace('.XX', '.PHA'))
             names.append(fileStem.replace('.XX', '.BAK'))
-        fitsUtil.createPHAII(t, srcExp, src, self.detector, tzero, names[0], 
-                            edges = edges, ra = ra, dec = dec, errRad = radErr, qual = qual, bkg = False)
-        fitsUtil.createPHAII(t, bkgExp, bkg, self.detector, tzero, names[1], 
+        if chunkSize and not compress:
+            for name, exp, counts, isBkg in [(names[0], srcExp, src, False),
+                                             (names[1], bkgExp, bkg, True)]:
+                with fitsUtil.PHAIIStream(name, self.detector, tzero, edges, counts.shape[1],
+                                          ra = ra, dec = dec, errRad = radErr, bkg = isBkg) as out:
+                    for i in range(0, exp.size, chunkSize):
+                        if cancel is not None and cancel.is_set():
+                            break
+                        chunk = slice(i, i + chunkSize)
+                        out.append((ti[chunk], tj[chunk]), exp[chunk], counts[chunk], qual[chunk])
+                    else:
+                        continue
+                # Cancelled, the .PHA may be finished if it was the .BAK
+                for name in names[:2]:
+                    if os.path.exists(name):
+                        os.remove(name)
+                return []
+            return names[:2]
+        srcName = fitsUtil.createPHAII(t, srcExp, src, self.detector, tzero, names[0], 
+                            edges = edges, ra = ra, dec = dec, errRad = radErr, qual = qual, bkg = False,
+                            compress = compress, compresslevel = compresslevel)
+        bkgName = fitsUtil.createPHAII(t, bkgExp, bkg, self.detector, tzero, names[1], 
                             edges = edges, ra = ra, dec = dec, errRad = radErr, qual = qual,
-                            statErr = bkgErr, bkg = True)
+                            statErr = bkgErr, bkg = True,
+                            compress = compress, compresslevel = compresslevel)
+        return [srcName, bkgName]
     def write_pha(self, opts, data_class = 'TOTAL', new_file = [], data = [], dir = './', gti = [], names = [],
                     lcMask = np.empty((0)), specMask = np.empty((0))):
         '''
@@ -689,10 +766,88 @@ class Pha_data:
         fitsUtil.createPHA(t, bkgExp, bkg, self.detector, tzero, names[1], 
                             edges = edges, ra = ra, dec = dec, errRad = radErr, qual = qual,
                             err = bkgErr, statErr = True, bkg = True)
+    def sum_intervals(self, edges, offset = 0, specMask = np.empty((0))):
+        '''
+        Sum the source & background over a list of time intervals. edges is
+        a flat list of start, stop pairs (the format of the 'lc' lookup
+        entries), relative to offset. Every interval is reduced in a single
+        np.add.reduceat call per array.
+
+        Returns (tstart, tstop), srcExp, src, srcErr, bkgExp, bkg, bkgErr,
+        qual where the arrays have one row per interval. Errors are summed in
+        quadrature, qual is the worst quality flag in each interval.
+        '''
+        t = self.data['src'][0]
+        ti, tj = t[:,0], t[:,1]
+        if not specMask.size:
+            specMask = self.eEdgeMin != -99999999
+        edges = np.asarray(edges, dtype = float).reshape(-1, 2) + offset
+        edges.sort(axis = 1)
+        # Indices of the first & one past the last bin in each interval
+        start = np.searchsorted(ti, edges[:,0] - 1e-6, side = 'left')
+        stop = np.searchsorted(tj, edges[:,1] + 1e-6, side = 'right')
+        stop = np.maximum(stop, start)
+        empty = stop == start
+        # reduceat sums arr[idx[k]:idx[k+1]], so with interleaved start/stop
+        # indices every even entry is an interval sum. A zero row is appended
+        # so that an interval ending on the last bin has a valid stop index.
+        idx = np.column_stack((start, stop)).ravel()
+
+        def reduce(arr, ufunc = np.add):
+            arr = np.asarray(arr, dtype = float)
+            pad = np.zeros((1,) + arr.shape[1:])
+            out = ufunc.reduceat(np.concatenate((arr, pad)), idx, axis = 0)[::2]
+            out[empty] = 0
+            return out
+
+        src = self.data['src'][1][:, specMask]
+        srcErr = self.data['src'][3][:, specMask]
+        bkg = self.background['all'][:, specMask]
+        bkgErr = self.background['allerr'][:, specMask]
+        tint = (edges[:,0], edges[:,1])
+        return (tint,
+                reduce(self.data['src'][2]),
+                reduce(src),
+                np.sqrt(reduce(srcErr**2)),
+                reduce(self.bkgExp['all']),
+                reduce(bkg),
+                np.sqrt(reduce(bkgErr**2)),
+                reduce(self.quality, np.maximum))
+
+    def write_pha_typeii(self, opts, edges, names = [], specMask = np.empty((0)), offset = 0):
+        '''
+        Write a source & background PHA TYPE II file with one spectrum for
+        each interval in edges (flat list of start, stop pairs relative to
+        offset, as stored in the 'lc' lookup).
+        '''
+        if not len(edges) >= 2:
+            return False
+        ra = opts.coords[0]
+        dec = opts.coords[1]
+        radErr = 0.
+        tzero = opts.tzero
+        fileStem = "glg_osv_%s_%s.XX" %(opts.name, self.detector)
+        if not specMask.size:
+            specMask = self.eEdgeMin != -99999999
+        edgesE = (self.eEdgeMin[specMask], self.eEdgeMax[specMask])
+        if not len(names):
+            names = [fileStem.replace('.XX', '.PHA2'), fileStem.replace('.XX', '.BAK2')]
+
+        t, srcExp, src, srcErr, bkgExp, bkg, bkgErr, qual = self.sum_intervals(
+                                    edges[:len(edges) // 2 * 2], offset, specMask)
+        fitsUtil.createPHATypeII(t, srcExp, src, self.detector, tzero, names[0],
+                            edges = edgesE, ra = ra, dec = dec, errRad = radErr,
+                            qual = qual, err = srcErr, bkg = False)
+        fitsUtil.createPHATypeII(t, bkgExp, bkg, self.detector, tzero, names[1],
+                            edges = edgesE, ra = ra, dec = dec, errRad = radErr,
+                            qual = qual, err = bkgErr, bkg = True)
+        return names
+
     def write_ascii(self, opts, data_class = 'TOTAL', new_file = [], data = [], dir = './', gti = [], names = [],
-                    lcMask = np.empty((0)), specMask = np.empty((0))):
+                    lcMask = np.empty((0)), specMask = np.empty((0)), fmt = '%s'):
         '''
-        Write a set of PHA files.
+        Write a set of ASCII light curves. fmt is the float format used
+        for every column.
         '''
         if data == []:        
             if data_class == 'TOTAL':
@@ -749,5 +904,5 @@ class Pha_data:
         srcExp = srcExp[lcMask]
         bkgExp = bkgExp[lcMask]
         t = (ti[lcMask], tj[lcMask])
-        fitsUtil.createASCII(t, srcExp, src, self.detector, tzero, names[0], )
-        fitsUtil.createASCII(t, bkgExp, bkg, self.detector, tzero, names[1], )
\ No newline at end of file
+        fitsUtil.createASCII(t, srcExp, src, self.detector, tzero, names[0], fmt = fmt)
+        fitsUtil.createASCII(t, bkgExp, bkg, self.detector, tzero, names[1], fmt = fmt)
\ No newline at end of file
@@ -1,3 +1,6 @@
+import time
+import threading
+
 import wx
 
 from . import options
@@ -18,11 +21,67 @@ def genDataMissingMessage(missingFileDictionary, internetAccess = True):
     mes += missingFiles
 
     if internetAccess:
-        mes += "\nWould you like to create a download script?\n\n"
+        mes += "\nWould you like to download the missing files now?\n\n"
     else:
         mes += "" #You do not seem to have internet access."
     return mes
 
+class OSV(wx.App):
+    """Main OSV Application class"""
+
+    def OnInit(self,):
+        return True
+    
+    def OnLaunch(self, opts = None):
+        """Launch application with optional command line options""" 
+        if opts is None:
+            self.OnNew()
+        else:
+            self.createInstance(opts)
+        return True        
+    
+    def OnNew(self):
+        """Show options dialog and create instance"""
+        with OptDialog(None, False, title="OSV Options") as dlg:
+            if dlg.ShowModal() != wx.ID_OK:
+                return
+                
+            self.opts = dlg.opts
+            self.opts.check()
+            
+            if self.opts.error:
+                self._show_dialog(self.opts.err_mes)
+                return
+            elif self.opts.warnAll and self.opts.warning:
+                self._show_dialog(self.opts.warning_mes, title='Warnings')
+                
+            self.createInstance(dlg.opts)
+    
+    def createInstance(self, opts):
+        ''' 
+        Create instance of OSV GUI & run with given options
+        '''
+        timestamp = time.strftime("%H:%M:%S", time.gmtime())   
+        inst = OSV_Instance(opts)
+        title = '%s @ %s' %(inst.opts.name, timestamp)
+        
+        inst.gui = gui_classes.OrbsubGUI(
+            None, -1, 
+            title = title,
+             plotDimensions = (2,1,)
+        )
+        inst.gui.instance = inst
+        inst.gui.log.update(str(opts)) 
+        inst.runOrbSub()
+        return inst #add a return, shouldn't break anything 
+
+    def _show_dialog(self, message, title='Error encountered'):
+        """Show message dialog"""
+        wx.MessageBox(message, title, style=wx.OK | wx.ICON_ERROR)
+
+    # Alias for backward compatibility
+    DialogBox = _show_dialog
+
 class OSV_Instance:
     ''' An instance of OSV
     '''
@@ -37,7 +96,17 @@ class OSV_Instance:
     def delete(self):
         if self.gui:
             self.gui.delete()
-    def runOrbSub(self, flag_nogui=False):
+    def rerun(self, opts):
+        """
+        Run the analysis again with changed options, redoing only what the
+        change affects (OrbSub.update) rather than starting a new instance.
+        """
+        self.opts = opts
+        if self.gui and self.gui.log:
+            self.gui.log.update(str(opts))
+        self.runOrbSub(update = True)
+
+    def runOrbSub(self, flag_nogui=False, update=False):
         """
         Run the orbital subtraction analysis.
         
@@ -50,10 +119,16 @@ class OSV_Instance:
         
         Args:
             flag_nogui (bool): If True, run without GUI feedback
+            update (bool): If True, reuse what the existing OrbSub has done
         """
         try:
-            # Initialize orbital subtraction object
-            self.orbsub = orbsub.OrbSub(self.opts)
+            # Initialize orbital subtraction object. The files read are only
+            # kept once the instance is run again with changed options
+            # (OrbSub.update), as most instances never are
+            if update and self.orbsub:
+                self.orbsub.update(self.opts)
+            else:
+                self.orbsub = orbsub.OrbSub(self.opts)
             
             # Step 1: Find necessary files
             self.orbsub.find_files()
@@ -78,6 +153,7 @@ class OSV_Instance:
                 
             # Step 5: Initialize data display if GUI is available
             if self.gui:
+                self.gui.log.update(str(self.orbsub.instrument))
                 self.gui.InitData(self.orbsub)
                 
         except Exception as e:
@@ -105,25 +181,79 @@ class OSV_Instance:
                             style=wx.YES_NO|wx.ICON_ERROR|wx.YES_DEFAULT)
                             
         if downloadData:
-            # Create downloader instance
-            downloader = lib.ftp.Downloader(self.orbsub.files.missingFiles, self.opts.spec_type)
-            
-            # Generate Python download script instead of shell script
-            try:
-
-                downloader.createPythonDownloadScript(self.opts.data_dir)
-                msg = "Python download script (download.py) saved in current directory"
-                
-                # Show confirmation message (won't close the app)
-                self.gui.ErrorMes(msg, 'Download Script', style=wx.OK)
-            except Exception as e:
-                self.gui.ErrorMes(f"Error creating download script: {str(e)}",
-                                'Download Script Error', style=wx.OK|wx.ICON_ERROR)
+            self._download_missing_files()
         else:
             # Show the log with error messages
             self.gui.log.show(self.gui)
             
         return False
+
+    def _download_missing_files(self):
+        """
+        Download the missing files on a background thread, reporting progress
+        in the status bar. The files are read & the orbital subtraction is
+        done for each detector as soon as its files are present, while the
+        rest are still downloading (OrbSub.stream_orbsub).
+        """
+        missingFiles = self.orbsub.files.missingFiles
+        gui = self.gui
+        gui.UpdateStatusBar('Downloading missing data files...')
+
+        def fetch(progress):
+            def report(done, total, name, ok):
+                progress(done, total, name, ok)
+                wx.CallAfter(gui.UpdateStatusBar, 'Downloading missing data files: %i/%i' %(done, total))
+            return lib.getData.download_missing(missingFiles, self.opts.spec_type, self.opts.data_dir,
+                                                progress = report, cache = lib.getData.ListingCache())
+
+        def download():
+            try:
+                isValid, downloaded, failed = self.orbsub.stream_orbsub(fetch)
+            except Exception as e:
+                isValid, downloaded, failed = False, [], ['Download failed: %s' %e]
+            wx.CallAfter(self._missing_files_downloaded, isValid, downloaded, failed)
+
+        threading.Thread(target = download, daemon = True).start()
+
+    def _missing_files_downloaded(self, isValid, downloaded, failed):
+        """Carry on with the analysis once the download thread is done."""
+        mes = '<Begin Download>\n'
+        mes += 'Downloaded %i files\n' %len(downloaded)
+        for name in failed:
+            mes += '*** Not downloaded: %s\n' %name
+        mes += '<End Download>\n\n'
+        self.gui.log.update(mes)
+        if failed:
+            self.gui.UpdateStatusBar('Download of %i files failed' %len(failed))
+            self.gui.ErrorMes('Some data files could not be downloaded. Please consult the log for full details',
+                            'Download failed')
+            self.gui.log.show(self.gui)
+            return
+        self.gui.UpdateStatusBar('Downloaded %i files' %len(downloaded))
+        try:
+            # Carry on from the period recalculation. If that changes the
+            # regions the files are found again, and the subtraction is
+            # redone from the data already read.
+            period = self.orbsub.period
+            if self.opts.reCalcOrbit and not self._recalculate_orbit():
+                return
+            if self.orbsub.files.error:
+                return self._handle_missing_files()
+            if self.opts.doGeom and not self._calculate_geometry():
+                return
+            if self.orbsub.period != period:
+                isValid = self._perform_orbital_subtraction()
+            elif not isValid:
+                self.gui.log.update(self.orbsub.orbErrMes)
+                self.gui.ErrorMes('Orbital Subtraction ran into trouble. Please consult the log for full details',
+                                'Orbital Subtraction failed')
+                self.gui.log.show(self.gui)
+            if isValid:
+                self.gui.log.update(str(self.orbsub.instrument))
+                self.gui.InitData(self.orbsub)
+        finally:
+            if not self.orbsub.keepReads:
+                self.orbsub.reads.clear()
         
     def _recalculate_orbit(self):
         """Recalculate orbit period if requested."""
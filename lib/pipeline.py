@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+'''
+Headless orbital subtraction: find_files -> calc_period -> get_gti/get_steps
+-> do_orbsub -> output products, with no wx or matplotlib import, for
+running on machines without a display. The dialogs of the GUI are replaced
+by an exit code & a JSON summary of the run.
+
+    python osv.py run 612345678.9 --CSPEC --dets 0 1 --out-dir out --summary -
+    python -m lib.pipeline 612345678.9 --coords 120.5 -30.2
+
+Exit codes:
+    0 OK          products written
+    1 OPTIONS     bad options (e.g. tZero outside the mission)
+    2 MISSING     data files missing (and not downloaded)
+    3 PERIOD      recalculation of the orbital period failed
+    4 GEOMETRY    G.T.I. or occultation step calculation failed
+    5 ORBSUB      orbital subtraction failed
+    6 WRITE       writing a product failed
+    7 ERROR       unexpected error
+'''
+
+import os
+import sys
+import json
+import time
+import traceback
+import contextlib
+
+from . import options
+from . import orbsub
+
+OK, OPTIONS, MISSING, PERIOD, GEOMETRY, ORBSUB, WRITE, ERROR = range(8)
+STATUS = ['ok', 'options', 'missing', 'period', 'geometry', 'orbsub', 'write', 'error']
+
+PRODUCTS = ['phaii', 'pha', 'ascii', 'ascii-all']
+
+
+def optionsFromDict(req, dataDir = None):
+    '''
+    OSV_Args from a dictionary such as a JSON request or job: tzero &
+    optionally tRange, offsets, dets (names or indices), specType, coords,
+    name, dataDir & reCalcOrbit. dataDir is used if the dictionary has
+    none. Raises ValueError if it is malformed.
+    '''
+    if 'tzero' not in req:
+        raise ValueError('tzero is required')
+    opts = options.OSV_Args()
+    opts.tzero = float(req['tzero'])
+    if 'tRange' in req:
+        opts.tRange = [float(i) for i in req['tRange']]
+    if 'offsets' in req:
+        opts.offset = [str(i) for i in req['offsets']]
+    else:
+        opts.offset = list(opts.offset)
+    dets = req.get('dets') or opts.DetInd
+    opts.dets = [opts.DetInd[i] if isinstance(i, int) else i for i in dets]
+    if any(i not in opts.DetInd for i in opts.dets):
+        raise ValueError('Unknown detector in %s' %opts.dets)
+    opts.spec_type = req.get('specType', 'CTIME').upper()
+    if req.get('coords'):
+        opts.coords = [float(i) for i in req['coords']]
+        opts.doGeom = True
+    opts.name = req.get('name') or ''
+    opts.data_dir = req.get('dataDir') or dataDir or opts.data_dir
+    opts.reCalcOrbit = req.get('reCalcOrbit', True)
+    return opts
+
+
+def writeProducts(orb, products, outDir, compress = None, max_workers = 4):
+    '''
+    Write the products for every detector into outDir. products is a list
+    taken from PRODUCTS. Returns a dictionary of the file names written by
+    product (& detector).
+    '''
+    os.makedirs(outDir, exist_ok = True)
+    opts = orb.opts
+    dets = sorted(orb.data.keys())
+
+    def stem(det):
+        return os.path.join(outDir, "glg_osv_%s_%s.XX" %(opts.name, det))
+
+    written = {}
+    if 'phaii' in products:
+        names = {}
+        for det in dets:
+            names[det] = orb.data[det].write_phaii(opts, names = [stem(det).replace('.XX', '.PHA'),
+                                                                   stem(det).replace('.XX', '.BAK')],
+                                                   compress = compress)
+        written['phaii'] = names
+    if 'pha' in products:
+        names = {}
+        for det in dets:
+            names[det] = [stem(det).replace('.XX', '.PHA1'), stem(det).replace('.XX', '.BAK1')]
+            orb.data[det].write_pha(opts, names = names[det])
+        written['pha'] = names
+    if 'ascii' in products:
+        names = {}
+        for det in dets:
+            names[det] = [stem(det).replace('.XX', '.src'), stem(det).replace('.XX', '.bkg')]
+            orb.data[det].write_ascii(opts, names = names[det])
+        written['ascii'] = names
+    if 'ascii-all' in products:
+        fileStem = os.path.join(outDir, "glg_osv_%s_all.XX" %(opts.name))
+        written['ascii-all'] = orb.write_ascii_all(names = [fileStem.replace('.XX', '.src'),
+                                                            fileStem.replace('.XX', '.bkg')])
+    return written
+
+
+def runPipeline(opts, outDir = './', products = ['phaii'], compress = None, download = False,
+                cache = None, keep = False):
+    '''
+    Run the orbital subtraction for opts (options.OSV_Args) & write the
+    products. If download is set, missing data files are fetched with
+    getData.download_missing while the data already present is read
+    (OrbSub.stream_orbsub). cache is an optional store of data already
+    read with a load(files) method returning {file: read output}, e.g.
+    service.WarmCache. With keep the OrbSub is returned in the summary
+    as 'orbsub'. Returns a summary dictionary, whose 'exitCode' is one of
+    the codes above; 'timing' has the seconds taken by each stage & 'stages'
+    the wall & CPU time, bytes read & array sizes of each stage & detector
+    (OrbSub.instrument).
+    '''
+    summary = {'exitCode': OK, 'status': STATUS[OK], 'messages': [], 'errors': [], 'timing': {}}
+    t0 = time.time()
+    orb = None
+
+    def finish(code, errMes = ''):
+        summary['exitCode'] = code
+        summary['status'] = STATUS[code]
+        if errMes:
+            summary['errors'].append(errMes)
+        if orb is not None:
+            summary['stages'] = orb.instrument.asDict()
+        summary['seconds'] = time.time() - t0
+        return summary
+
+    @contextlib.contextmanager
+    def stage(name):
+        t = time.time()
+        try:
+            yield
+        finally:
+            summary['timing'][name] = summary['timing'].get(name, 0.) + time.time() - t
+
+    def warm(orb):
+        # Files the cache already holds aren't read again. Called again after
+        # calc_period, which only needs the files of regions it moved
+        if cache is not None and not orb.files.error:
+            with stage('load'):
+                files = list(orb.files.pos_files)
+                for det in opts.dets:
+                    files += orb.files.pha_files[det]
+                files = [i for i in files if i not in orb.reads]
+                if files:
+                    orb.reads.update(cache.load(files))
+
+    try:
+        opts.check()
+        summary['options'] = {'name': opts.name, 'tzero': opts.tzero, 'tRange': list(opts.tRange),
+                              'offset': [str(i) for i in opts.offset], 'specType': opts.spec_type,
+                              'dets': list(opts.dets), 'dataDir': str(opts.data_dir),
+                              'coords': list(opts.coords) if opts.doGeom else None}
+        if opts.warning:
+            summary['messages'].append(opts.warning_mes)
+        if opts.error:
+            return finish(OPTIONS, opts.err_mes)
+
+        orb = orbsub.OrbSub(opts)
+        if keep:
+            summary['orbsub'] = orb
+        with stage('find_files'):
+            orb.find_files()
+        warm(orb)
+        isValid = None
+        if orb.files.error and download:
+            from .ftp import downloadDaily as getData
+            def fetch(progress):
+                return getData.download_missing(orb.files.missingFiles, opts.spec_type, opts.data_dir,
+                                                progress = progress, cache = getData.ListingCache())
+            with stage('download'):
+                isValid, downloaded, failed = orb.stream_orbsub(fetch)
+            summary['downloaded'] = downloaded
+            if failed:
+                summary['missing'] = failed
+                return finish(MISSING, 'Some data files could not be downloaded')
+        elif orb.files.error:
+            summary['missing'] = orb.files.missingFiles
+            return finish(MISSING, orb.files.errMes)
+        summary['files'] = {'pos': [str(i) for i in orb.files.pos_files],
+                            'pha': {det: [str(i) for i in orb.files.pha_files[det]] for det in opts.dets}}
+
+        period = orb.period
+        if opts.reCalcOrbit:
+            with stage('calc_period'):
+                perValid = orb.calc_period()
+            if not perValid:
+                return finish(PERIOD, orb.perErrMes)
+            summary['messages'].append(orb.perMes)
+            if orb.files.error:
+                summary['missing'] = orb.files.missingFiles
+                return finish(MISSING, orb.files.errMes)
+            warm(orb)
+        summary['period'] = orb.period
+
+        if opts.doGeom:
+            with stage('get_gti'):
+                gtiValid = orb.get_gti()
+            if not gtiValid:
+                return finish(GEOMETRY, orb.gtiErrMes)
+            summary['messages'].append(orb.gtiMes)
+            with stage('get_steps'):
+                occValid = orb.get_steps()
+            if not occValid:
+                return finish(GEOMETRY, orb.occErrMes)
+            summary['messages'].append(orb.occMes)
+
+        # Data read while downloading is used unless the period moved the regions
+        if isValid is None or orb.period != period:
+            with stage('do_orbsub'):
+                isValid = orb.do_orbsub()
+        orb.reads.clear()
+        if not isValid:
+            return finish(ORBSUB, orb.orbErrMes)
+
+        try:
+            with stage('write'):
+                summary['products'] = writeProducts(orb, products, outDir, compress = compress)
+        except Exception as e:
+            return finish(WRITE, 'Error writing products: %s' %e)
+    except Exception as e:
+        return finish(ERROR, 'Unexpected error: %s\n%s' %(e, traceback.format_exc()))
+    return finish(OK)
+
+
+def main(argv = None):
+    '''
+    Run from the command line (osv.py run ...). The options are those of
+    the GUI's command line plus the output options below. The summary is
+    written as JSON to --summary ('-' for stdout). Returns the exit code.
+    '''
+    parser = options.cmdLineParser()
+    parser.prog = 'osv.py run'
+    parser.add_argument('--data-dir', help = 'Data directory [default: from the config]')
+    parser.add_argument('--out-dir', help = 'Directory for the products [default: ./]', default = './')
+    parser.add_argument('--products', help = 'Products to write [default: phaii]', nargs = '+',
+                        choices = PRODUCTS, default = ['phaii'])
+    parser.add_argument('--compress', help = 'Compress the PHAII files', choices = ['gzip'])
+    parser.add_argument('--download', help = 'Download missing data files', action = 'store_true')
+    parser.add_argument('--summary', help = "File for the JSON summary, '-' for stdout")
+    opts = options.cmdLineOptions(argv, parser = parser)
+    args = opts.args
+    if args.data_dir:
+        opts.data_dir = args.data_dir
+
+    summary = runPipeline(opts, outDir = args.out_dir, products = args.products,
+                          compress = args.compress, download = args.download)
+    text = json.dumps(summary, indent = 2, default = str)
+    if args.summary == '-':
+        print(text)
+    elif args.summary:
+        with open(args.summary, 'w') as f:
+            f.write(text + '\n')
+    if summary['exitCode'] != OK:
+        sys.stderr.write('osv run failed (%s):\n%s\n' %(summary['status'], '\n'.join(summary['errors'])))
+    return summary['exitCode']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+'''
+Profiling switches for any osv.py command or the GUI, so a slow run can be
+looked at without editing code:
+
+    python osv.py --profile run 612345678.9 --dets 0 1
+    python osv.py --profile=slow.prof --trace-memory 612345678.9
+    python osv.py --trace-memory getdata 220315
+
+--profile runs the command under cProfile & writes the statistics to a
+.prof file (osv_<command>_<time>.prof unless named, for snakeviz, pstats
+etc.) & the top TOP functions of the data handling modules (PROFILED) by
+cumulative time to a .txt file next to it, which is also printed.
+--trace-memory traces allocations with tracemalloc & reports the peak
+memory of each stage of the orbital subtraction (see instrument.py) & of
+the whole command.
+
+cProfile only sees the main thread, so the time spent in the download &
+read threads shows as waiting.
+'''
+
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import tracemalloc
+import contextlib
+
+from . import instrument
+
+TOP = 25
+# The functions reported, matched against the file names by pstats
+PROFILED = r'lib[\\/](util[\\/]util|orbsub_classes|fitsUtil[\\/])'
+
+
+def popFlags(argv):
+    '''
+    Remove the profiling switches from argv (in place), wherever they are.
+    Returns (profile, traceMemory) where profile is False, True or the name
+    of the .prof file.
+    '''
+    profile = traceMemory = False
+    for arg in list(argv[1:]):
+        if arg == '--profile':
+            profile = True
+        elif arg.startswith('--profile='):
+            profile = arg.split('=', 1)[1]
+        elif arg == '--trace-memory':
+            traceMemory = True
+        else:
+            continue
+        argv.remove(arg)
+    return profile, traceMemory
+
+
+def profileReport(prof, fileName, top = TOP):
+    ''' Write the cProfile statistics to fileName & the summary to fileName.txt. Returns the summary '''
+    prof.dump_stats(fileName)
+    out = io.StringIO()
+    stats = pstats.Stats(prof, stream = out)
+    stats.sort_stats('cumulative').print_stats(PROFILED, top)
+    text = 'Profile written to %s\n%s' %(fileName, out.getvalue())
+    with open(os.path.splitext(fileName)[0] + '.txt', 'w') as f:
+        f.write(text)
+    return text
+
+
+def memoryReport(records, peak):
+    ''' Text table of the memory peaks of the stage records & the command (bytes) '''
+    mes = '<Begin Memory>\n'
+    mes += '%-12s %-4s %10s\n' %('stage', 'det', 'peak (MB)')
+    for rec in records:
+        mes += '%-12s %-4s %10.2f\n' %(rec['stage'], rec['det'] or '-', rec['memPeak'] / 1e6)
+    mes += 'Peak traced memory of the command: %.2f MB\n' %(peak / 1e6)
+    mes += '<End Memory>\n'
+    return mes
+
+
+@contextlib.contextmanager
+def profiled(command, profile = False, traceMemory = False, stream = sys.stderr):
+    '''
+    Run the enclosed code with the profiling asked for, reporting on
+    stream when it finishes (even by sys.exit or an exception).
+    '''
+    if not profile and not traceMemory:
+        yield
+        return
+    records, peaks = [], []
+    def observe(rec):
+        # Each stage resets tracemalloc's peak, so the overall one is kept here
+        records.append(rec)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+    if traceMemory:
+        tracemalloc.start()
+        instrument.addObserver(observe)
+    if profile:
+        prof = cProfile.Profile()
+        prof.enable()
+    try:
+        yield
+    finally:
+        if profile:
+            prof.disable()
+            if profile is True:
+                profile = 'osv_%s_%s.prof' %(command, time.strftime('%Y%m%d_%H%M%S'))
+            stream.write(profileReport(prof, profile))
+        if traceMemory:
+            instrument.removeObserver(observe)
+            peak = max(peaks + [tracemalloc.get_traced_memory()[1]])
+            tracemalloc.stop()
+            stream.write(memoryReport(records, peak))
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+'''
+A long running orbital subtraction service (osv.py serve). Starting Python,
+importing astropy & reading the days of data is most of the time taken by
+a single run, so the service keeps the poshist & PHA files it has read in
+memory (WarmCache) and answers JSON requests over HTTP, on localhost or a
+Unix socket:
+
+    POST /orbsub   {"tzero": 612345678.9, "tRange": [-100, 500], "offsets": [30],
+                    "dets": ["n0", "n1"], "specType": "CTIME", "coords": [120.5, -30.2],
+                    "products": ["phaii"], "outDir": "out", "lightcurves": false}
+    GET  /status   cache & request counts
+
+Only tzero is required, the rest default as for osv.py run. The response is
+the pipeline summary (see pipeline.runPipeline) with the time taken by each
+stage, the cache hits & misses, and the light curves summed over channels
+if lightcurves is set. Products are only written if products is given. At
+most maxConcurrent requests run at once; others wait up to queueTimeout
+seconds and are then refused with 503.
+
+    python osv.py serve --port 8765
+    curl -d '{"tzero": 612345678.9, "dets": ["n0"]}' localhost:8765/orbsub
+'''
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import socketserver
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+from . import pipeline
+import lib.util.util as util
+
+
+class WarmCache:
+    '''
+    The output of util.read_pha & util.read_poshist for the most recently
+    used maxFiles files, keyed by path. An entry is read again if the file
+    has been modified since. Files missing from the cache are read in
+    parallel, and a file being read for one request isn't read again for
+    another. The arrays are shared between requests, which only read them.
+    '''
+    def __init__(self, maxFiles = 200, max_workers = 4):
+        self.maxFiles = maxFiles
+        self.files = collections.OrderedDict()  # path -> (mtime, read output)
+        self.loading = {}  # path -> Future
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers = max_workers)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def read(path):
+        if os.path.basename(path).startswith('glg_poshist'):
+            return util.read_poshist(path, verbose = False)
+        return util.read_pha(path)
+
+    def _read(self, path, mtime):
+        try:
+            data = self.read(path)
+            with self.lock:
+                self.files[path] = (mtime, data)
+                self.files.move_to_end(path)
+                while len(self.files) > self.maxFiles:
+                    self.files.popitem(last = False)
+            return data
+        finally:
+            with self.lock:
+                self.loading.pop(path, None)
+
+    def load(self, paths):
+        ''' Return {path: read output} for paths '''
+        return self.loadCounted(paths)[0]
+
+    def loadCounted(self, paths):
+        ''' Return ({path: read output}, hits, misses) '''
+        out, futures = {}, {}
+        hits = misses = 0
+        with self.lock:
+            for path in paths:
+                mtime = os.path.getmtime(path)
+                entry = self.files.get(path)
+                if entry is not None and entry[0] == mtime:
+                    self.files.move_to_end(path)
+                    out[path] = entry[1]
+                    hits += 1
+                    continue
+                misses += 1
+                if path not in self.loading:
+                    self.loading[path] = self.executor.submit(self._read, path, mtime)
+                futures[path] = self.loading[path]
+            self.hits += hits
+            self.misses += misses
+        for path, future in futures.items():
+            out[path] = future.result()
+        return out, hits, misses
+
+    def status(self):
+        with self.lock:
+            return {'files': len(self.files), 'maxFiles': self.maxFiles, 'hits': self.hits,
+                    'misses': self.misses}
+
+
+class _RequestCache:
+    ''' A WarmCache as seen by one request, counting its hits & misses '''
+    def __init__(self, cache):
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, paths):
+        out, hits, misses = self.cache.loadCounted(paths)
+        self.hits += hits
+        self.misses += misses
+        return out
+
+
+class OrbSubService:
+    '''
+    Runs requests through the pipeline with a shared WarmCache. dataDir &
+    outDir are the defaults for requests which don't give them.
+    '''
+    def __init__(self, maxFiles = 200, maxConcurrent = 2, queueTimeout = 60., dataDir = None,
+                 outDir = './'):
+        self.cache = WarmCache(maxFiles)
+        self.slots = threading.BoundedSemaphore(maxConcurrent)
+        self.maxConcurrent = maxConcurrent
+        self.queueTimeout = queueTimeout
+        self.dataDir = dataDir
+        self.outDir = outDir
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.active = 0
+        self.served = 0
+        self.refused = 0
+
+    def run(self, req):
+        ''' Answer a request, returning (HTTP status, response dictionary) '''
+        t0 = time.time()
+        if not self.slots.acquire(timeout = self.queueTimeout):
+            with self.lock:
+                self.refused += 1
+            return 503, {'status': 'busy', 'errors': ['Too many requests, try again later']}
+        try:
+            with self.lock:
+                self.active += 1
+            waited = time.time() - t0
+            try:
+                opts = pipeline.optionsFromDict(req, self.dataDir)
+            except (ValueError, TypeError, IndexError) as e:
+                return 400, {'status': 'request', 'errors': ['Bad request: %s' %e]}
+            cache = _RequestCache(self.cache)
+            summary = pipeline.runPipeline(opts, outDir = req.get('outDir', self.outDir),
+                                           products = req.get('products', []), cache = cache, keep = True)
+            orb = summary.pop('orbsub', None)
+            if req.get('lightcurves') and summary['exitCode'] == pipeline.OK:
+                summary['lightcurves'] = lightCurves(orb)
+            summary['timing']['queue'] = waited
+            summary['cache'] = {'hits': cache.hits, 'misses': cache.misses}
+            return 200, summary
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.served += 1
+            self.slots.release()
+
+    def status(self):
+        with self.lock:
+            return {'uptime': time.time() - self.started, 'active': self.active, 'served': self.served,
+                    'refused': self.refused, 'maxConcurrent': self.maxConcurrent,
+                    'cache': self.cache.status()}
+
+
+def lightCurves(orb):
+    ''' Source & background light curves of each detector, summed over channels '''
+    out = {}
+    for det, data in orb.data.items():
+        t = data.data['src'][0]
+        out[det] = {'tstart': t[:,0].tolist(), 'tstop': t[:,1].tolist(),
+                    'exposure': data.data['src'][2].tolist(),
+                    'src': data.data['src'][1].sum(axis = 1).tolist(),
+                    'bkg': data.background['all'].sum(axis = 1).tolist()}
+    return out
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def reply(self, code, body):
+        data = json.dumps(body, default = str).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.reply(200, self.server.service.status())
+        else:
+            self.reply(404, {'errors': ['Unknown path %s' %self.path]})
+
+    def do_POST(self):
+        if self.path != '/orbsub':
+            self.reply(404, {'errors': ['Unknown path %s' %self.path]})
+            return
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(req, dict):
+                raise ValueError('expected a JSON object')
+        except ValueError as e:
+            self.reply(400, {'status': 'request', 'errors': ['Bad JSON: %s' %e]})
+            return
+        self.reply(*self.server.service.run(req))
+
+    def address_string(self):
+        # client_address is empty for a Unix socket
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def makeServer(service, host = '127.0.0.1', port = 8765, socketPath = None, quiet = False):
+    ''' HTTP server for service, on host:port or the Unix socket socketPath '''
+    if socketPath:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server = _UnixHTTPServer(socketPath, _Handler)
+    else:
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'osv.py serve',
+                                     description = 'Serve orbital subtraction requests, keeping '
+                                                   'recently used data files in memory')
+    parser.add_argument('--host', help = 'Address to listen on [default: 127.0.0.1]', default = '127.0.0.1')
+    parser.add_argument('--port', help = 'Port to listen on [default: 8765]', type = int, default = 8765)
+    parser.add_argument('--socket', help = 'Listen on this Unix socket instead')
+    parser.add_argument('--data-dir', help = 'Data directory [default: from the config]')
+    parser.add_argument('--out-dir', help = 'Directory for products [default: ./]', default = './')
+    parser.add_argument('--max-files', help = 'Data files kept in memory [default: 200]', type = int,
+                        default = 200)
+    parser.add_argument('--max-concurrent', help = 'Requests run at once [default: 2]', type = int,
+                        default = 2)
+    parser.add_argument('--queue-timeout', help = 'Seconds a request waits to run [default: 60]',
+                        type = float, default = 60.)
+    parser.add_argument('--quiet', help = "Don't log requests", action = 'store_true')
+    args = parser.parse_args(argv)
+
+    service = OrbSubService(maxFiles = args.max_files, maxConcurrent = args.max_concurrent,
+                            queueTimeout = args.queue_timeout, dataDir = args.data_dir,
+                            outDir = args.out_dir)
+    server = makeServer(service, args.host, args.port, args.socket, quiet = args.quiet)
+    where = args.socket if args.socket else 'http://%s:%i' %(args.host, args.port)
+    print('OSV service listening on %s' %where)
+    # Shut down cleanly (removing the socket) when killed too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,2 +1,19 @@
-from .util import *
-from .gbmVals import gbmVals
\ No newline at end of file
+'''
+Utilities. The time conversions (timeConv) & gbmVals only need the standard
+library; the rest of util needs numpy, so it is only imported when one of
+its functions is first used.
+'''
+import importlib
+
+from .timeConv import *
+from .gbmVals import gbmVals
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(name)
+    util = importlib.import_module('.util', __name__)
+    try:
+        return getattr(util, name)
+    except AttributeError:
+        raise AttributeError("module %r has no attribute %r" %(__name__, name)) from None
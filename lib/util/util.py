@@ -4,7 +4,10 @@ import os
 import datetime
 
 import numpy as np
-import astropy.io.fits as pf
+
+from .timeConv import mjd_met, met_mjd, good_gbm_met, mjd_greg, met_grb, date_to_met
+# astropy.io.fits is slow to import, so it is imported by the functions
+# which read & write FITS files
 
 def calc_occ_steps(src_ra, src_dec, time, pos):
     '''    
@@ -290,79 +293,10 @@ def counts_spec(counts,e_min,e_max,chan_range=[0,8]):
     #    print spec_exp
     return e_centres,spec,spec_exp
 
-def mjd_met(t):
-    ''' Convert from MJD to Fermi MET '''
-    return (t - (51910+0.00074287037037)) * 86400.0
-
-def met_mjd(t):
-    """Converts from Fermi MET to MJD """
-    return (t /86400.0)+51910+0.00074287037037
-
 def find_nearest(array,value):
     idx=(np.abs(array-value)).argmin()
     return array[idx]
 
-def good_gbm_met(met):
-    '''Ensure that a GBM MET does not extend pre launch or to the Future'''
-    good_time = True
-    #Triggering enable 14 June 08, put min date at this plus 2 days for offset
-    then = datetime.datetime(2008, 6, 16)
-    now = datetime.datetime.now()
-    dif = now - then
-    min_met = 235300000 #2008, 6, 16th, 09:07:44
-    max_met = min_met + dif.total_seconds()
-    if min_met > met or met > max_met:
-        good_time = False
-    return good_time
-
-def mjd_greg(mjd):
-    """Converts an input date from MJD to Gregorian"""
-    jd=mjd+2400000.5+.5
-    Z=int(jd)
-    F=jd-Z
-    if Z < 2299161:
-            A=Z
-    elif Z >= 2299161:
-            alpha = int((Z-1867216.25)/36524.25)
-            A = Z + 1 + alpha - int(alpha/4)
-    B = A + 1524
-    C = int( (B-122.1)/365.25)
-    D = int( 365.25*C )
-    E = int( (B-D)/30.6001 )
-
-    dd = B - D - int(30.6001*E) + F 
-    
-    if E < 13.5:
-            mm = E - 1
-    elif E > 13.5:
-            mm = E - 13
-
-    if mm>2.5:
-            yyyy = C - 4716
-    elif mm<2.5:
-            yyyy = C - 4715
-
-    months=["January", "February", "March", "April", "May", "June", "July", "August", 
-            "September", "October", "November", "December"]
-    daylist=[31,28,31,30,31,30,31,31,30,31,30,31]
-    daylist2=[31,29,31,30,31,30,31,31,30,31,30,31]
-
-    h=int((dd-int(dd))*24)
-    min=int((((dd-int(dd))*24)-h)*60)
-    sec=86400*(dd-int(dd))-h*3600-min*60
-
-    # Now calculate the fractional year. Do we have a leap year?
-    if (yyyy%4 != 0):
-            days=daylist2
-    elif (yyyy%400 == 0):
-            days=daylist2
-    elif (yyyy%100 == 0):
-            days=daylist
-    else:
-            days=daylist2              
-    greg=[yyyy,mm,int(math.floor(dd)),h,min,sec]   
-    return greg
-
 def date_interpolate(start,end):
     """Interpolate between two input dates 
 
@@ -441,6 +375,7 @@ def read_poshist(pos_file, verbose = True):
     lon set to zero or the fields are missing altogheter. This should be caught
     by the try except block in place.
     '''
+    import astropy.io.fits as pf
     dtorad=180./math.acos(-1.)
     data=pf.getdata(pos_file,ext=1)
     nt=np.size(data)
@@ -503,6 +438,7 @@ def read_pha(pha_file, gti = False, qualMask = True, tOffset = True,):
     13.01.10: Fixed a bug where gtis where calculated between time rather
     than time & endtime.
     """
+    import astropy.io.fits as pf
     data = pf.open(pha_file)
     gtis = np.array((data[3].data.START,data[3].data.STOP)) 
     qual = data[2].data['QUALITY']
@@ -683,6 +619,7 @@ def write_aux(test,pointing,filename="aux_file.fits"):
     
     Needs work: currently doesnt include any useful header information
     '''
+    import astropy.io.fits as pf
     col1=pf.Column(name='Neg_Point',format='1E',array=pointing[0] ,unit='degree' )
     col2=pf.Column(name='Point',format='1E',array=pointing[1] ,unit='degree')
     col3=pf.Column(name='Pos_Point',format='1E',array=pointing[2] ,unit='degree')
@@ -718,65 +655,3 @@ def get_plot_limits(x1,y1,x2,y2):
 
     return xmin,xmax,ymin,ymax
 
-def met_grb(tzero, day = False):
-    '''
-    Take in a time in GBM MET and return name in GRB format
-    
-    Added 12.12.11 from orsub.py, also added day keyword, this will cause only
-    day part of string to be returned.
-    '''
-    greg = mjd_greg(met_mjd(tzero))
-    yr = str(greg[0])[2:]
-    if len(str(greg[1])) == 1:
-        mt = '0' + str(greg[1])
-    else:
-        mt = str(greg[1])
-    if len(str(greg[2])) == 1:
-        dd = '0' + str(greg[2])
-    else:
-        dd = str(greg[2])
-    ttt = str((greg[3]*3600+greg[4]*60+greg[5])/86400)[2:5]
-    if day:
-        name = yr + mt + dd    
-    else:
-        name = yr + mt + dd + ttt
-    return name
-
-def date_to_met(date):
-    '''
-    Convert a date to Fermi MET
-    
-    Accepted formats:
-    - YYYY-MM-DD
-    - YYYY-MM-DD hh:mm
-    - YYYY-MM-DD hh:mm:ss
-    - YYYY-MM-DD hh:mm:ss.f
-    
-    Missing time components default to 0
-    '''
-    data_start = "2001:01:01 00:00:00"  # start of MET
-    data_end = date
-    
-    date_start = datetime.datetime.strptime(data_start, '%Y:%m:%d %H:%M:%S')
-    
-    # Try different formats based on the input
-    formats = [
-        '%Y-%m-%d',
-        '%Y-%m-%d %H:%M',
-        '%Y-%m-%d %H:%M:%S',
-        '%Y-%m-%d %H:%M:%S.%f'
-    ]
-    
-    for fmt in formats:
-        try:
-            date_end = datetime.datetime.strptime(data_end, fmt)
-            break
-        except ValueError:
-            continue
-    else:
-        raise ValueError(f"Date '{date}' doesn't match any of the accepted formats: YYYY-MM-DD, YYYY-MM-DD hh:mm, YYYY-MM-DD hh:mm:ss, YYYY-MM-DD hh:mm:ss.f")
-    
-    # Calculate the difference in seconds
-    delta = date_end - date_start
-    
-    return delta.total_seconds()
@@ -2,83 +2,33 @@
 """OSV Application - Orbital Subtraction Tool"""
 
 import sys
-import time
-from pathlib import Path
 
-import wx
-
-import lib
-import lib.osv_classes as osv_classes
-import lib.gui_classes as gui_classes
-import lib.dep_ver_checker as setup
+# Modules are imported by the commands which need them, so the utility
+# commands start quickly & only the GUI imports wx & matplotlib
 
 __version__ = "1.3"
 
-class OSV(wx.App):
-    """Main OSV Application class"""
-
-    def OnInit(self,):
-        return True
-    
-    def OnLaunch(self, opts = None):
-        """Launch application with optional command line options""" 
-        if opts is None:
-            self.OnNew()
-        else:
-            self.createInstance(opts)
-        return True        
-    
-    def OnNew(self):
-        """Show options dialog and create instance"""
-        with osv_classes.OptDialog(None, False, title="OSV Options") as dlg:
-            if dlg.ShowModal() != wx.ID_OK:
-                return
-                
-            self.opts = dlg.opts
-            self.opts.check()
-            
-            if self.opts.error:
-                self._show_dialog(self.opts.err_mes)
-                return
-            elif self.opts.warnAll and self.opts.warning:
-                self._show_dialog(self.opts.warning_mes, title='Warnings')
-                
-            self.createInstance(dlg.opts)
-    
-    def createInstance(self, opts):
-        ''' 
-        Create instance of OSV GUI & run with given options
-        '''
-        timestamp = time.strftime("%H:%M:%S", time.gmtime())   
-        inst = osv_classes.OSV_Instance(opts)
-        title = '%s @ %s' %(inst.opts.name, timestamp)
-        
-        inst.gui = gui_classes.OrbsubGUI(
-            None, -1, 
-            title = title,
-             plotDimensions = (2,1,)
-        )
-        inst.gui.log.update(str(opts)) 
-        inst.runOrbSub()
-        return inst #add a return, shouldn't break anything 
-
-    def _show_dialog(self, message, title='Error encountered'):
-        """Show message dialog"""
-        wx.MessageBox(message, title, style=wx.OK | wx.ICON_ERROR)
+def _setup():
+    import lib.dep_ver_checker as setup
+    return setup
 
-    # Alias for backward compatibility
-    DialogBox = _show_dialog
+def _getData():
+    from lib.ftp import downloadDaily
+    return downloadDaily
 
 class CommandHandler:
     """Handle command line operations"""
     
     COMMANDS = {
-        'doconfig'  : setup.doConfig,
-        'getdata'   : lambda: lib.getData.main(argv=sys.argv[2:]),
-        'checkdeps' : setup.doCheckDeps,
-        'checkvers' : setup.doCheckVersions,
-        'getconfig' : lambda: setup.getConfig(printflag=True),
+        'doconfig'  : lambda: _setup().doConfig(),
+        'getdata'   : lambda: _getData().main(argv=sys.argv[2:]),
+        'checkdeps' : lambda: _setup().doCheckDeps(),
+        'checkvers' : lambda: _setup().doCheckVersions(),
+        'getconfig' : lambda: _setup().getConfig(printflag=True),
         'convert'   : '_handle_convert',
+        'run'       : '_handle_run',
+        'serve'     : '_handle_serve',
+        'jobs'      : '_handle_jobs',
         'ver'       : lambda: print(f"osv v{__version__}"),
         'version'   : lambda: print(f"osv v{__version__}")
     }
@@ -97,20 +47,38 @@ class CommandHandler:
             return
             
         try:
-            from lib.util.util import date_to_met
+            from lib.util.timeConv import date_to_met
             met = date_to_met(args[1])
             print(f"Date: {args[1]}")
             print(f"Fermi MET: {met}")
         except ValueError as e:
             print(f"Error: {e}")
     
+    @staticmethod
+    def _handle_run():
+        """Run the orbital subtraction headless, exiting with its exit code"""
+        from lib.pipeline import main as runPipeline
+        sys.exit(runPipeline(sys.argv[2:]))
+
+    @staticmethod
+    def _handle_serve():
+        """Serve orbital subtraction requests, keeping data files in memory"""
+        from lib.service import main as serve
+        sys.exit(serve(sys.argv[2:]))
+
+    @staticmethod
+    def _handle_jobs():
+        """Queue & run orbital subtraction jobs for many triggers"""
+        from lib.jobs import main as jobs
+        sys.exit(jobs(sys.argv[2:]))
+    
     @classmethod
     def handle(cls, command):
         """Execute command if it exists"""
         command_lower = command.lower()
         
-        # Handle version commands
-        if "ver" in command_lower:
+        # Handle version commands (ver, version, --version...)
+        if command_lower.lstrip('-').startswith("ver"):
             command_lower = "ver"
             
         if command_lower in cls.COMMANDS:
@@ -124,16 +92,31 @@ class CommandHandler:
 
 def main():
     """Main entry point"""
+    # Only imported when asked for, to keep the start up quick
+    if any(arg.startswith(('--profile', '--trace-memory')) for arg in sys.argv[1:]):
+        from lib.profiling import popFlags, profiled
+        profile, traceMemory = popFlags(sys.argv)
+        command = sys.argv[1].lower() if len(sys.argv) > 1 else ''
+        command = command if command in CommandHandler.COMMANDS else 'gui'
+        with profiled(command, profile, traceMemory):
+            run()
+    else:
+        run()
+
+def run():
+    """Run the command or the GUI given by sys.argv"""
     args = sys.argv[1:]
     
     if args:
         if CommandHandler.handle(args[0]):
             return
         # If not a recognized command, treat as options
-        opts = lib.options.cmdLineOptions()
+        from lib.options import cmdLineOptions
+        opts = cmdLineOptions()
     else:
         opts = None
 
+    from lib.osv_classes import OSV
     app = OSV(False)
     app.OnLaunch(opts)
     app.MainLoop()